@@ -0,0 +1,262 @@
+"""
+Version 1.0,
+Micro-benchmarks of the ladderpath engine and of the peptide generation.
+
+Times lp.ladderpath, gp.getLadderonAddress, gp.getPipPoolBook and gp.genNewPips
+on synthetic pools of 8 to 10,000 amino-acid sequences of length 15 to 40, and
+measures the peak memory of each call: by default the growth of the resident
+set (Linux, the high-water mark is reset through /proc/self/clear_refs before
+the call), or the peak of the Python allocations with --memory tracemalloc,
+which is exact but slows the ladderpath engine down about five times; the
+tracemalloc run is then an extra call. Every case runs in its own process and is stopped after --max-seconds; larger pools of the same
+function and length are then skipped, since the ladderpath engine does not
+scale linearly with the pool size.
+
+Results are written as JSON. Times are also divided by the time of a fixed
+pure-Python calibration loop, so that a baseline stored on one machine can be
+compared with a run on another one:
+
+    python benchmarks/benchGeneration.py --output bench.json --compare benchmarks/baseline.json
+
+The exit status is 1 when a case is slower or uses more memory than the
+baseline by more than --tolerance.
+"""
+
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+import multiprocessing as mp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pephire_supply import ladderpath as lp
+from pephire_supply import genPeptides as gp
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+FUNCTIONS = ['ladderpath', 'getLadderonAddress', 'getPipPoolBook', 'genNewPips']
+SIZES = [8, 100, 1000, 10000]
+LENGTHS = [15, 21, 40]
+
+def synthetic_pool(size, length, n_families=8, seed=0):
+    """
+    Build a pool of distinct sequences made of point mutants of a few random
+    parent sequences, like the families of BH3 peptides used as pipPool0.
+
+    Args:
+    size (int): Number of sequences.
+    length (int): Length of every sequence.
+    n_families (int): Number of parent sequences.
+    seed (int): Seed of the random generator.
+
+    Returns:
+    list: A list of distinct sequences.
+    """
+    rng = random.Random(f'{seed}-{size}-{length}')
+    parents = [''.join(rng.choice(AMINO_ACIDS) for _ in range(length)) for _ in range(n_families)]
+    pool, seen = [], set()
+    while len(pool) < size:
+        peptide = list(parents[len(pool) % n_families])
+        for _ in range(max(1, length // 5)):
+            peptide[rng.randrange(length)] = rng.choice(AMINO_ACIDS)
+        peptide = ''.join(peptide)
+        if peptide not in seen:
+            seen.add(peptide)
+            pool.append(peptide)
+    return pool
+
+def calibrate(repeat=7):
+    # Time of a fixed pure-Python workload (string and dict operations, like the ladderpath engine),
+    # used to compare results across machines
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        counts = {}
+        for k in range(1000000):
+            key = AMINO_ACIDS[k % 20] + AMINO_ACIDS[(k * 7) % 20]
+            counts[key] = counts.get(key, 0) + 1
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def rss_kb(field):
+    # VmRSS or VmHWM of this process in kB, None where /proc is not available
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+def reset_peak_rss():
+    # Reset VmHWM to the current resident set size (Linux 4.0+)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def prepare(function, pool, limit, n_new):
+    # Inputs of the benchmarked call, computed outside of the timed region
+    if function == 'ladderpath':
+        return lambda: lp.ladderpath(pool, CalPOM=True)
+    if function == 'getLadderonAddress':
+        strs_lp = lp.ladderpath(pool, CalPOM=True)
+        return lambda: gp.getLadderonAddress(pool, strs_lp, limitLadderonSize=limit)
+    if function == 'getPipPoolBook':
+        return lambda: gp.getPipPoolBook(pool, limitLadderonSize=limit)
+    if function == 'genNewPips':
+        PipPoolBook = gp.getPipPoolBook(pool, limitLadderonSize=limit)
+        return lambda: gp.genNewPips(PipPoolBook, pool, N=n_new, noRepetition=True)
+    raise ValueError(f'Unknown function {function}')
+
+def run_case(function, size, length, options, queue):
+    """
+    Time one function on one synthetic pool and put the result into a queue (run in a child process).
+    The call is repeated up to options['repeat'] times while it takes less than a second; the best time is kept.
+    """
+    random.seed(0)
+    pool = synthetic_pool(size, length, seed=options['seed'])
+    limit = None if options['limitSize'] is None else int(options['limitSize'] * length)
+    call = prepare(function, pool, limit, options['n_new'])
+
+    peak = None
+    rss0 = rss_kb('VmRSS')
+    reset = options['memory'] == 'rss' and rss0 is not None and reset_peak_rss()
+    times = []
+    while len(times) < options['repeat'] and sum(times) < 1.0:
+        t0 = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - t0)
+        if reset and len(times) == 1:
+            peak = (rss_kb('VmHWM') - rss0) * 1024
+
+    if options['memory'] == 'tracemalloc':
+        tracemalloc.start()
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    queue.put({'seconds': min(times), 'repeats': len(times), 'peak_bytes': peak, 'memory': options['memory']})
+
+def run_benchmarks(functions, sizes, lengths, options):
+    """
+    Run every (function, length, size) case in a child process, with a timeout.
+
+    Returns:
+    list: One result dict per case.
+    """
+    results = []
+    ctx = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else mp.get_context()
+    for function in functions:
+        for length in lengths:
+            timed_out = False
+            for size in sorted(sizes):
+                result = {'function': function, 'size': size, 'length': length}
+                if timed_out:
+                    result['status'] = 'skipped'
+                    results.append(result)
+                    continue
+                queue = ctx.Queue()
+                process = ctx.Process(target=run_case, args=(function, size, length, options, queue))
+                process.start()
+                try:
+                    result.update(queue.get(timeout=options['max_seconds']))
+                    result['status'] = 'ok'
+                except Exception:  # queue.Empty on timeout, or the child died
+                    result['status'] = 'timeout' if process.is_alive() else 'error'
+                    timed_out = True
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+                results.append(result)
+                print(format_result(result), flush=True)
+    return results
+
+def format_result(result):
+    line = f"{result['function']:<20}{result['size']:>7}{result['length']:>5}  "
+    if result['status'] != 'ok':
+        return line + result['status']
+    line += f"{result['seconds']:>10.4f} s"
+    if result.get('peak_bytes') is not None:
+        line += f"{result['peak_bytes'] / 2**20:>10.2f} MiB"
+    return line
+
+def compare(report, baseline, tolerance, min_seconds=0.05, min_bytes=2**20):
+    """
+    Compare a report with a baseline report.
+    Times are compared after division by the calibration time of each report;
+    cases faster than min_seconds or using less than min_bytes in both reports are too noisy to compare.
+
+    Returns:
+    list: Descriptions of the regressions.
+    """
+    scale = report['calibration'] / baseline['calibration']
+    reference = {(r['function'], r['size'], r['length']): r for r in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        key = (result['function'], result['size'], result['length'])
+        base = reference.get(key)
+        if base is None or base['status'] != 'ok':
+            continue
+        name = '{} size={} length={}'.format(*key)
+        if result['status'] != 'ok':
+            regressions.append(f"{name}: {result['status']} (baseline {base['seconds']:.4f} s)")
+            continue
+        expected = base['seconds'] * scale
+        if max(result['seconds'], expected) >= min_seconds and result['seconds'] > expected * (1 + tolerance):
+            regressions.append(f"{name}: {result['seconds']:.4f} s, expected {expected:.4f} s "
+                               f"(x{result['seconds'] / expected:.2f})")
+        # Resident set growth is rounded to pages and allocator arenas, small values are not comparable
+        if (result.get('peak_bytes') and base.get('peak_bytes') and result.get('memory') == base.get('memory')
+                and max(result['peak_bytes'], base['peak_bytes']) >= min_bytes
+                and result['peak_bytes'] > base['peak_bytes'] * (1 + tolerance)):
+            regressions.append(f"{name}: peak memory {result['peak_bytes'] / 2**20:.2f} MiB, "
+                               f"baseline {base['peak_bytes'] / 2**20:.2f} MiB")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of ladderpath and of the peptide generation.')
+    parser.add_argument('--functions', nargs='+', default=FUNCTIONS, choices=FUNCTIONS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    parser.add_argument('--lengths', nargs='+', type=int, default=LENGTHS)
+    parser.add_argument('--limitSize', type=float, default=0.5, help='as in parameters.txt; 0 for no limit')
+    parser.add_argument('--n-new', type=int, default=100, help='peptides generated by genNewPips')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-seconds', type=float, default=60.0, help='timeout of one case')
+    parser.add_argument('--memory', default='rss', choices=['rss', 'tracemalloc', 'none'],
+                        help='peak memory measurement, see the module docstring')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--compare', help='baseline JSON file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative slowdown or memory increase')
+    args = parser.parse_args(argv)
+
+    options = {'limitSize': args.limitSize or None, 'n_new': args.n_new, 'repeat': args.repeat,
+               'max_seconds': args.max_seconds, 'memory': args.memory, 'seed': args.seed}
+    report = {'python': platform.python_version(), 'platform': platform.platform(),
+              'calibration': calibrate(), 'options': options}
+    report['results'] = run_benchmarks(args.functions, args.sizes, args.lengths, options)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            return 1
+        print(f'No regression against {args.compare}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
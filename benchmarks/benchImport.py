@@ -0,0 +1,77 @@
+"""
+Version 1.0,
+Import-time benchmark of the pipeline modules and of the pephire.py command line.
+
+Every case runs in a fresh interpreter (no module cached in memory), repeated
+--repeat times; the best time minus the startup time of a bare interpreter is
+compared with --target-ms. The modules each case loads are also checked:
+pandas and graphviz must not be imported by the pipeline modules, which only
+need them for the laddergraph and omega0 utilities of ladderpath.
+
+    python benchmarks/benchImport.py --target-ms 250
+
+The exit status is 1 when a case is over the target or imports a forbidden module.
+"""
+
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ['genPeptides', 'ladderpath', 'psipredHelix', 'hdockScore', 'jobQueue', 'asyncPipeline', 'hitSelection']
+FORBIDDEN = ['pandas', 'graphviz']
+
+def cold_time(code, repeat):
+    """
+    Best wall time of `python -c code` in a fresh interpreter, and the heavy modules it imported.
+    """
+    check = f"\nimport sys, json\nprint(json.dumps([m for m in {FORBIDDEN!r} if m in sys.modules]))"
+    best, loaded = None, []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code + check], cwd=ROOT, capture_output=True, text=True, check=True)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+        loaded = json.loads(output.stdout.strip().splitlines()[-1])
+    return best, loaded
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cold import time of the pipeline modules.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--target-ms', type=float, default=250.0, help='maximum import time above a bare interpreter')
+    parser.add_argument('--output', help='JSON file for the results')
+    args = parser.parse_args(argv)
+
+    baseline, _ = cold_time('pass', args.repeat)
+    cases = {module: f'from pephire_supply import {module}' for module in MODULES}
+    # The command line without arguments imports everything pephire.py needs, then prints its usage
+    cases['pephire.py'] = ("import sys, runpy\nsys.argv = ['pephire.py']\n"
+                           "try:\n    runpy.run_path('pephire.py', run_name='__main__')\nexcept SystemExit:\n    pass")
+
+    results, failures = [], []
+    for name, code in cases.items():
+        seconds, loaded = cold_time(code, args.repeat)
+        milliseconds = (seconds - baseline) * 1000
+        results.append({'case': name, 'ms': milliseconds, 'forbidden': loaded})
+        status = 'ok'
+        if milliseconds > args.target_ms:
+            status = 'SLOW'
+            failures.append(f'{name}: {milliseconds:.0f} ms > {args.target_ms:.0f} ms')
+        if loaded:
+            status = 'FORBIDDEN'
+            failures.append(f"{name} imports {', '.join(loaded)}")
+        print(f'{name:<16}{milliseconds:>8.0f} ms  {status}', flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'baseline_ms': baseline * 1000, 'target_ms': args.target_ms, 'results': results}, f, indent=1)
+    for failure in failures:
+        print('FAIL', failure)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
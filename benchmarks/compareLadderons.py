@@ -0,0 +1,123 @@
+"""
+Version 1.0,
+Comparison of the approximate ladderon engine (ladderonSketch) with the exact ladderpath engine.
+
+On synthetic pools small enough for lp.ladderpath, builds the pip pool book
+with gp.getPipPoolBook and with gp.getPipPoolBook(sketch=...), with the
+sketch and with exact k-mer counts (epsilon = 0), and reports:
+    - the time of each engine,
+    - the Jaccard index of the sets of ladderons longer than one letter,
+    - the total variation distance between the normalised listProb of the
+      two books, and between their probability mass per ladderon length,
+    - the largest difference between the multiplicities from the sketch and
+      from exact counts, with the error bound epsilon * T_k,
+    - the mean identity of generated peptides to their closest pool sequence.
+
+    python benchmarks/compareLadderons.py --sizes 8 50 100 --output compare.json
+"""
+
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pephire_supply import genPeptides as gp
+from pephire_supply import ladderonSketch as ls
+from benchGeneration import synthetic_pool
+
+def distribution(keys, weights):
+    total = sum(weights)
+    result = {}
+    for key, weight in zip(keys, weights):
+        result[key] = result.get(key, 0.0) + weight / total
+    return result
+
+def total_variation(p, q):
+    return 0.5 * sum(abs(p.get(key, 0.0) - q.get(key, 0.0)) for key in set(p) | set(q))
+
+def identity_to_pool(peptides, pool):
+    # Mean fraction of positions equal to the closest sequence of the pool
+    identities = []
+    for peptide in peptides:
+        identities.append(max(sum(a == b for a, b in zip(peptide, str0)) / len(peptide) for str0 in pool))
+    return sum(identities) / len(identities) if identities else None
+
+def compare_pool(pool, limit, sketch, n_new, seed):
+    """
+    Compare the exact and approximate books of one pool.
+
+    Returns:
+    dict: The metrics described in the module docstring.
+    """
+    t0 = time.perf_counter()
+    exact = gp.getPipPoolBook(pool, limitLadderonSize=limit)
+    t_exact = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    approx = gp.getPipPoolBook(pool, limitLadderonSize=limit, sketch=sketch)
+    t_approx = time.perf_counter() - t0
+
+    # Sketch against exact counts: the part of the difference due to the count-min sketch
+    counted = ls.sketchLadderons(pool, limit, **dict(sketch, epsilon=0))
+    sketched = ls.sketchLadderons(pool, limit, **sketch)
+    multi_counted = dict(zip(counted[0], counted[1]))
+    multi_sketched = dict(zip(sketched[0], sketched[1]))
+    count_error = max([abs(multi_sketched.get(key, 0) - multi_counted.get(key, 0))
+                       for key in set(multi_counted) | set(multi_sketched)] or [0])
+
+    long_exact = {ladderon for ladderon in exact[1] if len(ladderon) > 1}
+    long_approx = {ladderon for ladderon in approx[1] if len(ladderon) > 1}
+    union = long_exact | long_approx
+
+    random.seed(seed)
+    new_exact = gp.genNewPips(exact, pool, N=n_new, noRepetition=True)
+    random.seed(seed)
+    new_approx = gp.genNewPips(approx, pool, N=n_new, noRepetition=True)
+
+    return {'seconds_exact': t_exact, 'seconds_approx': t_approx,
+            'ladderons_exact': len(exact[1]), 'ladderons_approx': len(approx[1]),
+            'jaccard': len(long_exact & long_approx) / len(union) if union else 1.0,
+            'tv_prob': total_variation(distribution(exact[1], exact[2]), distribution(approx[1], approx[2])),
+            'tv_length': total_variation(distribution([len(x) for x in exact[1]], exact[2]),
+                                         distribution([len(x) for x in approx[1]], approx[2])),
+            'sketch_multiplicity_error': count_error, 'error_bound': max(sketched[3].values() or [0.0]),
+            'identity_exact': identity_to_pool(new_exact, pool), 'identity_approx': identity_to_pool(new_approx, pool)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the approximate ladderon engine with the exact one.')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[8, 50, 100])
+    parser.add_argument('--lengths', nargs='+', type=int, default=[15, 21])
+    parser.add_argument('--limitSize', type=float, default=0.5, help='as in parameters.txt; 0 for no limit')
+    parser.add_argument('--epsilon', type=float, default=1e-5)
+    parser.add_argument('--delta', type=float, default=0.02)
+    parser.add_argument('--minSupport', type=int, default=2)
+    parser.add_argument('--n-new', type=int, default=100, help='peptides generated with each book')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file for the results')
+    args = parser.parse_args(argv)
+
+    sketch = {'epsilon': args.epsilon, 'delta': args.delta, 'minSupport': args.minSupport}
+    results = []
+    print(f"{'size':>6}{'len':>5}{'exact s':>10}{'approx s':>10}{'jaccard':>9}{'TV prob':>9}{'TV len':>8}"
+          f"{'cnt err':>8}{'bound':>8}{'id exact':>9}{'id appr':>9}")
+    for length in args.lengths:
+        for size in args.sizes:
+            pool = synthetic_pool(size, length, seed=args.seed)
+            limit = int(args.limitSize * length) if args.limitSize else None
+            result = {'size': size, 'length': length, **compare_pool(pool, limit, sketch, args.n_new, args.seed)}
+            results.append(result)
+            print(f"{size:>6}{length:>5}{result['seconds_exact']:>10.3f}{result['seconds_approx']:>10.3f}"
+                  f"{result['jaccard']:>9.3f}{result['tv_prob']:>9.3f}{result['tv_length']:>8.3f}"
+                  f"{result['sketch_multiplicity_error']:>8}{result['error_bound']:>8.3f}"
+                  f"{result['identity_exact']:>9.3f}{result['identity_approx']:>9.3f}", flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'options': vars(args), 'results': results}, f, indent=1)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
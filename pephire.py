@@ -4,16 +4,29 @@ written by Lu Peng and Jun Ma, 2023.12.15
 """
 
 
-from pephire_supply import ladderpath as lp
 from pephire_supply import genPeptides as gp
 from pephire_supply import psipredHelix as ph
 from pephire_supply import hdockScore as hs
+from pephire_supply import runDatabase as rd
+from pephire_supply import asyncPipeline as ap
+from pephire_supply import jobQueue as jq
+from pephire_supply import tracing as tr
+from pephire_supply import hitSelection as hsel
+from pephire_supply import sequenceIndex as si
+from pephire_supply import surrogate as sg
+from pephire_supply import toolCache as tc
+from pephire_supply import sweepRunner as sw
+from pephire_supply import speculation as spc
+from pephire_supply import runBudget as rb
 
 import os
 import sys
 import ast
-import glob
-import pandas as pd
+import json
+import uuid
+import random
+import asyncio
+import numpy as np
 
 def read_parameters(file_path):
     """
@@ -58,37 +71,66 @@ def delete_files(suffix):
         if filename.endswith(suffix):
             os.remove(os.path.join(temp_folder, filename))
 
-def select_data(threshold, output_filename):
+def save_checkpoint(checkpoint_file, state, budget=None):
     """
-    Selects peptides with scores below a given threshold from multiple CSV files.
+    Saves the state of the run, with the states of the random generators, to a JSON file.
+    The file is replaced atomically, so an interruption never leaves a broken checkpoint.
 
     Args:
-    threshold (float): The threshold score for selecting peptides.
-
-    Returns:
-    list: List of selected peptides.
+    checkpoint_file (str): Path to the checkpoint file.
+    state (dict): Iteration, completed stages, pools and stage results of the run.
+    budget (RunBudget, optional): Its wall time and tool calls used so far are saved as state['budget'],
+        so that a resumed run goes on with what is left of the budget.
     """
-    output_folder = f'Data_output/{output_filename}_appendix'
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    output_data_path = os.path.join(script_dir, output_folder)
+    state = dict(state)
+    if budget is not None:
+        state['budget'] = budget.state()
+    state['random_state'] = random.getstate()
+    np_state = np.random.get_state()
+    state['np_random_state'] = [np_state[0], np_state[1].tolist()] + list(np_state[2:])
+    with open(checkpoint_file + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(checkpoint_file + '.tmp', checkpoint_file)
 
-    # List all 'peptide_score' CSV files in the output_data folder
-    input_files = [os.path.join(output_data_path, f) for f in os.listdir(output_data_path) if f.startswith('peptide_score') and f.endswith('.csv')]
-    output_file = os.path.join(script_dir, 'Data_output', f'{output_filename}.csv')
+def load_checkpoint(checkpoint_file):
+    """
+    Loads the state of an interrupted run and restores the states of the random generators.
 
-    # Combine data from all input files
-    all_data = pd.concat([pd.read_csv(file) for file in input_files])
-    selected_data = all_data[all_data['score'] < threshold]
-    selected_data.to_csv(output_file, mode='a', header=True, index=False)
+    Args:
+    checkpoint_file (str): Path to the checkpoint file.
 
-    return selected_data['helixpool'].tolist()
+    Returns:
+    dict: The state saved by save_checkpoint.
+    """
+    with open(checkpoint_file) as f:
+        state = json.load(f)
+    version, internal, gauss = state.pop('random_state')
+    random.setstate((version, tuple(internal), gauss))
+    np_state = state.pop('np_random_state')
+    np.random.set_state((np_state[0], np.array(np_state[1], dtype=np.uint32)) + tuple(np_state[2:]))
+    return state
 
 if __name__ == "__main__":
-  if len(sys.argv) != 2:
-    print("Usage: python pephire.py <output_filename>.csv")
+  if len(sys.argv) >= 3 and sys.argv[1] == 'worker':
+    # Worker claiming PSIPRED and docking jobs from a shared job queue (executor = 'queue')
+    lease = float(sys.argv[3]) if len(sys.argv) > 3 else 60.0
+    jq.worker(sys.argv[2], lease=lease)
+    sys.exit(0)
+  if len(sys.argv) >= 3 and sys.argv[1] == 'sweep':
+    # Runs of a grid of parameter sets, see pephire_supply/sweepRunner.py
+    max_parallel = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    sweep_name = os.path.splitext(os.path.basename(sys.argv[2]))[0]
+    sys.exit(sw.run_sweep(read_parameters(sys.argv[2]), sweep_name, max_parallel=max_parallel))
+
+  resume = '--resume' in sys.argv[1:]
+  args = [arg for arg in sys.argv[1:] if arg != '--resume']
+  if len(args) != 1:
+    print("Usage: python pephire.py <output_filename>.csv [--resume]")
+    print("       python pephire.py worker <job_queue> [lease_seconds]")
+    print("       python pephire.py sweep <grid_file> [max_parallel]")
     sys.exit(1)
 
-  output_filename = sys.argv[1].replace('.csv', '')
+  output_filename = args[0].replace('.csv', '')
 
   # if Data_output/{output_filename}_appendix does not exist, create it
   if not os.path.exists(f'Data_output/{output_filename}_appendix'):
@@ -109,38 +151,279 @@ if __name__ == "__main__":
   N_iteration = params['N_iteration']
   threshold = params['threshold']
   limitLadderonSize = params['limitSize'] * len(pipPool0[0])
+  screening = params.get('screening')
+  screening_order = params.get('screening_order')
+  screening_margin = params.get('screening_margin', 0.0)
+  complex_models = params.get('complex_models', 'hits')
+  results_db = params.get('results_db')
+  write_csv = params.get('write_csv', True)
+  pipeline = params.get('pipeline', 'staged')
+  max_jobs = params.get('max_jobs')
+  executor = jq.get_executor(params)
+  trace = params.get('trace', False)
+  artifact_poses = params.get('artifact_poses')
+  artifact_compression = params.get('artifact_compression')
+  artifact_drop_misses = params.get('artifact_drop_misses', False)
+  hits_top_k = params.get('hits_top_k')
+  max_pool = params.get('max_pool')
+  max_pool_best = params.get('max_pool_best')
+  evaluated_db = params.get('evaluated_db')
+  score_feedback = params.get('score_feedback', 0.0)
+  feedback_exploration = params.get('feedback_exploration', 0.2)
+  feedback_history = params.get('feedback_history', 1000)
+  surrogate_model = params.get('surrogate_model')
+  surrogate_explore = params.get('surrogate_explore', 0.25)
+  tool_cache = params.get('tool_cache')
+  ladderon_sketch = params.get('ladderon_sketch')
+  speculate = params.get('speculate', 0)
+  helix_diversity = params.get('helix_diversity', 0.0)
+  docking_coarse = params.get('docking_coarse')
+  docking_fine = params.get('docking_fine')
+  refine_fraction = params.get('refine_fraction', 0.25)
+  budget_seconds = params.get('budget_seconds')
+  budget_hdock = params.get('budget_hdock')
+  budget_psipred = params.get('budget_psipred')
+
+  # The run is checkpointed after each stage; --resume continues from the last completed stage
+  checkpoint_file = f'Data_output/{output_filename}_appendix/checkpoint.json'
+  state = {'iteration': 0, 'stages': [], 'pipPool': list(pipPool0), 'docked_peptides': {}, 'run_id': uuid.uuid4().hex}
+  if resume and os.path.exists(checkpoint_file):
+    state = load_checkpoint(checkpoint_file)
+    print(f"Resuming at iteration {state['iteration']+1}, completed stages: {state['stages']}")
+  elif resume:
+    print(f'No checkpoint found in Data_output/{output_filename}_appendix, starting a new run')
+    resume = False
+
+  store = None
+  if results_db is not None:
+    store = rd.RunDatabase(results_db, output_filename)
+    if not resume:
+      store.clear_run()
+  elif not write_csv:
+    print("write_csv = False requires a results_db in parameters.txt")
+    sys.exit(1)
+
+  # Timings of the stages and of the external tools, see pephire_supply/tracing.py
+  trace_file = f'Data_output/{output_filename}_appendix/trace.jsonl'
+  if trace:
+    if not resume and os.path.exists(trace_file):
+      os.remove(trace_file)
+    tr.enable(trace_file)
+
+  # Peptides below the threshold are collected as the scores of each iteration come in
+  hits = hsel.HitSelector(threshold, [pdb_file[:-4] for pdb_file in pdb_files],
+                          f'Data_output/{output_filename}_appendix/hits_stream.csv', top_k=hits_top_k,
+                          state=state.get('hits'))
+
+  # Peptides evaluated by earlier iterations and runs are not generated again
+  seen = si.SequenceIndex(evaluated_db, output_filename) if evaluated_db is not None else None
+
+  # Surrogate model of the docking scores ranking the helix candidates, trained after every iteration
+  surrogate = None
+  if surrogate_model is not None:
+    if surrogate_model == 'run':
+      surrogate_model = f'Data_output/{output_filename}_appendix/surrogate.npz'
+    surrogate = sg.SurrogateModel.load(surrogate_model) if os.path.exists(surrogate_model) else sg.SurrogateModel()
+
+  # Outputs of PSIPRED, MODPEP and HDOCK kept across iterations and runs
+  cache = tc.ToolCache(tool_cache) if tool_cache is not None else None
 
-  pipPool = pipPool0
-
-  for i in range(N_iteration):
-    # Generate new peptides
-    PipPoolBook = gp.getPipPoolBook(pipPool, limitLadderonSize=limitLadderonSize)
-    peptides = gp.genNewPips(PipPoolBook, pipPool, N=N_newPiptide, noRepetition=True)
-
-    # Helix prediction using PSIPRED
-    ph.run_psipred(peptides, i)
-    delete_files('.ss')
-    delete_files('.ss2')
-    ph.sort_horiz_files(i, output_filename)
-
-    # Docking test
-    helixpool = ph.create_helixpool(i, N_for_docking, output_filename)
-    delete_files('.horiz')
-    delete_files('.fasta')
-    ph.run_psipred(helixpool, i)
-    delete_files('.horiz')
-    delete_files('.ss')
-
-    # Scoring
-    hs.docking_score(i, N_for_docking, pdb_files, output_filename)
-    hs.get_scores(i, output_filename)
-    hs.get_peptide_score(i, output_filename)
-
-    # Update peptide pool
-    dockingPool = hs.create_dockingpool(i, N_putBack, output_filename)
-    unique_dockingPool = set(dockingPool) - set(pipPool)
-    pipPool.extend(list(unique_dockingPool))
+  docked_peptides = state['docked_peptides']  # peptide -> (iteration, index in helixpool), to write the complexes of the hits
+
+  pipPool = state['pipPool']
+  pool_scores = state.get('pool_scores', {})  # Average score of the members of the pool, for the eviction from the pool
+  docked_scores = state.get('docked_scores', {})  # Average score of every docked peptide, for the ladderon feedback
+  speculation = None  # Generation of the next iteration started during the docking, see pephire_supply/speculation.py
+
+  # Limits of the run: the iterations are scaled down to fit, see pephire_supply/runBudget.py
+  budget = None
+  if budget_seconds is not None or budget_hdock is not None or budget_psipred is not None:
+    budget = rb.RunBudget(seconds=budget_seconds, hdock=budget_hdock, psipred=budget_psipred, state=state.get('budget'))
+
+  for i in range(state['iteration'], N_iteration):
+    stages = state['stages']
+    N_new, N_dock = N_newPiptide, N_for_docking
+    if budget is not None:
+      if not stages:
+        sizes = budget.plan(N_newPiptide, N_for_docking, N_iteration - i,
+                            len(pdb_files) * (1 + refine_fraction if docking_coarse is not None else 1))
+        if sizes is None:
+          print(f'Not enough budget left ({budget.summary()}), stopping before iteration {i+1}')
+          break
+        state['sizes'] = sizes
+        budget.start_iteration()
+      N_new, N_dock = state.get('sizes', (N_newPiptide, N_for_docking))
+      print(f'Iteration {i+1}: {N_new} new peptides, {N_dock} docked ({budget.summary()})')
+    if pipeline == 'async' and 'docked' not in stages:
+      # An interrupted asynchronous iteration is restarted from its generation step
+      stages = []
+
+    speculative = None
+    if speculation is not None:
+      # Kept if it was started with the pool the docking put back
+      speculative = speculation.take(pipPool)
+      speculation = None
+
+    if 'generated' not in stages:
+      # Generate new peptides
+      if speculative is None:
+        with tr.span('ladderpath', iteration=i):
+          PipPoolBook = gp.getPipPoolBook(pipPool, limitLadderonSize=limitLadderonSize, scores=docked_scores,
+                                          feedback=score_feedback, exploration=feedback_exploration,
+                                          sketch=ladderon_sketch)
+      if store is not None:
+        store.clear_iteration('pool', i)
+        store.append('pool', [(i, p, 'seed' if p in pipPool0 else 'putback') for p in pipPool])
+    if pipeline == 'async' and 'docked' not in stages:
+      # Generation, helix prediction and docking with overlapping stages
+      for table in ['candidates', 'helix', 'helixpool']:
+        if store is not None:
+          store.clear_iteration(table, i)
+      with tr.span('async iteration', iteration=i):
+        peptides, helixpool, _ = asyncio.run(ap.run_iteration(
+          i, PipPoolBook, pipPool, N_new, N_dock, pdb_files, output_filename,
+          max_jobs=max_jobs, store=store, write_csv=write_csv, screening=screening, cutoff=threshold,
+          screening_order=screening_order, screening_margin=screening_margin,
+          write_complex=(complex_models == 'all'), poses=artifact_poses, compression=artifact_compression,
+          seen=seen, surrogate=surrogate, explore=surrogate_explore, diversity=helix_diversity, cache=cache,
+          coarse=docking_coarse, fine=docking_fine, refine_fraction=refine_fraction))
+      if store is not None:
+        store.append('candidates', [(i, j, p) for j, p in enumerate(peptides)])
+      stages = ['generated', 'helix', 'helixpool', 'docked']
+      state.update(stages=stages, peptides=peptides, helixpool=helixpool)
+      save_checkpoint(checkpoint_file, state, budget)
+
+    if 'generated' not in stages:
+      if speculative is not None:
+        # Generated during the docking of the previous iteration, from the same state of the random generator
+        peptides = speculative['peptides']
+        random.setstate(speculative['random_state'])
+      else:
+        with tr.span('generation', iteration=i):
+          peptides = gp.genNewPips(PipPoolBook, pipPool, N=N_new, noRepetition=True, seen=seen)
+      if store is not None:
+        store.clear_iteration('candidates', i)
+        store.append('candidates', [(i, j, p) for j, p in enumerate(peptides)])
+        store.flush()
+      stages = ['generated']
+      state.update(stages=stages, peptides=peptides)
+      save_checkpoint(checkpoint_file, state, budget)
+    peptides = state['peptides']
+
+    sorted_helix = None  # Passed on in memory, unless the stage was done before a resume
+    if 'helix' not in stages:
+      # Helix prediction using PSIPRED
+      delete_files('.fasta')
+      with tr.span('psipred', iteration=i):
+        if speculative is None:
+          ph.run_psipred(peptides, i, executor=executor, cache=cache)
+        delete_files('.ss')
+        delete_files('.ss2')
+        if store is not None:
+          store.clear_iteration('helix', i)
+        sorted_helix = ph.sort_horiz_files(i, output_filename, store=store, write_csv=write_csv)
+      stages.append('helix')
+      save_checkpoint(checkpoint_file, state, budget)
+
+    if 'helixpool' not in stages:
+      # Docking test
+      if store is not None:
+        store.clear_iteration('helixpool', i)
+      with tr.span('helixpool', iteration=i):
+        helixpool = ph.create_helixpool(i, N_dock, output_filename, store=store, write_csv=write_csv,
+                                        surrogate=surrogate, explore=surrogate_explore, diversity=helix_diversity,
+                                        sorted_helix=sorted_helix)
+      stages.append('helixpool')
+      state['helixpool'] = helixpool
+      save_checkpoint(checkpoint_file, state, budget)
+    helixpool = state['helixpool']
+
+    if 'docked' not in stages:
+      if speculate and i + 1 < N_iteration and not score_feedback and budget is None:
+        # The next pool only depends on the peptides put back: generate for the likely ones while docking
+        ranking = surrogate.predict(helixpool).tolist() if surrogate is not None and surrogate.ready() else None
+        variants = [pool for pool in spc.putBackVariants(pipPool, helixpool, N_putBack, speculate, ranking=ranking)
+                    if max_pool is None or len(pool) <= max_pool]
+        if variants:
+          speculation = spc.Speculation(i+1, variants, N_newPiptide, limitLadderonSize, sketch=ladderon_sketch,
+                                        evaluated_db=evaluated_db, run=output_filename, extra_seen=peptides,
+                                        cache_folder=tool_cache,
+                                        inherited=[owner for owner in (store, seen, getattr(executor, 'queue', None))
+                                                   if owner is not None])
+      delete_files('.horiz')
+      delete_files('.fasta')
+      with tr.span('docking', iteration=i):
+        ph.run_psipred(helixpool, i, executor=executor, cache=cache)
+        delete_files('.horiz')
+        delete_files('.ss')
+
+        # Scoring
+        hs.docking_score(i, len(helixpool), pdb_files, output_filename, screening=screening, cutoff=threshold,
+                         screening_order=screening_order, screening_margin=screening_margin,
+                         write_complex=(complex_models == 'all'), executor=executor, skip_done=resume,
+                         poses=artifact_poses, compression=artifact_compression, cache=cache,
+                         coarse=docking_coarse, fine=docking_fine, refine_fraction=refine_fraction)
+      stages.append('docked')
+      save_checkpoint(checkpoint_file, state, budget)
+
+    for j, peptide in enumerate(helixpool):
+      docked_peptides.setdefault(peptide, (i, j))
+    if seen is not None:
+      seen.add(peptides, i)
+      seen.add(helixpool, i, stage='docked')
+    if store is not None:
+      store.clear_iteration('docking', i)
+      store.clear_iteration('peptide_scores', i)
+    with tr.span('scoring', iteration=i):
+      scores = hs.get_scores(i, output_filename, pdb_files, store=store, write_csv=write_csv, coarse=docking_coarse)
+      if surrogate is not None:
+        # Saved before the checkpoint; an iteration done again after an interruption is not added twice
+        surrogate.add_scores(f"{state.get('run_id', output_filename)}:{i}", helixpool, scores)
+        surrogate.save(surrogate_model)
+      peptide_scores = hs.get_peptide_score(i, output_filename, store=store, write_csv=write_csv,
+                                            scores=scores, helixpool=helixpool, pdb_files=pdb_files)
+      hits.add(peptide_scores)
+
+      # Update peptide pool
+      dockingPool = hs.create_dockingpool(i, N_putBack, output_filename, store=store, write_csv=write_csv,
+                                          peptide_scores=peptide_scores)
+    if score_feedback:
+      docked_scores.update((record['helixpool'], record['score']) for record in peptide_scores)
+      if feedback_history is not None:
+        # Only the most recent scores are kept, so that the cost of the feedback stays flat
+        for peptide in list(docked_scores)[:max(0, len(docked_scores) - feedback_history)]:
+          del docked_scores[peptide]
+    new_pipPool = gp.putBackPips(pipPool, dockingPool)
+    unique_dockingPool = new_pipPool[len(pipPool):]
+    pipPool = new_pipPool
+    if max_pool is not None:
+      for record in peptide_scores:
+        if record['helixpool'] in unique_dockingPool and not record.get('partial', False):
+          pool_scores[record['helixpool']] = record['score']
+      if len(pipPool) > max_pool:
+        # Keep the seeds, the best scores and a diverse rest, so that the generation cost stays flat
+        pipPool = gp.prunePipPool(pipPool, max_pool, seeds=pipPool0, scores=pool_scores, nBest=max_pool_best)
+        pool_scores = {p: pool_scores[p] for p in pipPool if p in pool_scores}
+    if budget is not None:
+      budget.end_iteration(N_new, len(helixpool))
+    state.update(iteration=i+1, stages=[], pipPool=pipPool, peptides=None, helixpool=None, hits=hits.state(),
+                 pool_scores=pool_scores, docked_scores=docked_scores)
+    save_checkpoint(checkpoint_file, state, budget)
+    if artifact_drop_misses:
+      # The scores of the iteration are recorded, the docking files of the misses are not needed any more
+      hs.drop_misses(i, output_filename, pdb_files, threshold)
     print(f'Iteration {i+1} complete, current pipPool: {pipPool}')
 
+  if budget is not None:
+    # The budget used by this session, up to the end of the run or the budget stop
+    save_checkpoint(checkpoint_file, state, budget)
+
   # Final selection of peptides based on score threshold
-  select_data(threshold, output_filename)
+  hit_peptides = hits.finish(f'Data_output/{output_filename}.csv')
+  if complex_models == 'hits':
+    for peptide in set(hit_peptides):
+      hs.create_complexes(*docked_peptides[peptide], pdb_files, output_filename, compression=artifact_compression)
+
+  if trace:
+    tr.disable()
+    tr.export_chrome(trace_file, f'Data_output/{output_filename}_appendix/trace.json')
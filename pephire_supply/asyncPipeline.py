@@ -0,0 +1,281 @@
+"""
+Version 1.0,
+asyncio version of one iteration of pephire.py.
+
+Candidates flow through the stages as soon as their inputs are ready:
+PSIPRED starts on the first generated peptides while generation goes on,
+and every peptide of the helix pool goes through MODPEP, HDOCK and createpl
+on its own, with the PSIPRED prediction made for it as a candidate. Ranking the helix predictions is the only global
+barrier, with the ranking of the coarse docking scores when the docking has
+a coarse tier (see hs.docking_score). The number of concurrent jobs of each tool is bounded by a semaphore.
+"""
+
+
+import os
+import time
+import shutil
+import asyncio
+import subprocess
+from pephire_supply import genPeptides as gp
+from pephire_supply import psipredHelix as ph
+from pephire_supply import hdockScore as hs
+from pephire_supply import tracing as tr
+
+def make_semaphores(max_jobs=None):
+    """
+    Create the semaphores bounding the concurrent jobs of each tool.
+
+    Args:
+    max_jobs (dict, optional): Maximum number of concurrent jobs per tool,
+        e.g. {'psipred': 8, 'modpep': 4, 'hdock': 4}. Missing tools default to the number of cores.
+
+    Returns:
+    dict: A dictionary mapping tools to semaphores.
+    """
+    max_jobs = max_jobs or {}
+    semaphores = {}
+    for tool in ['psipred', 'modpep', 'hdock']:
+        semaphores[tool] = asyncio.Semaphore(max_jobs.get(tool, os.cpu_count() or 1))
+    # createpl always writes model_1.pdb into the working directory, so it cannot run concurrently
+    semaphores['createpl'] = asyncio.Semaphore(1)
+    return semaphores
+
+async def exec_tool(args, cwd=None, stdout=None, wait=0.0):
+    """
+    Run an external tool as an asyncio subprocess and wait for it.
+    wait is the time spent waiting for a slot, recorded in the trace.
+
+    Raises:
+    subprocess.CalledProcessError: If the tool exits with a non-zero status.
+    """
+    ts, t0 = time.time(), time.perf_counter()
+    process = await asyncio.create_subprocess_exec(*args, cwd=cwd, stdout=stdout)
+    returncode = await process.wait()
+    tr.record_subprocess(args, ts, time.perf_counter() - t0, returncode, wait=wait, tid=process.pid)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, args)
+
+async def run_tool(tool, args, semaphores, cwd=None, stdout=None):
+    # Run an external tool once a slot of its semaphore is free
+    t0 = time.perf_counter()
+    async with semaphores[tool]:
+        await exec_tool(args, cwd=cwd, stdout=stdout, wait=time.perf_counter() - t0)
+
+def remove_temp_files(i, suffixes):
+    """
+    Deletes the temporary files of iteration i with the given suffixes.
+    """
+    temp_folder = '_external_app'
+    prefix = f'peptide{i}_'
+    for filename in os.listdir(temp_folder):
+        if filename.startswith(prefix) and filename.endswith(tuple(suffixes)):
+            os.remove(os.path.join(temp_folder, filename))
+
+async def predict_helix(i, j, peptide, semaphores, exeName='runpsipred_single', cache=None):
+    """
+    Writes peptide{i}_{j}.fasta and runs PSIPRED on it in the temp folder, unless the prediction is in the cache.
+    """
+    temp_folder = '_external_app'
+    fasta_filename = f'peptide{i}_{j}.fasta'
+    with open(os.path.join(temp_folder, fasta_filename), 'w') as f:
+        f.write(f'>peptide{j}\n{peptide}')
+    outputs = [os.path.join(temp_folder, f'peptide{i}_{j}{ext}') for ext in ['.horiz', '.ss2']]
+    if cache is not None and cache.fetch('psipred', peptide, ['.horiz', '.ss2'], outputs):
+        return
+    await run_tool('psipred', [exeName, fasta_filename], semaphores, cwd=temp_folder, stdout=asyncio.subprocess.DEVNULL)
+    if cache is not None:
+        cache.store('psipred', peptide, ['.horiz', '.ss2'], outputs)
+
+def keep_predictions(i, peptides, helixpool):
+    """
+    Keeps the .ss2 files of the candidates chosen for the helix pool, renamed peptide{i}_{j} after their index j
+    in the helix pool, with their .fasta files, and deletes the other temporary files of the candidates.
+    """
+    temp_folder = '_external_app'
+    index = {peptide: k for k, peptide in enumerate(peptides)}
+    # Through other names first, as the candidate and helix pool files are numbered alike
+    for j, peptide in enumerate(helixpool):
+        os.replace(os.path.join(temp_folder, f'peptide{i}_{index[peptide]}.ss2'), os.path.join(temp_folder, f'pool{i}_{j}.ss2'))
+    remove_temp_files(i, ['.horiz', '.fasta', '.ss', '.ss2'])
+    for j, peptide in enumerate(helixpool):
+        os.replace(os.path.join(temp_folder, f'pool{i}_{j}.ss2'), os.path.join(temp_folder, f'peptide{i}_{j}.ss2'))
+        with open(os.path.join(temp_folder, f'peptide{i}_{j}.fasta'), 'w') as f:
+            f.write(f'>peptide{j}\n{peptide}')
+
+async def generate_and_predict(i, PipPoolBook, pipPool, N, semaphores, chunk=64, seen=None, cache=None):
+    """
+    Generates new peptides like genNewPips(noRepetition=True, seen=seen) and starts the
+    PSIPRED prediction of every chunk of candidates while the next chunk is generated.
+
+    Returns:
+    list: A list of new peptide sequences.
+    """
+    peptides, tasks = [], []
+    while N > 0:
+        newpips = gp.genNewPips(PipPoolBook, pipPool + peptides, N=min(chunk, N), noRepetition=True, seen=seen)
+        N -= min(chunk, N)
+        for peptide in newpips:
+            tasks.append(asyncio.create_task(predict_helix(i, len(peptides), peptide, semaphores, cache=cache)))
+            peptides.append(peptide)
+        await asyncio.sleep(0)  # Let the predictions of this chunk start
+    await asyncio.gather(*tasks)
+    return peptides
+
+async def dock_receptor(i, j, pdb_file, output_filename, semaphores, write_complex=True, poses=None, compression=None,
+                        cache=None, peptide=None, sampling=None):
+    """
+    Docks models{i}_{j}.pdb against one receptor and moves the results to the output folder
+    (with the retention of hs.save_artifact). With a cache, peptide is the sequence of the model.
+    sampling holds the options of hdock for the grid spacing and angle step, see hs.docking_score.
+    """
+    output_folder = f'Data_output/{output_filename}_appendix'
+    pdb_input = os.path.join('Data_input', pdb_file)
+    models_file = os.path.join(output_folder, f'models{i}_{j}.pdb')
+    hdock_output_file = f'Hdock{i}_{j}_{pdb_file[:-4]}.out'
+
+    key = cache.receptor_key(peptide, pdb_input) if cache is not None else None
+    if key is not None and sampling:
+        key += '|' + ' '.join(hs.sampling_args(sampling))
+    if cache is not None and cache.fetch('hdock', key, ['.out'], [hdock_output_file]):
+        hs.relink_hdock(hdock_output_file, pdb_input, models_file)
+    else:
+        await run_tool('hdock', ['hdock', pdb_input, models_file] + hs.sampling_args(sampling) + ['-out', hdock_output_file],
+                       semaphores)
+        if cache is not None:
+            cache.store('hdock', key, ['.out'], [hdock_output_file])
+
+    if write_complex:
+        t0 = time.perf_counter()
+        async with semaphores['createpl']:
+            await exec_tool(['createpl', hdock_output_file, 'top1.pdb', '-nmax', '1', '-complex', '-models'],
+                            wait=time.perf_counter() - t0)
+            final_score_file = f'Score_{i}_{j}_{pdb_file[:-4]}.pdb'
+            shutil.move('model_1.pdb', final_score_file)
+            hs.save_artifact(final_score_file, output_folder, compression=compression)
+
+    hs.save_artifact(hdock_output_file, output_folder, poses=poses, compression=compression)
+    return os.path.join(output_folder, hdock_output_file)
+
+async def dock_peptide(i, j, peptide, pdb_files, output_filename, semaphores, state, screening=None, cutoff=None,
+                       screening_order=None, screening_margin=0.0, write_complex=True, poses=None, compression=None,
+                       cache=None, coarse=None):
+    """
+    Runs MODPEP and HDOCK for one peptide of the helix pool, taking the outputs in the cache if any;
+    its PSIPRED prediction is the one made for the candidates (see keep_predictions).
+    Without screening all receptors are docked concurrently; with screening they
+    are docked one after the other, as in hs.docking_score. With the sampling of a coarse tier,
+    all receptors are docked concurrently with it; the fine tier is run by dock_receptors.
+
+    Returns:
+    list: The receptors actually docked.
+    """
+    temp_folder = '_external_app'
+    output_folder = f'Data_output/{output_filename}_appendix'
+
+    models_file = os.path.join(output_folder, f'models{i}_{j}.pdb')
+    if cache is None or not cache.fetch('modpep', peptide, ['.pdb'], [models_file]):
+        await run_tool('modpep', ['modpep', f'peptide{i}_{j}.fasta', os.path.join('..', models_file), '-n', '1', '-L', './',
+                                  '-h', f'peptide{i}_{j}.ss2'], semaphores, cwd=temp_folder)
+        if cache is not None:
+            cache.store('modpep', peptide, ['.pdb'], [models_file])
+
+    if coarse is not None:
+        await asyncio.gather(*[dock_receptor(i, j, pdb_file, output_filename, semaphores, write_complex, poses, compression,
+                                             cache, peptide, sampling=coarse)
+                               for pdb_file in pdb_files])
+        return list(pdb_files)
+    return await dock_receptors(i, j, peptide, pdb_files, output_filename, semaphores, state, screening, cutoff,
+                                screening_order, screening_margin, write_complex, poses, compression, cache)
+
+async def dock_receptors(i, j, peptide, pdb_files, output_filename, semaphores, state, screening=None, cutoff=None,
+                         screening_order=None, screening_margin=0.0, write_complex=True, poses=None, compression=None,
+                         cache=None, sampling=None):
+    """
+    Docks the model of peptide j against the receptors, with screening if any, once the model is written.
+
+    Returns:
+    list: The receptors actually docked.
+    """
+    receptors = hs.screening_receptors(pdb_files, screening, screening_order)
+    if screening is None:
+        await asyncio.gather(*[dock_receptor(i, j, pdb_file, output_filename, semaphores, write_complex, poses, compression,
+                                             cache, peptide, sampling)
+                               for pdb_file in receptors])
+        return receptors
+
+    docked, scores = [], []
+    for pdb_file in receptors:
+        hdock_output_file = await dock_receptor(i, j, pdb_file, output_filename, semaphores, write_complex, poses, compression,
+                                                cache, peptide, sampling)
+        docked.append(pdb_file)
+        scores.append(hs.read_hdock_score(hdock_output_file)[1])
+        if hs.stop_screening(scores, len(receptors), screening, cutoff, state['best_mean'], screening_margin):
+            break
+    if len(scores) == len(receptors):
+        running_mean = sum(scores) / len(scores)
+        if state['best_mean'] is None or running_mean < state['best_mean']:
+            state['best_mean'] = running_mean
+    return docked
+
+async def run_iteration(i, PipPoolBook, pipPool, N_newPiptide, N_for_docking, pdb_files, output_filename,
+                        max_jobs=None, store=None, write_csv=True, screening=None, cutoff=None,
+                        screening_order=None, screening_margin=0.0, write_complex=True, poses=None, compression=None,
+                        seen=None, surrogate=None, explore=0.25, diversity=0.0, cache=None, coarse=None, fine=None,
+                        refine_fraction=0.25):
+    """
+    Runs the generation, helix prediction, helix pool selection and docking of iteration i.
+    The scores are then collected with hs.get_scores as in the staged pipeline.
+
+    Args:
+    i (int): Identifier for the iteration.
+    PipPoolBook (tuple): Output of gp.getPipPoolBook for the current pool.
+    pipPool (list): The current pool of peptides.
+    max_jobs (dict, optional): Maximum number of concurrent jobs per tool, see make_semaphores.
+    seen (SequenceIndex, optional): Peptides evaluated before, not generated again.
+    surrogate (SurrogateModel, optional): Model ranking the helix candidates, with explore, see ph.create_helixpool.
+    diversity (float): Weight of the diversity of the helix pool, see ph.create_helixpool.
+    cache (ToolCache, optional): Cache of the PSIPRED, MODPEP and HDOCK outputs, see toolCache.
+    coarse, fine, refine_fraction: Docking tiers, see hs.docking_score.
+    The other arguments are those of ph.sort_horiz_files, ph.create_helixpool and hs.docking_score.
+
+    Returns:
+    tuple: (generated peptides, helix pool, {j: receptors docked}); with a coarse tier, the receptors docked
+        with the fine sampling, as hs.docking_score.
+    """
+    output_folder = f'Data_output/{output_filename}_appendix'
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    if coarse is not None and hs.sampling_values(coarse) == hs.sampling_values(fine):
+        raise ValueError('The coarse and fine docking tiers have the same grid spacing and angle step')
+    semaphores = make_semaphores(max_jobs)
+    peptides = await generate_and_predict(i, PipPoolBook, pipPool, N_newPiptide, semaphores, seen=seen, cache=cache)
+    remove_temp_files(i, ['.ss'])
+
+    # Global barrier: the helix pool is chosen from the predictions of all candidates
+    sorted_helix = ph.sort_horiz_files(i, output_filename, store=store, write_csv=write_csv)
+    helixpool = ph.create_helixpool(i, N_for_docking, output_filename, store=store, write_csv=write_csv,
+                                    surrogate=surrogate, explore=explore, diversity=diversity,
+                                    sorted_helix=sorted_helix)
+    keep_predictions(i, peptides, helixpool)
+
+    state = {'best_mean': None}
+    docked = await asyncio.gather(*[dock_peptide(i, j, peptide, pdb_files, output_filename, semaphores, state,
+                                                 screening=screening, cutoff=cutoff, screening_order=screening_order,
+                                                 screening_margin=screening_margin, write_complex=write_complex,
+                                                 poses=poses, compression=compression, cache=cache, coarse=coarse)
+                                    for j, peptide in enumerate(helixpool)])
+    if coarse is not None:
+        # Barrier of the coarse tier: the best peptides are docked again with the fine sampling
+        state = {'best_mean': None}
+        refined = hs.refine_candidates(i, len(helixpool), pdb_files, output_filename, coarse, refine_fraction)
+        fine_docked = await asyncio.gather(*[dock_receptors(i, j, helixpool[j], pdb_files, output_filename, semaphores,
+                                                            state, screening, cutoff, screening_order, screening_margin,
+                                                            write_complex, poses, compression, cache, sampling=fine)
+                                             for j in refined])
+        # As hs.docking_score: the receptors docked with the fine sampling
+        docked = [[] for _ in helixpool]
+        for j, receptors in zip(refined, fine_docked):
+            docked[j] = receptors
+    remove_temp_files(i, ['.fasta', '.ss2'])
+    return peptides, helixpool, dict(enumerate(docked))
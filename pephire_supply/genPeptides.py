@@ -9,7 +9,9 @@ Changes from v3.0:
 set the maximum scale of ladderon to prevent large ladderons from always overshadowing other sequences. 
 """
 from pephire_supply import ladderpath as lp
+from pephire_supply import tracing as tr
 import random
+import math
 
 def find_all(s, sub):
     """
@@ -34,6 +36,7 @@ def find_all(s, sub):
             i = subfound + 1
 
 
+@tr.traced
 def getLadderonAddress(strs, strs_lp, limitLadderonSize=None):
     """
     Find the positions of each ladderon in the given strings.
@@ -92,7 +95,8 @@ def genNewPeptide(peptideLen, listLadderon, listProb, LadderonAddress, disp=True
             NtoFill -= countQ
     return newPeptide
 
-def genNewPips(PipPoolBook, pipPool, N=10, noRepetition=False):
+@tr.traced
+def genNewPips(PipPoolBook, pipPool, N=10, noRepetition=False, seen=None):
     """
     Generate new peptide sequences.
 
@@ -101,45 +105,183 @@ def genNewPips(PipPoolBook, pipPool, N=10, noRepetition=False):
     pipPool (list): List of existing peptides.
     N (int): Number of new peptides to generate.
     noRepetition (bool): If True, avoid generating duplicate sequences.
+    seen (optional): Peptides evaluated before, e.g. a SequenceIndex (anything supporting `in`).
+        With noRepetition, candidates found in it are rejected too.
 
     Returns:
     list: A list of new peptide sequences.
     """
     newpips = [] 
+    known = set(pipPool) if noRepetition else None  # The pool and the new pips
     for _ in range(N):
         temp = genNewPeptide(PipPoolBook[0], PipPoolBook[1], PipPoolBook[2], PipPoolBook[3], disp=False)
         if noRepetition:
             # Ensure no duplicate sequences are generated
-            if temp not in newpips and temp not in pipPool:
+            if temp not in known and (seen is None or temp not in seen):
                 newpips.append(temp)
+                known.add(temp)
         else:
             newpips.append(temp)
     return newpips
 
-def getPipPoolBook(pipPool, limitLadderonSize=None):
+def feedbackWeights(listLadderon, scores, strength=1.0, exploration=0.2):
+    """
+    Multipliers of the ladderon probabilities from the docking scores of the peptides containing them.
+    A ladderon whose peptides score better (lower) than average is favoured, exp(-strength * z) with z the
+    standardised mean score of its peptides, shrunk towards 0 when it was seen in few peptides.
+
+    Args:
+    listLadderon (list): List of ladderons.
+    scores (dict): Average docking score of the peptides docked so far.
+    strength (float): Strength of the feedback, 0 disables it.
+    exploration (float): Share of the weight kept uniform (between 0 and 1), so that
+        ladderons with poor scores are still tried now and then.
+
+    Returns:
+    list: The multiplier of each ladderon; 1 for the ladderons without scored peptides.
+    """
+    values = list(scores.values())
+    if strength == 0 or len(values) < 2:
+        return [1.0] * len(listLadderon)
+    mean = sum(values) / len(values)
+    std = math.sqrt(sum((v - mean) ** 2 for v in values) / len(values)) or 1.0
+
+    # Scores of the peptides containing each ladderon, in one pass over the substrings of the peptides
+    ladderons = set(listLadderon)
+    lengths = {len(ladderon) for ladderon in ladderons}
+    found = {}
+    for peptide, score in scores.items():
+        substrings = {peptide[start:start + length] for length in lengths for start in range(len(peptide) - length + 1)}
+        for ladderon in substrings & ladderons:
+            found.setdefault(ladderon, []).append(score)
+
+    weights = []
+    for ladderon in listLadderon:
+        if ladderon not in found:
+            weights.append(1.0)
+            continue
+        found_scores = found[ladderon]
+        z = (sum(found_scores) / len(found_scores) - mean) / std * len(found_scores) / (len(found_scores) + 1)
+        z = max(-5.0, min(5.0, z))
+        weights.append((1 - exploration) * math.exp(-strength * z) + exploration)
+    return weights
+
+@tr.traced
+def getPipPoolBook(pipPool, limitLadderonSize=None, scores=None, feedback=0.0, exploration=0.2, sketch=None):
     """
     Get the pip pool book.
 
     Args:
     pipPool (list): The pool of pips.
     limitLadderonSize (int, optional): The maximum size of the ladderon. Defaults to None.
+    scores (dict, optional): Average docking score of the peptides docked so far, for the feedback.
+    feedback (float): Strength of the score feedback on the ladderon probabilities, see feedbackWeights.
+        0 (default) keeps the probabilities multi*len(ladderon).
+    exploration (float): Uniform share of the feedback weights, see feedbackWeights.
+    sketch (dict, optional): Use the approximate ladderons of ladderonSketch.sketchLadderons instead of
+        the ladderpath decomposition, with these options, e.g. {'epsilon': 1e-5, 'minSupport': 2}.
+        For pools too large for the exact engine.
 
     Returns:
     tuple: A tuple containing information about the peptide, ladderons, their probabilities, and positions.
     """
     peptideLen = len(pipPool[0])
-    strs_lp = lp.ladderpath(pipPool, CalPOM=True)
-    LadderonAddress = getLadderonAddress(pipPool, strs_lp, limitLadderonSize=limitLadderonSize)
-
     listLadderon, listProb = [], []
-    for pom in strs_lp.POM:
-        for ladderon, multi in pom:
-            if (limitLadderonSize is None) or (len(ladderon) <= limitLadderonSize):
-                listLadderon.append(ladderon)
-                # Calculate the frequency of each ladderon being chosen
-                listProb.append(multi*len(ladderon))
-            
+    if sketch is not None:
+        # Imported here, so that the exact generation path does not load numpy
+        from pephire_supply import ladderonSketch as ls
+        listLadderon, listMulti, LadderonAddress, _ = ls.sketchLadderons(pipPool, limitLadderonSize, **sketch)
+        listProb = [multi*len(ladderon) for ladderon, multi in zip(listLadderon, listMulti)]
+    else:
+        strs_lp = lp.ladderpath(pipPool, CalPOM=True)
+        LadderonAddress = getLadderonAddress(pipPool, strs_lp, limitLadderonSize=limitLadderonSize)
+        for pom in strs_lp.POM:
+            for ladderon, multi in pom:
+                if (limitLadderonSize is None) or (len(ladderon) <= limitLadderonSize):
+                    listLadderon.append(ladderon)
+                    # Calculate the frequency of each ladderon being chosen
+                    listProb.append(multi*len(ladderon))
+
+    if feedback and scores:
+        # Favour the ladderons found in well-docking peptides
+        weights = feedbackWeights(listLadderon, scores, strength=feedback, exploration=exploration)
+        listProb = [prob * weight for prob, weight in zip(listProb, weights)]
+
     return (peptideLen, listLadderon, listProb, LadderonAddress)
     # listLadderon: the list of all ladderons, get from pipPool. ['W', 'QL', 'RLA'...]
     # listProb: the probability being taken for new pip, by !!! user defined !!! method. [2,6,8...]
     # LadderonAddress: the position of each ladderon can be. {'AGDEFE': [11], 'RIGDE': [10], ...}
+
+def kmerSet(peptide, k=3):
+    """
+    Return the set of k-mers of a peptide.
+    """
+    return {peptide[i:i+k] for i in range(len(peptide) - k + 1)}
+
+def jaccard(set1, set2):
+    """
+    Jaccard similarity of two sets.
+    """
+    union = len(set1 | set2)
+    return len(set1 & set2) / union if union else 1.0
+
+def putBackPips(pipPool, dockingPool):
+    """
+    The pool of the next iteration: the pool followed by the put-back pips not already in it, in their order.
+
+    Args:
+    pipPool (list): The pool of pips.
+    dockingPool (list): The best docked pips, see hs.create_dockingpool.
+
+    Returns:
+    list: The new pool.
+    """
+    known = set(pipPool)
+    return list(pipPool) + [p for p in dict.fromkeys(dockingPool) if p not in known]
+
+def prunePipPool(pipPool, maxSize, seeds=(), scores=None, nBest=None, k=3):
+    """
+    Bound the size of the pool of pips, so that the cost of getPipPoolBook does not grow with the iterations.
+    The seeds are always kept, then the best-scoring pips, and the remaining places go to the pips
+    whose k-mers differ most from those already kept (greedy farthest-point selection on the Jaccard similarity).
+
+    Args:
+    pipPool (list): The pool of pips.
+    maxSize (int): Maximum number of pips kept (the seeds are kept even if there are more of them).
+    seeds (list): Pips that are never evicted, e.g. pipPool0.
+    scores (dict, optional): Average docking score of the pips, lower is better.
+    nBest (int, optional): Number of places given to the best-scoring pips. Defaults to half of the free places, rounded up.
+    k (int): Length of the k-mers used for the diversity.
+
+    Returns:
+    list: The pips kept, in their order in pipPool.
+    """
+    if len(pipPool) <= maxSize:
+        return list(pipPool)
+    scores = scores or {}
+    seeds = set(seeds)
+    keep = [pip for pip in pipPool if pip in seeds]
+    free = maxSize - len(keep)
+    if free <= 0:
+        return keep
+
+    candidates = [pip for pip in pipPool if pip not in seeds]
+    scored = sorted((pip for pip in candidates if scores.get(pip) is not None), key=lambda pip: scores[pip])
+    nBest = max(1, (free + 1) // 2) if nBest is None else min(nBest, free)
+    keep.extend(scored[:nBest])
+    kept = set(keep)
+
+    # Farthest-point selection: repeatedly keep the candidate least similar to everything kept so far
+    kmers = {pip: kmerSet(pip, k) for pip in pipPool}
+    maxSim = {pip: max([jaccard(kmers[pip], kmers[other]) for other in keep] + [0.0])
+              for pip in candidates if pip not in kept}
+    while len(keep) < maxSize and maxSim:
+        # Ties go to the better score, then to the earlier pip
+        newPip = min(maxSim, key=lambda pip: (maxSim[pip], scores.get(pip) if scores.get(pip) is not None else float('inf')))
+        del maxSim[newPip]
+        keep.append(newPip)
+        kept.add(newPip)
+        for pip in maxSim:
+            maxSim[pip] = max(maxSim[pip], jaccard(kmers[pip], kmers[newPip]))
+
+    return [pip for pip in pipPool if pip in kept]
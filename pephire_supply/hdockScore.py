@@ -5,13 +5,22 @@ written by Lu Peng, 2023.12.15
 
 
 import os
+import re
+import math
+import io
 import csv
-import glob
+import gzip
 import shutil
-import subprocess
-import pandas as pd
+import zipfile
+import contextlib
+from pephire_supply import jobQueue as jq
+from pephire_supply import tracing as tr
+from pephire_supply import toolCache as tc
 
-def docking_score(i, N_for_docking, pdb_files, output_filename):
+HDOCK_SAMPLING = {'spacing': 1.2, 'angle': 15.0}  # Defaults of hdock, written in the header of the Hdock*.out files
+
+@tr.traced
+def docking_score(i, N_for_docking, pdb_files, output_filename, screening=None, cutoff=None, screening_order=None, screening_margin=0.0, write_complex=True, executor=None, skip_done=False, poses=None, compression=None, cache=None, coarse=None, fine=None, refine_fraction=0.25):
     """
     Process each peptide file and perform docking.
 
@@ -19,132 +28,693 @@ def docking_score(i, N_for_docking, pdb_files, output_filename):
     i (int): Identifier for the peptide.
     N_for_docking (int): Number of dockings to perform.
     pdb_files (list): List of pdb files for docking.
+    screening (str, optional): Successive screening mode. None docks every peptide against every receptor;
+        'threshold' stops docking a peptide once its running mean score exceeds cutoff + screening_margin;
+        'best' does the same against the best complete mean score found so far (cutoff is used until one exists).
+    cutoff (float, optional): Score a peptide has to beat (e.g. the selection threshold).
+    screening_order (list, optional): Order in which the receptors are docked. Defaults to the order of pdb_files.
+    screening_margin (float): Tolerance added to the cutoff before a peptide is considered hopeless.
+    write_complex (bool): If True, write the top complex of every pair with createpl (Score_*.pdb).
+        If False, only the Hdock*.out files are kept; use create_complexes() later for the pairs of interest.
+    executor (optional): Executor running the modpep and hdock jobs (see jobQueue). Defaults to LocalExecutor.
+        Without screening all the hdock jobs of the iteration are submitted at once; with screening the
+        receptors of a peptide are docked one after the other.
+    skip_done (bool): If True, (peptide, receptor) pairs whose Hdock*.out is already in the output folder
+        are not docked again, e.g. when resuming an interrupted run.
+    poses (int, optional): Number of poses kept in the Hdock*.out files. Defaults to all of them.
+    compression (str, optional): None keeps the artifacts as plain files; 'gzip' compresses each of them;
+        'archive' packs the artifacts of the iteration into docking{i}.zip. See save_artifact.
+    cache (ToolCache, optional): Cache of the MODPEP models and HDOCK outputs, see toolCache.
+    coarse (dict, optional): HDOCK sampling of a first, coarse tier, e.g. {'spacing': 2.0, 'angle': 30}. Every peptide
+        is docked against every receptor with it, then only the best refine_fraction of the peptides are docked
+        again with the fine sampling (and with screening, if any). None docks every peptide once with the fine sampling.
+    fine (dict, optional): HDOCK sampling of the full-resolution docking. Defaults to the options of hdock (HDOCK_SAMPLING).
+    refine_fraction (float): Share of the peptides docked again with the fine sampling, see refine_candidates.
+
+    Returns:
+    dict: The receptors actually docked for each peptide, {j: ['2PQK.pdb', ...]}. With a coarse tier, the receptors
+        docked with the fine sampling (every peptide was docked against every receptor with the coarse one).
     """
     temp_folder = '_external_app'
     output_folder = f'Data_output/{output_filename}_appendix'
-    input_folder = 'Data_input'
+    executor = executor or jq.LocalExecutor()
 
     # Ensure output_data folder exists
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    # Save current directory
-    current_dir = os.getcwd()
-
-    # Change to input_data directory for modpep
-    os.chdir(temp_folder)
-
+    # Generate pdb files using modpep software, run in the temp folder
+    jobs, modelled = [], []
     for j in range(N_for_docking):
+        if skip_done and any(is_docked(i, j, pdb_file, output_filename) for pdb_file in pdb_files):
+            continue  # The model was docked before the run was interrupted
+        models_file = os.path.join(output_folder, f'models{i}_{j}.pdb')
+        if cache is not None:
+            sequence = tc.fasta_sequence(os.path.join(temp_folder, f'peptide{i}_{j}.fasta'))
+            if cache.fetch('modpep', sequence, ['.pdb'], [models_file]):
+                continue
+            modelled.append((sequence, models_file))
         fasta_file = os.path.join('../', temp_folder, f'peptide{i}_{j}.fasta')
         ss2_file = os.path.join('../', temp_folder, f'peptide{i}_{j}.ss2')
-        models_file = os.path.join('../', output_folder, f'models{i}_{j}.pdb')
+        models_file = os.path.join('../', models_file)
+        jobs.append(jq.make_job(['modpep', fasta_file, models_file, '-n', '1', '-L', './', '-h', ss2_file], cwd=temp_folder,
+                                priority=j))
+    executor.run(jobs)
+    for sequence, models_file in modelled:
+        cache.store('modpep', sequence, ['.pdb'], [models_file])
+
+    receptors = screening_receptors(pdb_files, screening, screening_order)
+    candidates = list(range(N_for_docking))
+    docked = {j: [] for j in range(N_for_docking)}
+
+    if coarse is not None:
+        if sampling_values(coarse) == sampling_values(fine):
+            raise ValueError('The coarse and fine docking tiers have the same grid spacing and angle step')
+        # Coarse tier: every peptide against every receptor, then the best are docked again at full resolution
+        pairs = [(j, pdb_file) for j in range(N_for_docking) for pdb_file in pdb_files
+                 if not (skip_done and is_docked(i, j, pdb_file, output_filename))]
+        run_hdock(i, pairs, output_filename, executor, write_complex, poses, compression, cache, sampling=coarse)
+        candidates = refine_candidates(i, N_for_docking, pdb_files, output_filename, coarse, refine_fraction)
+
+    # Perform molecular docking with hdock software
+    if screening is None:
+        pairs = [(j, pdb_file) for j in candidates for pdb_file in receptors
+                 if not (skip_done and is_docked(i, j, pdb_file, output_filename, coarse))]
+        run_hdock(i, pairs, output_filename, executor, write_complex, poses, compression, cache, sampling=fine)
+        docked.update((j, list(receptors)) for j in candidates)
+        return docked
+
+    best_mean = None
+    for j in candidates:
+        scores = []
+        for pdb_file in receptors:
+            if skip_done and is_docked(i, j, pdb_file, output_filename, coarse):
+                hdock_output_file = os.path.join(output_folder, f'Hdock{i}_{j}_{pdb_file[:-4]}.out')
+            else:
+                hdock_output_file = run_hdock(i, [(j, pdb_file)], output_filename, executor, write_complex, poses, compression, cache,
+                                              sampling=fine)[0]
+            docked[j].append(pdb_file)
+            scores.append(read_hdock_score(hdock_output_file)[1])
+            # Skip the remaining receptors once this peptide cannot plausibly beat the limit
+            if stop_screening(scores, len(receptors), screening, cutoff, best_mean, screening_margin):
+                break
 
-        # Generate pdb files using modpep software
-        subprocess.run(['modpep', fasta_file, models_file, '-n', '1', '-L', './', '-h', ss2_file], check=True)
+        if len(scores) == len(receptors):
+            running_mean = sum(scores) / len(scores)
+            if best_mean is None or running_mean < best_mean:
+                best_mean = running_mean
 
-    # Change back to the original directory after modpep
-    os.chdir(current_dir)
+    return docked
 
-    # Perform molecular docking with hdock software
+def is_docked(i, j, pdb_file, output_filename, coarse=None):
+    """
+    Check whether peptide j of iteration i has been docked against a receptor.
+    Hdock*.out files are moved to the output folder only once hdock (and createpl) finished.
+    With the sampling of a coarse tier, only a docking with the fine sampling counts.
+    """
+    output_folder = f'Data_output/{output_filename}_appendix'
+    hdock_output_file = os.path.join(output_folder, f'Hdock{i}_{j}_{pdb_file[:-4]}.out')
+    if not artifact_exists(hdock_output_file):
+        return False
+    return coarse is None or hdock_fidelity(hdock_output_file, coarse) == 'fine'
+
+def sampling_args(sampling):
+    # Options of hdock for a docking tier, e.g. {'spacing': 2.0, 'angle': 30} -> ['-spacing', '2.0', '-angle', '30']
+    return [arg for option, value in (sampling or {}).items() for arg in (f'-{option}', str(value))]
+
+def sampling_values(sampling):
+    # (grid spacing, angle step) of a docking tier, rounded as in the header of the Hdock*.out files
+    sampling = dict(HDOCK_SAMPLING, **(sampling or {}))
+    return round(float(sampling['spacing']), 3), round(float(sampling['angle']), 3)
+
+def read_sampling(hdock_path):
+    """
+    Read the grid spacing and the angle step from the header of a Hdock*.out file.
+
+    Returns:
+    tuple: (grid spacing, angle step).
+    """
+    with open_artifact(hdock_path) as f:
+        spacing = float(f.readline().split()[-1])
+        angle = float(f.readline().split()[-1])
+    return round(spacing, 3), round(angle, 3)
+
+def hdock_fidelity(hdock_path, coarse):
+    """
+    Return 'coarse' if a Hdock*.out file was docked with the sampling of the coarse tier, else 'fine'.
+    """
+    return 'coarse' if coarse is not None and read_sampling(hdock_path) == sampling_values(coarse) else 'fine'
+
+def refine_candidates(i, N_for_docking, pdb_files, output_filename, coarse, refine_fraction):
+    """
+    Choose the peptides of iteration i docked again with the fine sampling after the coarse tier:
+    the ceil(refine_fraction * N_for_docking) best mean coarse scores over all receptors.
+    Peptides with a fine docking already (an interrupted run) were chosen before and are kept.
+    The coarse artifacts are kept: each one is only replaced once the fine docking of its pair is done,
+    so the receptors that screening skips keep their coarse score (the 'mixed' fidelity of get_scores).
+
+    Returns:
+    list: Indices of the peptides to refine, in the order of the helix pool.
+    """
+    output_folder = f'Data_output/{output_filename}_appendix'
+    n_refine = min(N_for_docking, math.ceil(refine_fraction * N_for_docking))
+    refined, ranked, fidelities = [], [], {}
     for j in range(N_for_docking):
+        scores = []
         for pdb_file in pdb_files:
-            pdb_input = os.path.join(input_folder, pdb_file)
-            models_file = os.path.join(output_folder, f'models{i}_{j}.pdb')
-            hdock_output_file = f'Hdock{i}_{j}_{pdb_file[:-4]}.out'
+            hdock_output_file = os.path.join(output_folder, f'Hdock{i}_{j}_{pdb_file[:-4]}.out')
+            if artifact_exists(hdock_output_file):
+                fidelities[j, pdb_file] = hdock_fidelity(hdock_output_file, coarse)
+                scores.append(read_hdock_score(hdock_output_file)[1])
+        if 'fine' in [fidelities.get((j, pdb_file)) for pdb_file in pdb_files]:
+            refined.append(j)
+        elif len(scores) == len(pdb_files) and None not in scores:
+            ranked.append((sum(scores) / len(scores), j))
+    refined += [j for _, j in sorted(ranked)[:max(0, n_refine - len(refined))]]
+    return sorted(refined)
+
+def run_hdock(i, pairs, output_filename, executor, write_complex=True, poses=None, compression=None, cache=None,
+              sampling=None):
+    """
+    Dock models{i}_{j}.pdb against the receptors of the given pairs. Each result is
+    moved to the output folder as soon as its hdock job finishes.
+
+    Args:
+    i (int): Identifier for the peptide.
+    pairs (list): (j, pdb_file) pairs to dock.
+    executor: Executor running the hdock jobs.
+    write_complex (bool): If True, write the top complex of each pair with createpl.
+    poses, compression: Retention of the artifacts, see save_artifact.
+    cache (ToolCache, optional): Cache of the HDOCK outputs; cached pairs are not docked again.
+    sampling (dict, optional): Options of hdock for the grid spacing and angle step, see docking_score.
+
+    Returns:
+    list: Paths of the Hdock*.out files (possibly compressed or archived), in the order of pairs.
+    """
+    output_folder = f'Data_output/{output_filename}_appendix'
+    input_folder = 'Data_input'
+
+    jobs, keys = [], {}
+    for j, pdb_file in pairs:
+        pdb_input = os.path.join(input_folder, pdb_file)
+        models_file = os.path.join(output_folder, f'models{i}_{j}.pdb')
+        hdock_output_file = f'Hdock{i}_{j}_{pdb_file[:-4]}.out'
+        if cache is not None:
+            sequence = tc.fasta_sequence(os.path.join('_external_app', f'peptide{i}_{j}.fasta'))
+            key = cache.receptor_key(sequence, pdb_input)
+            if sampling:
+                key += '|' + ' '.join(sampling_args(sampling))
+            if cache.fetch('hdock', key, ['.out'], [hdock_output_file]):
+                relink_hdock(hdock_output_file, pdb_input, models_file)
+                finish_hdock(hdock_output_file, output_folder, write_complex, poses, compression)
+                continue
+            keys[hdock_output_file] = key
+        # The candidates are docked in the order of the helix pool (best predicted first with a surrogate model)
+        jobs.append(jq.make_job(['hdock', pdb_input, models_file] + sampling_args(sampling) + ['-out', hdock_output_file],
+                                priority=j))
+    executor.run(jobs, on_done=lambda job: finish_hdock(job['args'][-1], output_folder, write_complex, poses, compression,
+                                                        cache, keys.get(job['args'][-1])))
+
+    return [os.path.join(output_folder, f'Hdock{i}_{j}_{pdb_file[:-4]}.out') for j, pdb_file in pairs]
+
+def finish_hdock(hdock_output_file, output_folder, write_complex=True, poses=None, compression=None, cache=None, key=None):
+    """
+    Write the complex of a finished hdock job with createpl (if asked) and move the results to the output folder.
+    createpl always runs locally, as it writes model_1.pdb in the working directory.
+    With a cache and the key of the job, the complete output is added to the cache first.
+    """
+    if cache is not None and key is not None:
+        cache.store('hdock', key, ['.out'], [hdock_output_file])
+
+    if write_complex:
+        # Score the docking results using createpl software
+        jq.run_local(['createpl', hdock_output_file, 'top1.pdb', '-nmax', '1', '-complex', '-models'])
+        final_score_file = 'Score_' + hdock_output_file[len('Hdock'):-len('.out')] + '.pdb'
+        shutil.move('model_1.pdb', final_score_file)
+        save_artifact(final_score_file, output_folder, compression=compression)
+
+    # Move generated files to the output_data folder
+    save_artifact(hdock_output_file, output_folder, poses=poses, compression=compression)
+
+def relink_hdock(hdock_output_file, pdb_input, models_file):
+    """
+    Point the header of a Hdock*.out file taken from the cache to the receptor and model files of this run,
+    which createpl reads and read_hdock_score reports as the ligand.
+    """
+    with open(hdock_output_file) as f:
+        lines = f.readlines()
+    for k, path in [(3, pdb_input), (4, models_file)]:
+        fields = lines[k].split(None, 1)
+        lines[k] = f'{path}      {fields[1]}' if len(fields) > 1 else f'{path}\n'
+    with open(hdock_output_file, 'w') as f:
+        f.writelines(lines)
+
+def artifact_archive(path):
+    """
+    Return the path of the archive of the iteration a Hdock{i}_*.out or Score_{i}_*.pdb file belongs to.
+    """
+    folder, name = os.path.split(path)
+    match = re.match(r'(?:Hdock|Score_)(\d+)_', name)
+    return os.path.join(folder, f'docking{match.group(1)}.zip') if match else None
+
+def save_artifact(filename, output_folder, poses=None, compression=None):
+    """
+    Move a docking artifact from the working directory to the output folder.
+
+    Args:
+    filename (str): Hdock*.out or Score_*.pdb file in the working directory.
+    poses (int, optional): Keep only the header and the first poses of a Hdock*.out file
+        (they are sorted by score, and createpl and read_hdock_score only use the first ones).
+    compression (str, optional): None moves the file; 'gzip' writes <filename>.gz;
+        'archive' adds the file to the zip archive of its iteration (docking{i}.zip).
+    """
+    if poses is not None and filename.endswith('.out'):
+        with open(filename) as f:
+            lines = [line for _, line in zip(range(5 + poses), f)]
+        with open(filename, 'w') as f:
+            f.writelines(lines)
+
+    target = os.path.join(output_folder, filename)
+    if compression is None:
+        shutil.move(filename, target)
+        return
+    if compression == 'gzip':
+        with open(filename, 'rb') as f_in, gzip.open(target + '.gz', 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+    elif compression == 'archive':
+        archive_path = artifact_archive(target)
+        if os.path.exists(archive_path):
+            with zipfile.ZipFile(archive_path) as archive:
+                replaced = filename in archive.namelist()
+            if replaced:
+                # The coarse docking of a pair, replaced by its fine docking
+                remove_artifacts(output_folder, int(re.match(r'(?:Hdock|Score_)(\d+)_', filename).group(1)), [filename])
+        with zipfile.ZipFile(archive_path, 'a', compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.write(filename, filename)
+    else:
+        raise ValueError(f"Unknown compression {compression!r}, use None, 'gzip' or 'archive'")
+    os.remove(filename)
+    if os.path.exists(target):
+        os.remove(target)  # Left by an earlier attempt without compression
+
+def artifact_exists(path):
+    """
+    Check whether an artifact exists as a plain file, gzipped, or in the archive of its iteration.
+    """
+    if os.path.exists(path) or os.path.exists(path + '.gz'):
+        return True
+    archive = artifact_archive(path)
+    if archive is None or not os.path.exists(archive):
+        return False
+    with zipfile.ZipFile(archive) as zf:
+        return os.path.basename(path) in zf.namelist()
+
+@contextlib.contextmanager
+def open_artifact(path):
+    """
+    Open an artifact for reading as text, whether it is a plain file, gzipped, or in the archive of its iteration.
+
+    Raises:
+    FileNotFoundError: If the artifact is in none of these forms.
+    """
+    if os.path.exists(path):
+        with open(path) as f:
+            yield f
+    elif os.path.exists(path + '.gz'):
+        with gzip.open(path + '.gz', 'rt') as f:
+            yield f
+    else:
+        archive = artifact_archive(path)
+        if archive is None or not os.path.exists(archive):
+            raise FileNotFoundError(path)
+        with zipfile.ZipFile(archive) as zf:
+            try:
+                member = zf.open(os.path.basename(path))
+            except KeyError:
+                raise FileNotFoundError(path)
+            with io.TextIOWrapper(member) as f:
+                yield f
+
+def list_artifacts(output_folder, i, prefix, suffix):
+    """
+    List the names of the artifacts of iteration i starting with prefix and ending with suffix, in all their forms.
+
+    Returns:
+    list: Sorted file names, without the .gz extension.
+    """
+    names = set()
+    for filename in os.listdir(output_folder):
+        name = filename[:-len('.gz')] if filename.endswith('.gz') else filename
+        if name.startswith(prefix) and name.endswith(suffix):
+            names.add(name)
+    archive = os.path.join(output_folder, f'docking{i}.zip')
+    if os.path.exists(archive):
+        with zipfile.ZipFile(archive) as zf:
+            names.update(name for name in zf.namelist() if name.startswith(prefix) and name.endswith(suffix))
+    return sorted(names)
+
+def remove_artifacts(output_folder, i, names):
+    """
+    Delete artifacts of iteration i in all their forms; the archive of the iteration is rewritten without them.
+    """
+    names = set(names)
+    for name in names:
+        for path in [os.path.join(output_folder, name), os.path.join(output_folder, name + '.gz')]:
+            if os.path.exists(path):
+                os.remove(path)
+    archive = os.path.join(output_folder, f'docking{i}.zip')
+    if os.path.exists(archive):
+        with zipfile.ZipFile(archive) as zf:
+            if not names & set(zf.namelist()):
+                return
+            kept = [item for item in zf.infolist() if item.filename not in names]
+            if kept:
+                with zipfile.ZipFile(archive + '.tmp', 'w', compression=zipfile.ZIP_DEFLATED) as new:
+                    for item in kept:
+                        new.writestr(item, zf.read(item.filename))
+        if kept:
+            os.replace(archive + '.tmp', archive)
+        else:
+            os.remove(archive)
+
+def drop_misses(i, output_filename, pdb_files, cutoff):
+    """
+    Delete the Hdock*.out and Score_*.pdb files of the peptides of iteration i that miss the cutoff:
+    their average score is not below it, or they were not docked against every receptor (screening).
+    Call it only once the scores of the iteration have been recorded.
+
+    Returns:
+    list: Indices of the peptides whose artifacts were deleted.
+    """
+    output_folder = f'Data_output/{output_filename}_appendix'
+    scores = {}
+    for name in list_artifacts(output_folder, i, f'Hdock{i}_', '.out'):
+        score = read_hdock_score(os.path.join(output_folder, name))[1]
+        scores.setdefault(int(name.split('_')[1]), []).append(score)
+
+    misses = [j for j, s in scores.items()
+              if len(s) < len(pdb_files) or None in s or sum(s) / len(s) >= cutoff]
+    names = []
+    for j in misses:
+        for prefix, suffix in [(f'Hdock{i}_{j}_', '.out'), (f'Score_{i}_{j}_', '.pdb')]:
+            names.extend(list_artifacts(output_folder, i, prefix, suffix))
+    remove_artifacts(output_folder, i, names)
+    return sorted(misses)
+
+def screening_receptors(pdb_files, screening=None, screening_order=None):
+    """
+    Order the receptors for docking: when screening, the receptors listed in
+    screening_order go first and the others keep their order in pdb_files.
+    """
+    if screening is not None and screening_order is not None:
+        return [f for f in screening_order if f in pdb_files] + [f for f in pdb_files if f not in screening_order]
+    return list(pdb_files)
+
+def stop_screening(scores, n_receptors, screening, cutoff, best_mean, screening_margin):
+    """
+    Decide whether the remaining receptors of a peptide can be skipped.
+
+    Args:
+    scores (list): Scores of the peptide against the receptors docked so far.
+    n_receptors (int): Number of receptors of the run.
+    screening (str): 'threshold' or 'best', see docking_score.
+    cutoff (float): Score a peptide has to beat.
+    best_mean (float): Best complete mean score found so far, or None.
+    screening_margin (float): Tolerance added to the limit.
+
+    Returns:
+    bool: True if the running mean cannot plausibly beat the limit.
+    """
+    limit = cutoff
+    if screening == 'best' and best_mean is not None:
+        limit = best_mean
+    if limit is None or len(scores) >= n_receptors:
+        return False
+    return sum(scores) / len(scores) > limit + screening_margin
+
+def read_hdock_score(hdock_path):
+    """
+    Read the ligand name and the score of the top pose from a Hdock*.out file.
+    Only the header and the first pose are read, which gives the same score as
+    the 'REMARK Score' of the complex written by createpl -nmax 1.
+
+    Args:
+    hdock_path (str): Path to the Hdock*.out file, which may be gzipped or archived (see open_artifact).
 
-            subprocess.run(['hdock', pdb_input, models_file, '-out', hdock_output_file], check=True)
+    Returns:
+    tuple: (ligand name, score); the score is None if the file has no pose.
+    """
+    with open_artifact(hdock_path) as f:
+        # Header: grid spacing, angle step, initial rotation, receptor, ligand
+        for _ in range(4):
+            f.readline()
+        ligand_name = f.readline().split()[0]
+        pose = f.readline().split()
+    if len(pose) < 7:
+        return ligand_name, None
+    return ligand_name, float(pose[6])
+
+@tr.traced
+def create_complexes(i, j, pdb_files, output_filename, compression=None):
+    """
+    Write the top complex of a docked peptide with createpl (Score_{i}_{j}_{receptor}.pdb),
+    for runs where docking_score was called with write_complex=False.
 
-            # Score the docking results using createpl software
-            subprocess.run(['createpl', hdock_output_file, 'top1.pdb', '-nmax', '1', '-complex', '-models'], check=True)
-            final_score_file = f'Score_{i}_{j}_{pdb_file[:-4]}.pdb'
-            subprocess.run(['mv', 'model_1.pdb', final_score_file], check=True)
+    Args:
+    i (int): Identifier for the peptide.
+    j (int): Index of the peptide in the helixpool of iteration i.
+    pdb_files (list): List of pdb files the peptide was docked against.
+    compression (str, optional): Compression of the complexes, see save_artifact.
 
-            # Move generated files to the output_data folder
-            shutil.move(hdock_output_file, os.path.join(output_folder, hdock_output_file))
-            shutil.move(final_score_file, os.path.join(output_folder, final_score_file))
+    Returns:
+    list: Paths of the complex pdb files written.
+    """
+    output_folder = f'Data_output/{output_filename}_appendix'
 
-def get_scores(i, output_filename):
+    complexes = []
+    for pdb_file in pdb_files:
+        hdock_name = f'Hdock{i}_{j}_{pdb_file[:-4]}.out'
+        hdock_output_file = os.path.join(output_folder, hdock_name)
+        if not artifact_exists(hdock_output_file):
+            continue  # Receptor skipped by screening
+        if not os.path.exists(hdock_output_file):
+            # createpl needs a plain file: extract the compressed or archived one in the working directory
+            with open_artifact(hdock_output_file) as f_in, open(hdock_name, 'w') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            hdock_output_file = hdock_name
+        final_score_file = f'Score_{i}_{j}_{pdb_file[:-4]}.pdb'
+        jq.run_local(['createpl', hdock_output_file, 'top1.pdb', '-nmax', '1', '-complex', '-models'])
+        if hdock_output_file == hdock_name:
+            os.remove(hdock_name)
+        shutil.move('model_1.pdb', final_score_file)
+        save_artifact(final_score_file, output_folder, compression=compression)
+        complexes.append(os.path.join(output_folder, final_score_file))
+    return complexes
+
+@tr.traced
+def get_scores(i, output_filename, pdb_files=None, store=None, write_csv=True, coarse=None):
     """
-    Retrieve and calculate scores from pdb files and store them in a CSV file.
+    Retrieve and calculate scores from the top pose of the HDOCK output files and store them in a CSV file.
 
     Args:
     i (int): Identifier for the peptide.
+    pdb_files (list, optional): All receptors of the run. When given, a 'partial' column marks the peptides
+        that were not docked against every receptor (see the screening option of docking_score).
+    store (RunDatabase, optional): Results database the docking scores and average scores are appended to.
+    write_csv (bool): If True, write Get_Score{i}.csv.
+    coarse (dict, optional): Sampling of the coarse docking tier, see docking_score. When given, a 'fidelity'
+        column tells whether the scores of a peptide come from the 'fine' or the 'coarse' tier
+        ('mixed' when screening stopped the fine docking of a peptide early).
 
     Returns:
     dict: A dictionary with ligand names and their scores.
     """
     output_folder = f'Data_output/{output_filename}_appendix'
 
-    # Get pdb files from output_data folder
-    pdb_files = [f for f in os.listdir(output_folder) if f.startswith(f"Score_{i}_") and f.endswith(".pdb")]
-    pdb_files.sort()
+    # Get the HDOCK output files from output_data folder, plain, gzipped or archived
+    hdock_files = list_artifacts(output_folder, i, f"Hdock{i}_", ".out")
 
     data = {}  # Dictionary to store data
-
-    for pdb_file in pdb_files:
-        with open(os.path.join(output_folder, pdb_file), "r") as f:
-            lines = f.readlines()
-            ligand_name, score = "", ""
-            for line in lines:
-                if line.startswith("REMARK Ligand:"):
-                    ligand_name = line.split()[-1]
-                elif line.startswith("REMARK Score:"):
-                    score = line.split()[-1]
-            if ligand_name and score:
-                data.setdefault(ligand_name, {})[pdb_file.split("_")[-1][:-4]] = score
-
-    # Calculate average scores
+    ligand_index = {}  # Index of each ligand in the helixpool
+    fidelities = {}  # Docking tier of each score
+    receptors = set()
+
+    for hdock_file in hdock_files:
+        ligand_name, score = read_hdock_score(os.path.join(output_folder, hdock_file))
+        if ligand_name and score is not None:
+            receptor = hdock_file.split("_")[-1][:-4]
+            data.setdefault(ligand_name, {})[receptor] = "{:.2f}".format(score)
+            ligand_index[ligand_name] = int(hdock_file.split("_")[1])
+            receptors.add(receptor)
+            if coarse is not None:
+                fidelities.setdefault(ligand_name, {})[receptor] = hdock_fidelity(os.path.join(output_folder, hdock_file), coarse)
+
+    if pdb_files is not None:
+        receptors.update(pdb_file[:-4] for pdb_file in pdb_files)
+
+    # Calculate average scores over the receptors that were actually docked
     for ligand_name, scores in data.items():
         avg_score = sum([float(score) for score in scores.values()]) / len(scores)
+        if pdb_files is not None:
+            scores["partial"] = len(scores) < len(receptors)
         scores["score"] = "{:.3f}".format(avg_score)
+        if coarse is not None:
+            tiers = set(fidelities[ligand_name].values())
+            scores["fidelity"] = tiers.pop() if len(tiers) == 1 else "mixed"
+
+    columns = sorted(receptors) + ["score"]
+    if pdb_files is not None:
+        columns.append("partial")
+    if coarse is not None:
+        columns.append("fidelity")
+
+    if store is not None:
+        helixpool = store.helixpool(i)
+        for ligand_name, scores in data.items():
+            j = ligand_index[ligand_name]
+            store.append('docking', [(i, j, receptor, float(scores[receptor]), fidelities.get(ligand_name, {}).get(receptor))
+                                     for receptor in sorted(receptors) if receptor in scores])
+            store.append('peptide_scores', [(i, helixpool[j], float(scores["score"]), int(scores.get("partial", False)),
+                                             scores.get("fidelity"))])
+        store.flush()
 
     # Write scores to a CSV file in output_data folder
-    with open(os.path.join(output_folder, f"Get_Score{i}.csv"), "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["REMARK Ligand"] + sorted(list(data.values())[0].keys()))
-        for ligand_name, scores in data.items():
-            writer.writerow([ligand_name] + [scores.get(pdb_file, "") for pdb_file in sorted(list(scores.keys()))])
+    if write_csv:
+        with open(os.path.join(output_folder, f"Get_Score{i}.csv"), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["REMARK Ligand"] + columns)
+            for ligand_name, scores in data.items():
+                writer.writerow([ligand_name] + [scores.get(column, "") for column in columns])
 
     return data
 
-def get_peptide_score(i, output_filename):
+def parse_score(value):
+    # Score read from a CSV file; empty for the receptors that were not docked
+    return float(value) if value not in ('', None) else None
+
+def ligand_number(ligand_name):
+    # Index j in the helix pool of the ligand models{i}_{j}.pdb
+    match = re.search(r'models\d+_(\d+)\.pdb$', ligand_name)
+    return int(match.group(1)) if match is not None else None
+
+FIDELITY_RANK = {'fine': 0, 'mixed': 1, 'coarse': 2}
+
+def score_rank(record):
+    # Sort key of the peptide scores: fine-tier scores first, as coarse and fine HDOCK scores are not on the same scale,
+    # then the peptides docked against every receptor before the partial means of those screened out
+    return (FIDELITY_RANK.get(record.get('fidelity'), 0), bool(record.get('partial', False)),
+            record['score'] is None, record['score'] or 0.0)
+
+def write_records(path, records, columns):
+    # Write dict rows as a CSV file, None as an empty field
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for record in records:
+            writer.writerow(['' if record.get(column) is None else record[column] for column in columns])
+
+@tr.traced
+def get_peptide_score(i, output_filename, store=None, write_csv=True, scores=None, helixpool=None, pdb_files=None):
     """
     Get scores for peptides and sort them.
 
     Args:
     i (int): Identifier for the peptide.
+    store (RunDatabase, optional): Results database to read the helix pool and the scores from.
+        If None, helixpool{i}.csv and Get_Score{i}.csv are read.
+    write_csv (bool): If True, write peptide_score{i}.csv.
+    scores (dict, optional): Output of get_scores. With helixpool, the records are built from it directly
+        and nothing is read back.
+    helixpool (list, optional): The helix pool of the iteration, see ph.create_helixpool.
+    pdb_files (list, optional): All receptors of the run, as for get_scores, so that the receptors no peptide
+        was docked against keep their column when the records are built from scores or the database.
+
     Returns:
-    DataFrame: A DataFrame with peptides and their scores.
+    list: One dict per peptide, {'helixpool': peptide, <receptor>: score, ..., 'score': average, 'partial': bool},
+        best average score first; with a coarse docking tier, the peptides scored by the fine tier come first,
+        then the 'mixed' and the 'coarse' ones, so that only fine-tier scores decide the put-back while there are enough.
+        Within a tier, the peptides docked against every receptor come before the partial ones.
     """
     output_folder = f'Data_output/{output_filename}_appendix'
 
-    # Get all CSV files in the output_data folder
-    all_files = glob.glob(os.path.join(output_folder, "*.csv"))
-    helix_file = os.path.join(output_folder, f"helixpool{i}.csv")
-    score_file = os.path.join(output_folder, f"Get_Score{i}.csv")
-
-    if helix_file in all_files and score_file in all_files:
-        df_helix = pd.read_csv(helix_file)
-        df_score = pd.read_csv(score_file)
-
-        # Merge DataFrame objects
-        df_merged = pd.concat([df_helix, df_score], axis=1)
-        df_merged = df_merged.drop(columns=["REMARK Ligand"])
-        df_merged.sort_values(by="score", inplace=True)
-
-        # Save the merged DataFrame in the output_data folder
-        merged_file_path = os.path.join(output_folder, f"peptide_score{i}.csv")
-        df_merged.to_csv(merged_file_path, index=False)
-
-    return df_merged
-
-def create_dockingpool(i, N_putBack, output_filename):
+    if scores is not None and helixpool is not None:
+        receptors = {column for ligand_scores in scores.values() for column in ligand_scores
+                     if column not in ('score', 'partial', 'fidelity')}
+        receptors = sorted(receptors.union(pdb_file[:-4] for pdb_file in pdb_files or []))
+        records = []
+        for ligand_name, ligand_scores in scores.items():
+            j = ligand_number(ligand_name)
+            if j is None:
+                continue
+            record = {'helixpool': helixpool[j]}
+            record.update({receptor: parse_score(ligand_scores.get(receptor)) for receptor in receptors})
+            record['score'] = float(ligand_scores['score'])
+            for column in ('partial', 'fidelity'):
+                if column in ligand_scores:
+                    record[column] = ligand_scores[column]
+            records.append(record)
+        records.sort(key=score_rank)
+        columns = ["helixpool"] + receptors + ["score"]
+        for column in ('partial', 'fidelity'):
+            if any(column in ligand_scores for ligand_scores in scores.values()):
+                columns.append(column)
+    elif store is not None:
+        peptide_index = {p: j for j, p in enumerate(store.helixpool(i))}
+        docking = {}
+        for j, receptor, score in store.docking_scores(i):
+            docking.setdefault(j, {})[receptor] = score
+        receptors = {receptor for scores in docking.values() for receptor in scores}
+        receptors = sorted(receptors.union(pdb_file[:-4] for pdb_file in pdb_files or []))
+        records = []
+        for peptide, score, partial, fidelity in store.peptide_scores(i):
+            scores = docking.get(peptide_index[peptide], {})
+            records.append({'helixpool': peptide, **{receptor: scores.get(receptor) for receptor in receptors},
+                            'score': score, 'partial': bool(partial)})
+            if fidelity is not None:
+                records[-1]['fidelity'] = fidelity
+        columns = ["helixpool"] + receptors + ["score", "partial"]
+        if any('fidelity' in record for record in records):
+            columns.append("fidelity")
+    else:
+        # The rows of Get_Score{i}.csv are matched to helixpool{i}.csv by the ligand file models{i}_{j}.pdb
+        with open(os.path.join(output_folder, f"helixpool{i}.csv"), newline='') as f:
+            helixpool = [row[0] for row in list(csv.reader(f))[1:]]
+        with open(os.path.join(output_folder, f"Get_Score{i}.csv"), newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader)[1:]  # Without the "REMARK Ligand" column
+            records = []
+            for row in reader:
+                j = ligand_number(row[0])
+                if j is None:
+                    continue
+                record = {'helixpool': helixpool[j]}
+                for column, value in zip(header, row[1:]):
+                    if column == 'partial':
+                        record[column] = value == 'True'
+                    elif column == 'fidelity':
+                        record[column] = value
+                    else:
+                        record[column] = parse_score(value)
+                records.append(record)
+        records.sort(key=score_rank)
+        columns = ["helixpool"] + header
+
+    if write_csv:
+        write_records(os.path.join(output_folder, f"peptide_score{i}.csv"), records, columns)
+    return records
+
+@tr.traced
+def create_dockingpool(i, N_putBack, output_filename, store=None, write_csv=True, peptide_scores=None):
     """
     Create a docking pool from sorted peptides.
 
     Args:
     i (int): Identifier for the peptide.
     N_putBack (int): Number of peptides to put back in the pool.
+    store (RunDatabase, optional): Results database to read the sorted peptide scores from.
+        If None, peptide_score{i}.csv is read.
+    write_csv (bool): If True, write dockingpool{i}.csv.
+    peptide_scores (list, optional): Output of get_peptide_score, used instead of the database or the CSV file.
 
     Returns:
     list: A list of peptides in the docking pool.
@@ -157,19 +727,25 @@ def create_dockingpool(i, N_putBack, output_filename):
     peptide_score_file = os.path.join(output_folder, f'peptide_score{i}.csv')
     docking_pool_file = os.path.join(output_folder, f'dockingpool{i}.csv')
 
-    with open(peptide_score_file, 'r') as csvfile:
-        dockingpool = []
-        reader = csv.reader(csvfile)
-        next(reader)  # Skip the header row
-        for row in reader:
-            dockingpool.append(row[0])
-            if len(dockingpool) == N_putBack:
-                break
+    if peptide_scores is not None:
+        dockingpool = [record['helixpool'] for record in peptide_scores[:N_putBack]]
+    elif store is not None:
+        dockingpool = [row[0] for row in store.peptide_scores(i)[:N_putBack]]
+    else:
+        with open(peptide_score_file, 'r') as csvfile:
+            dockingpool = []
+            reader = csv.reader(csvfile)
+            next(reader)  # Skip the header row
+            for row in reader:
+                dockingpool.append(row[0])
+                if len(dockingpool) == N_putBack:
+                    break
 
     # Save the docking pool to a CSV file in the output_data folder
-    with open(docking_pool_file, 'w') as f:
-        f.write('dockingpool\n')
-        for p in dockingpool:
-            f.write(f"{p}\n")
+    if write_csv:
+        with open(docking_pool_file, 'w') as f:
+            f.write('dockingpool\n')
+            for p in dockingpool:
+                f.write(f"{p}\n")
 
     return dockingpool
@@ -0,0 +1,106 @@
+"""
+Version 1.0,
+Incremental selection of the peptides that beat the score threshold.
+
+The scores of each iteration are passed to HitSelector.add() as soon as they
+are known. Qualifying peptides are appended to a stream file in the appendix
+folder, so memory stays constant however many iterations run; with top_k only
+the k best hits are kept, in a bounded heap. finish() writes
+<output_filename>.csv once, atomically, at the end of the run.
+"""
+
+
+import os
+import csv
+import heapq
+
+class HitSelector(object):
+    """
+    Peptides of a run whose complete average score is below the threshold.
+
+    Args:
+    threshold (float): The threshold score for selecting peptides.
+    receptors (list): Names of the receptors (pdb files without .pdb), the score columns of the output.
+    stream_file (str): File the qualifying rows are appended to (without header).
+    top_k (int, optional): Keep only the k best hits. Defaults to all hits.
+    state (dict, optional): Output of state() saved in a checkpoint, to resume a run.
+    """
+    def __init__(self, threshold, receptors, stream_file, top_k=None, state=None):
+        self.threshold = threshold
+        self.columns = ['helixpool'] + sorted(receptors) + ['score', 'partial']
+        self.stream_file = stream_file
+        self.top_k = top_k
+        state = state or {'offset': 0, 'heap': [], 'count': 0}
+        self.heap = [tuple(item[:2]) + (list(item[2]),) for item in state['heap']]
+        self.count = state['count']
+        # Rows written after the last checkpoint belong to an iteration that is done again
+        with open(stream_file, 'a') as f:
+            f.truncate(state['offset'])
+        self.stream = open(stream_file, 'a', newline='')
+        self.writer = csv.writer(self.stream)
+
+    def add(self, peptide_scores):
+        """
+        Add the scores of one iteration.
+
+        Args:
+        peptide_scores (list): Output of hs.get_peptide_score, dicts with the keys helixpool,
+            the score against each receptor, score and (optionally) partial and fidelity.
+
+        Returns:
+        int: Number of hits in this iteration.
+        """
+        n_hits = 0
+        for record in peptide_scores:
+            # Scores of peptides whose docking was stopped early by screening, or only done by the
+            # coarse docking tier, are not comparable
+            if not record['score'] < self.threshold or record.get('partial', False):
+                continue
+            if record.get('fidelity', 'fine') != 'fine':
+                continue
+            row = [record.get(column, '') for column in self.columns]
+            row[-1] = bool(record.get('partial', False))
+            self.writer.writerow(row)
+            if self.top_k is not None:
+                # Min-heap on -score: the root is the worst of the k best hits
+                item = (-record['score'], -self.count, row)
+                if len(self.heap) < self.top_k:
+                    heapq.heappush(self.heap, item)
+                elif item > self.heap[0]:
+                    heapq.heapreplace(self.heap, item)
+            self.count += 1
+            n_hits += 1
+        self.stream.flush()
+        return n_hits
+
+    def state(self):
+        """
+        Return the state to save in a checkpoint (JSON serialisable).
+        """
+        self.stream.flush()
+        return {'offset': self.stream.tell(), 'heap': list(self.heap), 'count': self.count}
+
+    def finish(self, output_file):
+        """
+        Write the hits to output_file, replacing it atomically: all hits in the order they were found,
+        or the top_k best ones sorted by score.
+
+        Returns:
+        list: The peptides written.
+        """
+        self.stream.close()
+        hits = []
+        with open(output_file + '.tmp', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns)
+            if self.top_k is None:
+                with open(self.stream_file, newline='') as stream:
+                    for row in csv.reader(stream):
+                        writer.writerow(row)
+                        hits.append(row[0])
+            else:
+                for _, _, row in sorted(self.heap, reverse=True):
+                    writer.writerow(row)
+                    hits.append(row[0])
+        os.replace(output_file + '.tmp', output_file)
+        return hits
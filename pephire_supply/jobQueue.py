@@ -0,0 +1,422 @@
+"""
+Version 1.0,
+Executors for the external tools run by the PSIPRED and docking stages.
+
+A job is a dict {'args': [...], 'cwd': path, 'quiet': bool, 'priority': number}. Executors run a
+list of jobs with run(jobs, on_done=None), calling on_done(job) as each job finishes.
+LocalExecutor runs the jobs one after the other in this process (the default).
+QueueExecutor puts them into a SQLite job queue on a shared filesystem, from
+which `python pephire.py worker <queue>` processes on any node claim them.
+A claimed job is leased to its worker, the worker renews the lease with
+heartbeats while the tool runs, and jobs whose lease expired (worker killed,
+node lost) are handed out again, up to max_attempts times. When a job fails,
+the unfinished jobs of its batch are cancelled.
+ScheduledExecutor runs the jobs concurrently on this node, as many at a time
+as the free cores, the memory budget and the load of the node allow, with the
+cores and memory of each tool learned from its past jobs.
+"""
+
+
+import os
+import math
+import json
+import time
+import zlib
+import socket
+import sqlite3
+import subprocess
+from pephire_supply import tracing as tr
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    args TEXT, cwd TEXT, quiet INTEGER,
+    status TEXT DEFAULT 'queued',
+    worker TEXT, lease_until REAL, attempts INTEGER DEFAULT 0, returncode INTEGER,
+    submitted REAL, started REAL, finished REAL);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, lease_until);
+"""
+
+def make_job(args, cwd=None, quiet=False, priority=0):
+    # The working directory is stored as an absolute path so that workers started elsewhere find the files.
+    # Jobs of lower priority values are started first by ScheduledExecutor, e.g. the best-ranked candidates.
+    return {'args': list(args), 'cwd': os.path.abspath(cwd or os.getcwd()), 'quiet': quiet, 'priority': priority}
+
+
+def run_local(args, cwd=None, stdout=None):
+    """
+    Run an external tool in this process, recording it in the trace when tracing is enabled.
+
+    Raises:
+    subprocess.CalledProcessError: If the tool exits with a non-zero status.
+    """
+    if not tr.enabled():
+        tr.count_call(args)
+        subprocess.run(args, cwd=cwd, stdout=stdout, check=True)
+        return
+    ts, t0 = time.time(), time.perf_counter()
+    returncode = subprocess.run(args, cwd=cwd, stdout=stdout).returncode
+    tr.record_subprocess(args, ts, time.perf_counter() - t0, returncode)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, args)
+
+
+class LocalExecutor(object):
+    """
+    Runs jobs sequentially in the current process.
+    """
+    def run(self, jobs, on_done=None):
+        for job in jobs:
+            stdout = subprocess.DEVNULL if job.get('quiet') else None
+            run_local(job['args'], cwd=job.get('cwd'), stdout=stdout)
+            if on_done is not None:
+                on_done(job)
+
+
+class JobQueue(object):
+    """
+    SQLite job queue shared by the submitting process and the workers.
+
+    Args:
+    path (str): Path to the queue database, on a filesystem shared by all nodes.
+    lease (float): Seconds a claimed job stays assigned to a worker without a heartbeat.
+    max_attempts (int): Number of times a job is handed out before it is marked as failed.
+    """
+    def __init__(self, path, lease=60.0, max_attempts=3):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.executescript(SCHEMA)
+
+    def submit(self, jobs):
+        """
+        Add jobs to the queue.
+
+        Returns:
+        list: The ids of the jobs.
+        """
+        ids = []
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        for job in jobs:
+            cursor = self.conn.execute('INSERT INTO jobs (args, cwd, quiet, submitted) VALUES (?, ?, ?, ?)',
+                                       (json.dumps(job['args']), job['cwd'], int(job.get('quiet', False)), now))
+            ids.append(cursor.lastrowid)
+        self.conn.execute('COMMIT')
+        return ids
+
+    def claim(self, worker):
+        """
+        Claim the oldest queued job, or a running job whose lease has expired.
+
+        Returns:
+        dict: The job with its 'id', or None if there is nothing to do.
+        """
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Jobs of workers that stopped sending heartbeats go back to the queue
+            self.conn.execute("UPDATE jobs SET status = 'failed', finished = ? WHERE status = 'running' "
+                              "AND lease_until < ? AND attempts >= ?", (now, now, self.max_attempts))
+            row = self.conn.execute("SELECT id, args, cwd, quiet FROM jobs WHERE status = 'queued' "
+                                    "OR (status = 'running' AND lease_until < ?) ORDER BY id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, "
+                              "attempts = attempts + 1, started = ? WHERE id = ?",
+                              (worker, now + self.lease, now, row[0]))
+        finally:
+            self.conn.execute('COMMIT')
+        return {'id': row[0], 'args': json.loads(row[1]), 'cwd': row[2], 'quiet': bool(row[3])}
+
+    def heartbeat(self, job_id, worker):
+        """
+        Renew the lease of a running job.
+
+        Returns:
+        bool: False if the job is no longer assigned to this worker.
+        """
+        cursor = self.conn.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                                   (time.time() + self.lease, job_id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker, returncode):
+        status = 'done' if returncode == 0 else 'failed'
+        self.conn.execute("UPDATE jobs SET status = ?, returncode = ?, finished = ? "
+                          "WHERE id = ? AND worker = ? AND status = 'running'",
+                          (status, returncode, time.time(), job_id, worker))
+
+    def status(self, ids):
+        """
+        Return {id: (status, returncode, args)} for the given jobs.
+        """
+        result = {}
+        for k in range(0, len(ids), 500):
+            chunk = ids[k:k + 500]
+            rows = self.conn.execute(f"SELECT id, status, returncode, args FROM jobs WHERE id IN ({', '.join('?' * len(chunk))})",
+                                     chunk).fetchall()
+            for job_id, status, returncode, args in rows:
+                result[job_id] = (status, returncode, json.loads(args))
+        return result
+
+    def cancel(self, ids):
+        """
+        Cancel the jobs that are not finished: the queued ones are no longer handed out, and the workers
+        running the others stop them at their next heartbeat.
+        """
+        now = time.time()
+        for k in range(0, len(ids), 500):
+            chunk = ids[k:k + 500]
+            self.conn.execute("UPDATE jobs SET status = 'cancelled', finished = ? WHERE status IN ('queued', 'running') "
+                              f"AND id IN ({', '.join('?' * len(chunk))})", [now] + chunk)
+
+    def times(self, job_id):
+        """
+        Return (submitted, started, finished, worker) of a job.
+        """
+        return self.conn.execute('SELECT submitted, started, finished, worker FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+    def close(self):
+        self.conn.close()
+
+
+class QueueExecutor(object):
+    """
+    Runs jobs through a JobQueue and waits until the workers have finished them.
+
+    Args:
+    path (str): Path to the queue database.
+    poll (float): Seconds between two checks of the job status.
+    """
+    def __init__(self, path, poll=0.2):
+        self.queue = JobQueue(path)
+        self.poll = poll
+
+    def run(self, jobs, on_done=None):
+        if len(jobs) == 0:
+            return
+        ids = self.queue.submit(jobs)
+        pending = dict(zip(ids, jobs))
+        try:
+            while pending:
+                status = self.queue.status(list(pending))
+                for job_id in list(pending):
+                    job_status, returncode, args = status[job_id]
+                    if job_status == 'failed':
+                        raise subprocess.CalledProcessError(returncode if returncode is not None else -1, args)
+                    if job_status == 'done':
+                        job = pending.pop(job_id)
+                        tr.count_call(args)
+                        if tr.enabled():
+                            submitted, started, finished, worker_name = self.queue.times(job_id)
+                            tr.record_subprocess(args, started, finished - started, returncode, wait=started - submitted,
+                                                 tid=zlib.crc32(worker_name.encode()), worker=worker_name)
+                        if on_done is not None:
+                            on_done(job)
+                if pending:
+                    time.sleep(self.poll)
+        except BaseException:
+            # A failed job or an interruption ends the batch: the workers do not go on with the rest of it,
+            # and a resumed run submits its jobs again
+            self.queue.cancel(list(pending))
+            raise
+
+
+def available_memory():
+    # MemAvailable of /proc/meminfo in MB, None where it is not available
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+
+class ScheduledExecutor(object):
+    """
+    Runs jobs concurrently on this node within its cores, memory and load.
+
+    Each tool has a profile, learned from its finished jobs (exponential moving averages): wall time,
+    cores used (CPU time / wall time, below 1 for light or waiting tools) and peak memory. A job is
+    started when the cores of its profile are free and its memory fits in the budget; it is pinned to
+    the least loaded cores, so that light jobs share cores and heavy ones get their own. Cores busy
+    with other processes of the node are not used: the 1-minute load average, less the load of the
+    jobs of this executor (averaged over the last minute like the load average), is taken off the
+    free cores. Jobs are started by priority, then longest expected first.
+
+    Args:
+    memory (float, optional): Memory budget in MB. Defaults to 80% of the available memory.
+    profile (str, optional): JSON file the tool profiles are loaded from and saved to, so that later runs start with them.
+    poll (float): Seconds between two checks of the running jobs.
+    smoothing (float): Weight of the last job in the moving averages.
+    """
+    DEFAULTS = {'wall': 1.0, 'cores': 1.0, 'memory': 256.0}
+
+    def __init__(self, memory=None, profile=None, poll=0.05, smoothing=0.3):
+        self.cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+        if memory is None:
+            memory = available_memory()
+            memory = 0.8 * memory if memory is not None else None
+        self.memory = memory
+        self.profile_file = profile
+        self.poll = poll
+        self.smoothing = smoothing
+        self.profiles = {}
+        self.own_load, self.load_time = 0.0, time.time()
+        if profile is not None and os.path.exists(profile):
+            with open(profile) as f:
+                self.profiles = json.load(f)
+
+    def expected(self, job):
+        return self.profiles.get(os.path.basename(job['args'][0]), self.DEFAULTS)
+
+    def learn(self, tool, wall, cpu, memory):
+        observed = {'wall': wall, 'cores': max(0.05, cpu / wall) if wall > 0 else 1.0, 'memory': memory}
+        if tool not in self.profiles:
+            self.profiles[tool] = dict(observed, jobs=0)
+        profile = self.profiles[tool]
+        for key, value in observed.items():
+            profile[key] += self.smoothing * (value - profile[key])
+        profile['jobs'] += 1
+
+    def save_profiles(self):
+        if self.profile_file is None:
+            return
+        with open(self.profile_file + '.tmp', 'w') as f:
+            json.dump(self.profiles, f, indent=1)
+        os.replace(self.profile_file + '.tmp', self.profile_file)
+
+    def free_cores(self, running):
+        # Number of cores not used by the running jobs, less those busy with the rest of the node
+        used = sum(job['cores'] for job in running.values())
+        now = time.time()
+        decay = math.exp(-(now - self.load_time) / 60.0)
+        self.own_load = self.own_load * decay + used * (1 - decay)
+        self.load_time = now
+        busy = max(0.0, os.getloadavg()[0] - self.own_load) if hasattr(os, 'getloadavg') else 0.0
+        return len(self.cores) - used - round(busy)
+
+    def pin(self, n_cores, running):
+        # The n least loaded cores
+        load = {core: 0.0 for core in self.cores}
+        for job in running.values():
+            for core in job['pinned']:
+                load[core] += job['cores'] / len(job['pinned'])
+        return sorted(self.cores, key=lambda core: load[core])[:n_cores]
+
+    def start(self, job, running):
+        expected = self.expected(job)
+        pinned = self.pin(min(len(self.cores), math.ceil(expected['cores'])), running)
+
+        def set_affinity():
+            if hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, pinned)
+        stdout = subprocess.DEVNULL if job.get('quiet') else None
+        ts, t0 = time.time(), time.perf_counter()
+        process = subprocess.Popen(job['args'], cwd=job.get('cwd'), stdout=stdout, preexec_fn=set_affinity)
+        return {'job': job, 'process': process, 'pinned': pinned, 'ts': ts, 't0': t0,
+                'cores': min(len(self.cores), expected['cores']), 'memory': expected['memory']}
+
+    def run(self, jobs, on_done=None):
+        pending = sorted(jobs, key=lambda job: (job.get('priority', 0), -self.expected(job)['wall']))
+        running, submitted = {}, time.perf_counter()
+        try:
+            while pending or running:
+                # Start every pending job that fits, in order; a node with no running job always takes one
+                free = self.free_cores(running)
+                memory_used = sum(job['memory'] for job in running.values())
+                for job in list(pending):
+                    expected = self.expected(job)
+                    fits = (min(len(self.cores), expected['cores']) <= free + 1e-9 and
+                            (self.memory is None or memory_used + expected['memory'] <= self.memory))
+                    if not fits and running:
+                        continue
+                    started = self.start(job, running)
+                    running[started['process'].pid] = started
+                    free -= started['cores']
+                    memory_used += started['memory']
+                    pending.remove(job)
+
+                # Reap the finished jobs with their resource usage
+                finished = False
+                for pid in list(running):
+                    reaped, status, usage = os.wait4(pid, os.WNOHANG)
+                    if reaped == 0:
+                        continue
+                    finished = True
+                    job = running.pop(pid)
+                    job['process'].returncode = os.waitstatus_to_exitcode(status)
+                    wall = time.perf_counter() - job['t0']
+                    tool = os.path.basename(job['job']['args'][0])
+                    self.learn(tool, wall, usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024)
+                    tr.record_subprocess(job['job']['args'], job['ts'], wall, job['process'].returncode,
+                                         wait=job['t0'] - submitted, tid=pid, cores=job['pinned'])
+                    if job['process'].returncode != 0:
+                        raise subprocess.CalledProcessError(job['process'].returncode, job['job']['args'])
+                    if on_done is not None:
+                        on_done(job['job'])
+                if not finished and running:
+                    time.sleep(self.poll)
+        finally:
+            for job in running.values():
+                job['process'].kill()
+                job['process'].wait()
+            self.save_profiles()
+
+
+def get_executor(params):
+    """
+    Create the executor selected in parameters.txt (executor = 'local', 'queue' or 'scheduler').
+    """
+    if params.get('executor', 'local') == 'queue':
+        return QueueExecutor(params['job_queue'])
+    if params.get('executor', 'local') == 'scheduler':
+        return ScheduledExecutor(memory=params.get('scheduler_memory'), profile=params.get('scheduler_profile'))
+    return LocalExecutor()
+
+
+def worker(path, name=None, lease=60.0, poll=1.0, idle_exit=None):
+    """
+    Claim and run jobs from a queue until interrupted.
+
+    Args:
+    path (str): Path to the queue database.
+    name (str, optional): Name of the worker. Defaults to <hostname>:<pid>.
+    lease (float): Lease of a claimed job in seconds; heartbeats are sent every lease/3 seconds.
+    poll (float): Seconds to wait when the queue is empty.
+    idle_exit (float, optional): Stop after this many seconds without a job.
+    """
+    queue = JobQueue(path, lease=lease)
+    name = name or f'{socket.gethostname()}:{os.getpid()}'
+    idle_since = time.time()
+    try:
+        while True:
+            job = queue.claim(name)
+            if job is None:
+                if idle_exit is not None and time.time() - idle_since > idle_exit:
+                    return
+                time.sleep(poll)
+                continue
+
+            stdout = subprocess.DEVNULL if job['quiet'] else None
+            try:
+                process = subprocess.Popen(job['args'], cwd=job['cwd'], stdout=stdout)
+            except OSError:
+                queue.complete(job['id'], name, 127)
+                continue
+            while True:
+                try:
+                    process.wait(timeout=lease / 3)
+                except subprocess.TimeoutExpired:
+                    if not queue.heartbeat(job['id'], name):
+                        process.kill()  # The job was given to another worker, or cancelled
+                        process.wait()
+                        break
+                else:
+                    queue.complete(job['id'], name, process.returncode)
+                    break
+            idle_since = time.time()
+    finally:
+        queue.close()
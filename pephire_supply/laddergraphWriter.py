@@ -0,0 +1,198 @@
+"""
+Version 1.0,
+Laddergraph of large pools, written as DOT or JSON in one streaming pass.
+
+STRMAT.laddergraph builds a graphviz object node by node and finds the
+letters of each ladderon by scanning the whole ladderonBook again, which is
+quadratic in the number of ladderons. Here the ladderonBook is read once to
+collect the edges (with their multiplicities), the ladderons used in each
+node and the levels of the nodes (as in calculatePOM: letters are level 0,
+a ladderon made of letters only is level 1, any other node is one level above
+its highest component), then nodes and edges are written to the file as they
+are produced. The nodes and edges are those of laddergraph:
+    - targets: IDs 0..n-1, ladderons: their group ID, letters: negative IDs,
+    - an edge component -> node for each copy of a ladderon in a node,
+    - an edge letter -> node for each letter of a node not covered by its ladderons.
+Filters keep the graph readable on production-size pools: levels, ladderon
+length, the subtree of the components of one node, and multi-edges merged
+into one edge with a count.
+"""
+
+
+import json
+from collections import Counter
+
+def graphNodes(strMat):
+    """
+    Nodes, component edges and levels of a ladderpath.
+
+    Args:
+    strMat (STRMAT): The result of lp.ladderpath(strs).
+
+    Returns:
+    tuple: ({ID: node dict}, Counter of (component ID, node ID) edges, {ID: Counter of the letters not covered}).
+    """
+    nodes, edges, used = {}, Counter(), {}
+    for k, seq in enumerate(strMat.strs):
+        nodes[k] = {'id': k, 'kind': 'target', 'label': seq, 'length': len(seq), 'multiplicity': 1}
+    ID = 0
+    for letter, multiplicity in strMat.ladderonBookLevel0.items():
+        ID -= 1
+        nodes[ID] = {'id': ID, 'kind': 'letter', 'label': letter, 'length': 1, 'level': 0, 'multiplicity': multiplicity}
+    letterIDs = {node['label']: ID for ID, node in nodes.items() if node['kind'] == 'letter'}
+
+    aliases = {}  # target index -> ladderon ID, for targets that are also ladderons
+    for ladderon, val in strMat.ladderonBook.items():
+        ID = val[0]
+        nExtra = strMat.ladderonBookDupsExtra[ladderon][1] if ladderon in strMat.ladderonBookDupsExtra else 0
+        if ID not in nodes:
+            nodes[ID] = {'id': ID, 'kind': 'ladderon', 'label': ladderon, 'length': len(ladderon)}
+        nodes[ID]['multiplicity'] = len(val) - 1 + nExtra
+        if ladderon in strMat.targetBook and strMat.targetBook[ladderon] != ID:
+            aliases[strMat.targetBook[ladderon]] = ID
+            nodes[ID]['target'] = strMat.targetBook[ladderon]
+        for upper1, _, upper2, _ in val[1:]:
+            for upper in (upper1, upper2):
+                if upper != ID:
+                    edges[ID, upper] += 1
+                    used.setdefault(upper, Counter()).update(ladderon)
+
+    # Letters left in each node once its ladderons are taken out
+    letters = {}
+    for ID, node in nodes.items():
+        if node['kind'] == 'letter' or ID in aliases:
+            continue
+        left = Counter(node['label'])
+        left.subtract(used.get(ID, Counter()))
+        letters[ID] = Counter({letterIDs[letter]: n for letter, n in left.items() if n > 0})
+
+    # Levels, from the components up (iterative, the graph can be deep)
+    components = {}
+    for component, node in edges:
+        components.setdefault(node, set()).add(component)
+    for start in nodes:
+        stack = [start]
+        while stack:
+            ID = stack[-1]
+            if 'level' in nodes[ID]:
+                stack.pop()
+                continue
+            todo = [c for c in components.get(ID, ()) if 'level' not in nodes[c]]
+            if todo:
+                stack.extend(todo)
+                continue
+            nodes[ID]['level'] = 1 + max([nodes[c]['level'] for c in components.get(ID, ())] or [0])
+            stack.pop()
+    for target, ID in aliases.items():
+        nodes[target]['alias'] = ID
+    return nodes, edges, letters
+
+def subtree(root, edges, letters):
+    # IDs of the node root and of all its components
+    components = {}
+    for component, node in edges:
+        components.setdefault(node, set()).add(component)
+    for node, left in letters.items():
+        components.setdefault(node, set()).update(left)
+    keep, stack = set(), [root]
+    while stack:
+        ID = stack.pop()
+        if ID not in keep:
+            keep.add(ID)
+            stack.extend(components.get(ID, ()))
+    return keep
+
+def writeLaddergraph(strMat, path, fmt=None, minLevel=None, maxLevel=None, minLength=None, maxLength=None,
+                     root=None, showLetters=True, showTargets=True, aggregate=True, style='box', color='grey',
+                     rankdir='BT'):
+    """
+    Write the laddergraph of a ladderpath as a DOT or JSON file, without building it in memory.
+
+    Args:
+    strMat (STRMAT): The result of lp.ladderpath(strs).
+    path (str): Output file, e.g. 'G.dot' (render with `dot -Tsvg G.dot -o G.svg`) or 'G.json'.
+    fmt (str, optional): 'dot' or 'json'. Defaults to the extension of path.
+    minLevel, maxLevel (int, optional): Levels of the ladderons and letters shown (letters are level 0).
+    minLength, maxLength (int, optional): Lengths of the ladderons and letters shown.
+    root (int or str, optional): Only show this node (ID, or sequence of a target or ladderon) and its components.
+    showLetters (bool): If False, the letters and their edges are omitted.
+    showTargets (bool): If False, the targets and their edges are omitted.
+    aggregate (bool): If True, the copies of an edge are written as one edge with a count, else one edge per copy.
+    style (str): 'box' shows the sequences, 'ellipse' the IDs with a size growing with the length, as laddergraph.
+    color (str): Color of the ladderons and letters.
+    rankdir (str): Direction of the DOT graph, BT, TB, LR or RL.
+
+    Returns:
+    tuple: (number of nodes, number of edges) written.
+    """
+    fmt = fmt or ('json' if path.endswith('.json') else 'dot')
+    nodes, edges, letters = graphNodes(strMat)
+
+    def shown(node):
+        if node['kind'] == 'target':
+            return showTargets
+        if node['kind'] == 'letter' and not showLetters:
+            return False
+        return ((minLevel is None or node['level'] >= minLevel) and (maxLevel is None or node['level'] <= maxLevel) and
+                (minLength is None or node['length'] >= minLength) and (maxLength is None or node['length'] <= maxLength))
+
+    keep = None
+    if root is not None:
+        if isinstance(root, str):
+            IDs = [ID for ID, node in nodes.items() if node['label'] == root and 'alias' not in node]
+            if not IDs:
+                raise ValueError(f'{root} is not a target or a ladderon of this ladderpath')
+            root = IDs[0]
+        keep = subtree(root, edges, letters)
+    visible = {ID for ID, node in nodes.items() if shown(node) and (keep is None or ID in keep)}
+
+    def allEdges():
+        for (component, node), n in edges.items():
+            yield component, node, n
+        for node, left in letters.items():
+            for letter, n in left.items():
+                yield letter, node, n
+
+    nNodes, nEdges = 0, 0
+    with open(path, 'w') as f:
+        if fmt == 'json':
+            f.write('{"nodes": [')
+            for ID in sorted(visible):
+                f.write((',\n' if nNodes else '\n') + json.dumps(nodes[ID]))
+                nNodes += 1
+            f.write('\n], "edges": [')
+            for source, target, n in allEdges():
+                if source in visible and target in visible:
+                    f.write((',\n' if nEdges else '\n') + json.dumps({'source': source, 'target': target, 'count': n}))
+                    nEdges += 1
+            f.write('\n]}\n')
+            return nNodes, nEdges
+
+        f.write(f'digraph Laddergraph {{\n  rankdir={rankdir}\n  node [shape={"box" if style == "box" else "ellipse"}]\n')
+        for ID in sorted(visible):
+            node = nodes[ID]
+            if style == 'box':
+                label = node['label'] + (' (&)' if 'alias' in node else '')
+                attrs = f'label="{label}"'
+            else:
+                size = (node['length'] ** (1 / 3)) / 2  # As ellipse_len in ladderpath.py
+                label = f"{ID}({node['alias']})" if 'alias' in node else str(ID)
+                attrs = f'label="{label}" width={size:.3f} height={size / 2:.3f}'
+            if node['kind'] == 'ladderon':
+                attrs += f' style=filled color="{color}"'
+            elif node['kind'] == 'letter':
+                attrs += f' shape=hexagon style=filled color="{color}"'
+            f.write(f'  "{ID}" [{attrs}]\n')
+            nNodes += 1
+        for source, target, n in allEdges():
+            if source in visible and target in visible:
+                attrs = f' [color="{color}"]' if style != 'box' else ''
+                if aggregate:
+                    if n > 1:
+                        attrs = f' [label="{n}" penwidth={1 + min(n, 9) / 3:.2f}' + (f' color="{color}"]' if style != 'box' else ']')
+                    f.write(f'  "{source}" -> "{target}"{attrs}\n')
+                else:
+                    f.write(f'  "{source}" -> "{target}"{attrs}\n' * n)
+                nEdges += 1 if aggregate else n
+        f.write('}\n')
+    return nNodes, nEdges
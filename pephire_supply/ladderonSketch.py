@@ -0,0 +1,218 @@
+"""
+Version 1.0,
+Approximate ladderons of large pools, for gp.getPipPoolBook(sketch=...).
+
+The exact ladderpath decomposition does not scale to pools of 10^4-10^5
+sequences. Here the k-mers of the pool (k = 2..maxLen) are counted in one
+streaming pass, chunk by chunk, into a count-min sketch per k; a second pass
+collects the k-mers whose estimated count reaches minSupport (the candidate
+ladderons) with their positions.
+
+Multiplicities follow the greedy decomposition of ladderpath, on counts:
+the candidates are taken from the longest to the shortest; the free
+occurrences of a candidate s are its occurrences that are not inside the
+copies of a longer ladderon t already taken,
+
+    free(s) = c(s) - sum over t of occ(s in t) * m(t),
+
+and s is a ladderon with multiplicity m(s) = free(s) - 1 (one occurrence is
+built, the others are copies) when free(s) >= 2. Single letters are counted
+exactly and kept with multiplicity max(1, free(letter)), as they fill the
+gaps left by the other ladderons.
+
+Error bound: the sketch of length k has width w = 2^ceil(log2(e/epsilon))
+and depth d = ceil(ln(1/delta)). Each estimate satisfies
+c(s) <= c_est(s) <= c(s) + epsilon * T_k with probability at least 1 - delta,
+T_k being the number of k-mers of length k in the pool. The width makes
+epsilon * T_k < 1 (every count exact with probability 1 - delta) as long as
+T_k < 1/epsilon, i.e. 10^5 k-mers with the default epsilon = 1e-5; beyond,
+a count is overestimated by at most epsilon * T_k, and a multiplicity m(s)
+by at most epsilon * T_k plus occ(s in t) times the error of each longer
+ladderon t containing s. The bound epsilon * T_k of each k is returned.
+epsilon = 0 counts the k-mers exactly (memory then grows with the number of
+distinct k-mers). The decomposition on counts is itself an approximation of
+the greedy ladderpath decomposition, which resolves overlapping occurrences
+one by one; benchmarks/compareLadderons.py measures both differences on
+pools small enough for the exact engine.
+
+K-mers are coded as integers in base 31 (exact up to k = 12); longer k-mers
+wrap modulo 2^64, where distinct k-mers could collide with a negligible
+probability.
+"""
+
+
+import math
+import numpy as np
+
+BASE = 31
+
+def encodePool(strs):
+    """
+    Encode sequences of the same length as an array of letter codes 1..26.
+
+    Raises:
+    ValueError: If a sequence contains anything else than uppercase letters.
+    """
+    codes = np.frombuffer(''.join(strs).encode('ascii'), dtype=np.uint8).reshape(len(strs), -1)
+    codes = codes.astype(np.uint64) - 64
+    if codes.size and (codes.min() < 1 or codes.max() > 26):
+        raise ValueError('The approximate ladderon engine expects uppercase one-letter amino-acid codes')
+    return codes
+
+def kmerCodes(codes, maxLen):
+    """
+    Yield (k, array of the k-mer codes at every position) for k = 1..maxLen.
+    """
+    kmers = codes
+    yield 1, kmers
+    for k in range(2, maxLen + 1):
+        if k > codes.shape[1]:
+            return
+        kmers = kmers[:, :-1] * np.uint64(BASE) + codes[:, k - 1:]
+        yield k, kmers
+
+
+class CountMinSketch(object):
+    """
+    Count-min sketch of integer codes, with multiply-shift hashing.
+
+    Args:
+    epsilon (float): Relative error; an estimate exceeds the count by at most epsilon times the total count.
+    delta (float): Probability that an estimate exceeds this bound.
+    seed (int): Seed of the hash functions.
+    """
+    def __init__(self, epsilon, delta, seed=0):
+        self.bits = max(4, math.ceil(math.log2(math.e / epsilon)))
+        self.depth = max(1, math.ceil(math.log(1 / delta)))
+        self.table = np.zeros((self.depth, 2 ** self.bits), dtype=np.uint32)
+        rng = np.random.default_rng(seed)
+        self.multipliers = rng.integers(1, 2 ** 63, size=self.depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.total = 0
+
+    def indices(self, codes, row):
+        return (codes * self.multipliers[row]) >> np.uint64(64 - self.bits)
+
+    def add(self, codes):
+        codes = codes.ravel()
+        for row in range(self.depth):
+            self.table[row] += np.bincount(self.indices(codes, row), minlength=self.table.shape[1]).astype(np.uint32)
+        self.total += codes.size
+
+    def query(self, codes):
+        return np.min([self.table[row][self.indices(codes, row)] for row in range(self.depth)], axis=0)
+
+
+class ExactCounter(object):
+    """
+    Exact counts of integer codes, with the interface of CountMinSketch (epsilon = 0).
+    """
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+
+    def add(self, codes):
+        values, counts = np.unique(codes, return_counts=True)
+        for value, count in zip(values.tolist(), counts.tolist()):
+            self.counts[value] = self.counts.get(value, 0) + count
+        self.total += codes.size
+
+    def query(self, codes):
+        return np.array([self.counts.get(value, 0) for value in codes.ravel().tolist()],
+                        dtype=np.int64).reshape(codes.shape)
+
+
+def chunksByLength(strs, chunk):
+    # Consecutive chunks of at most `chunk` sequences, split further by sequence length
+    for start in range(0, len(strs), chunk):
+        byLength = {}
+        for str0 in strs[start:start + chunk]:
+            byLength.setdefault(len(str0), []).append(str0)
+        for group in byLength.values():
+            yield group
+
+def sketchLadderons(strs, maxLen=None, epsilon=1e-5, delta=0.02, minSupport=2, chunk=4096):
+    """
+    Approximate ladderons of a pool, with their multiplicities and positions.
+
+    Args:
+    strs (list): The pool of sequences.
+    maxLen (int, optional): The maximum size of the ladderons. Defaults to the longest sequence minus one.
+    epsilon (float): Relative error of the count-min sketches; 0 counts the k-mers exactly.
+    delta (float): Probability that an estimated count exceeds the error bound.
+    minSupport (int): Minimum (estimated) number of occurrences of a candidate ladderon.
+    chunk (int): Number of sequences encoded at a time.
+
+    Returns:
+    tuple: (list of ladderons, list of multiplicities, {ladderon: positions}, {k: error bound epsilon * T_k}).
+    """
+    if maxLen is None:
+        maxLen = max(len(str0) for str0 in strs) - 1
+    maxLen = max(1, int(maxLen))
+
+    # Pass 1: letter counts and k-mer sketches
+    letterCounts = np.zeros(27, dtype=np.int64)
+    counters = {}
+    for group in chunksByLength(strs, chunk):
+        for k, kmers in kmerCodes(encodePool(group), maxLen):
+            if k == 1:
+                letterCounts += np.bincount(kmers.ravel().astype(np.intp), minlength=27)
+                continue
+            if k not in counters:
+                counters[k] = CountMinSketch(epsilon, delta, seed=k) if epsilon > 0 else ExactCounter()
+            counters[k].add(kmers)
+
+    # Pass 2: positions of the candidates (and of the letters)
+    found = {}  # k-mer code -> [ladderon, set of positions]
+    letterPositions = {}
+    for group in chunksByLength(strs, chunk):
+        for k, kmers in kmerCodes(encodePool(group), maxLen):
+            if k == 1:
+                for position in range(kmers.shape[1]):
+                    for letter in np.unique(kmers[:, position]).tolist():
+                        letterPositions.setdefault(letter, set()).add(position)
+                continue
+            rows, positions = np.nonzero(counters[k].query(kmers) >= minSupport)
+            if len(rows) == 0:
+                continue
+            codes = kmers[rows, positions]
+            for (code, position), index in zip(*np.unique(np.stack([codes, positions.astype(np.uint64)], axis=1),
+                                                          axis=0, return_index=True)):
+                code = int(code)
+                if (k, code) not in found:
+                    row = rows[index]
+                    found[(k, code)] = [group[row][position:position + k], set()]
+                found[(k, code)][1].add(int(position))
+
+    # Multiplicities, from the longest candidates to the shortest: the copies of a ladderon reuse it whole,
+    # so the occurrences of its substrings inside these copies are not free any more
+    counts = {}
+    for k in counters:
+        keys = [key for key in found if key[0] == k]
+        if keys:
+            estimates = counters[k].query(np.array([code for _, code in keys], dtype=np.uint64))
+            counts.update({found[key][0]: int(count) for key, count in zip(keys, estimates)})
+    positionsOf = {ladderon: positions for ladderon, positions in found.values()}
+    consumed, multis = {}, {}
+    for ladderon in sorted(counts, key=lambda ladderon: (-len(ladderon), ladderon)):
+        free = counts[ladderon] - consumed.get(ladderon, 0)
+        if free < 2:
+            continue  # Not repeated outside longer ladderons: built from smaller pieces
+        multis[ladderon] = free - 1
+        for a in range(len(ladderon)):
+            for b in range(a + 1, len(ladderon) + 1 - (a == 0)):
+                consumed[ladderon[a:b]] = consumed.get(ladderon[a:b], 0) + free - 1
+
+    listLadderon, listMulti, LadderonAddress = [], [], {}
+    for letter, count in enumerate(letterCounts.tolist()):
+        if count > 0:
+            ch = chr(64 + letter)
+            listLadderon.append(ch)
+            listMulti.append(max(1, count - consumed.get(ch, 0)))
+            LadderonAddress[ch] = sorted(letterPositions[letter])
+    for ladderon in sorted(multis, key=lambda ladderon: (len(ladderon), ladderon)):
+        listLadderon.append(ladderon)
+        listMulti.append(multis[ladderon])
+        LadderonAddress[ladderon] = sorted(positionsOf[ladderon])
+
+    errorBounds = {k: (epsilon * counter.total if epsilon > 0 else 0.0) for k, counter in counters.items()}
+    return listLadderon, listMulti, LadderonAddress, errorBounds
@@ -9,11 +9,9 @@ Based on 1st stable release. Main functions to calculate ladderpath.
 # coding: utf-8
 
 
-import numpy as np
-import pandas as pd
 import os
-import graphviz
 from collections import Counter
+# pandas and graphviz are only needed by getOmega0Data and laddergraph, and are imported there
 
 # ============ associated functions ============
 def LongestEqSubstr(str1, str2): 
@@ -494,6 +492,7 @@ class STRMAT(object):
                 except:
                     pass
             if len(_orderlist) != 0:
+                import pandas as pd
                 latestFile = 'v' + str(max(_orderlist)) + '.csv'
                 minData = pd.read_csv(DataFilePath_new + latestFile)
                 omega0 = float(minData[ minData['size']==len(self.strs[0]) ]['omega0'])
@@ -582,6 +581,8 @@ class STRMAT(object):
         #     or "box" (the sequence will be displayed).
         # "color" can be "grey", "red", "#808080", etc.
         # "rankdir" is the order of the nodes, should be BT (from bottom to top), TB, LR, RL.
+        import pandas as pd
+        import graphviz
         
         binfo = self.ladderonBook
         if binfo == {}:
@@ -693,6 +694,12 @@ class STRMAT(object):
         g.view()
         return ladderonDF
 
+    def writeLaddergraph(self, path, **filters):
+        # Write the laddergraph as a DOT or JSON file in one pass, for pools too large for laddergraph.
+        # "filters": levels, ladderon lengths, subtree of one node, aggregated edges, see laddergraphWriter.writeLaddergraph.
+        from pephire_supply import laddergraphWriter as lw
+        return lw.writeLaddergraph(self, path, **filters)
+
 
 
     # =================== Internal function ======================
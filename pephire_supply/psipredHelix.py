@@ -5,12 +5,15 @@ written by Lu Peng, 2023.12.15
 
 
 import os
-import subprocess
+import csv
 import shutil
-import pandas as pd
 import numpy as np
+from pephire_supply import jobQueue as jq
+from pephire_supply import tracing as tr
+from pephire_supply import ladderonSketch as ls
 
-def run_psipred(peptides, i, exeName='runpsipred_single'):
+@tr.traced
+def run_psipred(peptides, i, exeName='runpsipred_single', executor=None, cache=None):
     """
     Runs PSIPRED software for helix prediction on a list of peptides.
 
@@ -18,6 +21,8 @@ def run_psipred(peptides, i, exeName='runpsipred_single'):
     peptides (list): List of peptide sequences.
     i (int): Identifier for the peptide batch.
     exeName (str): Name of the executable for PSIPRED.
+    executor (optional): Executor running the PSIPRED jobs (see jobQueue). Defaults to LocalExecutor.
+    cache (ToolCache, optional): Cache of the predictions (.horiz and .ss2 files), see toolCache.
     """
     # Specify the temp folder path
     temp_folder = '_external_app'
@@ -30,11 +35,21 @@ def run_psipred(peptides, i, exeName='runpsipred_single'):
         with open(fasta_filename, 'w') as f:
             f.write(f'>peptide{j}\n{peptide}')
 
+    # Predictions found in the cache are not run again
+    cached = set()
+    if cache is not None:
+        for j, peptide in enumerate(peptides):
+            targets = [os.path.join(temp_folder, f'peptide{i}_{j}{ext}') for ext in ['.horiz', '.ss2']]
+            if cache.fetch('psipred', peptide, ['.horiz', '.ss2'], targets):
+                cached.add(f'peptide{i}_{j}.fasta')
+
     # Run PSIPRED on each .fasta file in the temp folder
+    jobs = []
     for filename in os.listdir(temp_folder):
-        if filename.endswith('.fasta'):
+        if filename.endswith('.fasta') and filename not in cached:
             filepath = os.path.join(temp_folder, filename)
-            subprocess.check_output([exeName, filepath]).decode('utf-8')
+            jobs.append(jq.make_job([exeName, filepath], quiet=True))
+    (executor or jq.LocalExecutor()).run(jobs)
 
     # Move generated files (.horiz, .ss, .ss2) to the temp folder
     for ext in ['.horiz', '.ss', '.ss2']:
@@ -42,9 +57,24 @@ def run_psipred(peptides, i, exeName='runpsipred_single'):
             if file.endswith(ext):
                 shutil.move(file, os.path.join(temp_folder, file))
 
-def sort_horiz_files(i, output_filename):
+    if cache is not None:
+        for j, peptide in enumerate(peptides):
+            if f'peptide{i}_{j}.fasta' not in cached:
+                sources = [os.path.join(temp_folder, f'peptide{i}_{j}{ext}') for ext in ['.horiz', '.ss2']]
+                cache.store('psipred', peptide, ['.horiz', '.ss2'], sources)
+
+@tr.traced
+def sort_horiz_files(i, output_filename, store=None, write_csv=True):
     """
     Merges and sorts .horiz files by helix content percentage.
+
+    Args:
+    i (int): Identifier for the peptide batch.
+    store (RunDatabase, optional): Results database the predictions are appended to.
+    write_csv (bool): If True, write sorted_helix_{i}.csv.
+
+    Returns:
+    list: (peptide_num, AA, Pred, H_percent) tuples, by decreasing H_percent.
     """
     temp_folder = '_external_app'
     output_folder = f'Data_output/{output_filename}_appendix'
@@ -68,31 +98,162 @@ def sort_horiz_files(i, output_filename):
         H_percent = H_count / total_count
         data.append((int(peptide_num), aa, pred, H_percent))
 
-    df = pd.DataFrame(data, columns=['peptide_num', 'AA', 'Pred', 'H_percent'])
-    df_sorted = df.sort_values(by=['H_percent'], ascending=False)
-    df_sorted.to_csv(os.path.join(output_folder, f'sorted_helix_{i}.csv'), index=False)
+    data_sorted = sorted(data, key=lambda row: -row[3])
+    if store is not None:
+        store.append('helix', [(i,) + row for row in data_sorted])
+        store.flush()
+    if write_csv:
+        with open(os.path.join(output_folder, f'sorted_helix_{i}.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['peptide_num', 'AA', 'Pred', 'H_percent'])
+            writer.writerows(data_sorted)
 
-    return df_sorted
+    return data_sorted
 
-def create_helixpool(i, N_for_docking, output_filename):
+def kmer_index(peptides, k=3):
+    """
+    Sparse k-mer incidence of peptides (distinct k-mers of each peptide), indexed both ways.
+
+    Returns:
+    tuple: (k-mer ids of each peptide as (indptr, ids), peptides of each k-mer id as (indptr, rows), k-mers per peptide).
+    """
+    rows, codes = [], []
+    by_length = {}
+    for j, peptide in enumerate(peptides):
+        by_length.setdefault(len(peptide), []).append(j)
+    for length, index in by_length.items():
+        if length < k:
+            continue
+        letters = ls.encodePool([peptides[j] for j in index])
+        kmers = np.zeros((len(index), length - k + 1), dtype=np.uint64)
+        for a in range(k):
+            kmers = kmers * np.uint64(ls.BASE) + letters[:, a:length - k + 1 + a]
+        rows.append(np.repeat(np.array(index), length - k + 1))
+        codes.append(kmers.ravel())
+    n = len(peptides)
+    if not rows:
+        empty = np.zeros(0, dtype=np.int64)
+        return (np.zeros(n + 1, dtype=np.int64), empty), (np.zeros(1, dtype=np.int64), empty), np.zeros(n, dtype=np.int64)
+    rows, codes = np.concatenate(rows), np.concatenate(codes)
+    _, ids = np.unique(codes, return_inverse=True)
+    pairs = np.unique(np.stack([rows, ids.ravel()], axis=1), axis=0)  # Distinct (peptide, k-mer), sorted by peptide
+    sizes = np.bincount(pairs[:, 0], minlength=n)
+    by_row = (np.concatenate([[0], np.cumsum(sizes)]), pairs[:, 1])
+    order = np.argsort(pairs[:, 1], kind='stable')
+    by_kmer = (np.concatenate([[0], np.cumsum(np.bincount(pairs[:, 1]))]), pairs[order, 0])
+    return by_row, by_kmer, sizes
+
+def select_diverse(peptides, helix, N, weight=1.0, k=3):
+    """
+    Greedy choice of N peptides with a high helix percentage and little k-mer overlap with each other:
+    each step takes the peptide maximising H_percent - weight * (largest Jaccard similarity of its k-mers
+    to the peptides already taken), ties at random. The similarities to each new peptide are one sparse
+    product with the k-mer incidence of all candidates (through the inverted index of kmer_index),
+    so the cost is linear in the number of candidates for each peptide taken.
+
+    Args:
+    peptides (list): Candidate peptides.
+    helix (array): Their helix percentages.
+    N (int): Number of peptides taken.
+    weight (float): Weight of the similarity against the helix percentage.
+    k (int): Length of the k-mers.
+
+    Returns:
+    array: Indices of the peptides taken, in the order they were taken; all of them if there are fewer than N.
+    """
+    (row_ptr, row_kmers), (kmer_ptr, kmer_rows), sizes = kmer_index(peptides, k)
+    helix = np.asarray(helix, dtype=float)
+    n = len(peptides)
+    max_sim = np.zeros(n)
+    available = np.ones(n, dtype=bool)
+    chosen = []
+    for _ in range(min(N, n)):
+        value = np.where(available, helix - weight * max_sim, -np.inf)
+        best = np.random.choice(np.flatnonzero(value == value.max()))
+        chosen.append(best)
+        available[best] = False
+        kmers = row_kmers[row_ptr[best]:row_ptr[best + 1]]
+        if len(kmers) == 0:
+            continue
+        hits = np.concatenate([kmer_rows[kmer_ptr[kmer]:kmer_ptr[kmer + 1]] for kmer in kmers])
+        shared = np.bincount(hits, minlength=n)
+        union = sizes + sizes[best] - shared
+        max_sim = np.maximum(max_sim, np.divide(shared, union, out=np.zeros(n), where=union > 0))
+    return np.array(chosen, dtype=np.int64)
+
+@tr.traced
+def create_helixpool(i, N_for_docking, output_filename, store=None, write_csv=True, surrogate=None, explore=0.25,
+                     diversity=0.0, sorted_helix=None):
     """
     Creates a helix pool from the sorted helix data.
+    The peptides are chosen among those with the highest helix percentage, at random or,
+    with a trained surrogate model, by their predicted docking score (best first).
+    With a diversity weight (and no trained surrogate model), they are chosen among all the
+    candidates for both their helix percentage and their difference from each other, see select_diverse.
+    If fewer peptides than N_for_docking have the highest helix percentage, the next highest are taken too,
+    and if there are fewer candidates than N_for_docking, the helix pool is all of them.
+
+    Args:
+    i (int): Identifier for the peptide batch.
+    N_for_docking (int): Number of peptides selected for docking.
+    store (RunDatabase, optional): Results database to read the sorted helix data from and append the helix pool to.
+        If None, sorted_helix_{i}.csv is read.
+    write_csv (bool): If True, write helixpool{i}.csv.
+    surrogate (SurrogateModel, optional): Model ranking the candidates, see surrogate.py.
+    explore (float): Share of the helix pool still chosen at random among the other candidates
+        when the surrogate model is used, so that the model keeps seeing new kinds of peptides.
+    diversity (float): Weight of the 3-mer similarity against the helix percentage; 0 keeps the random choice.
+    sorted_helix (list, optional): Output of sort_horiz_files, used instead of the database or the CSV file.
+
+    Returns:
+    list: The peptides of the helix pool, min(N_for_docking, number of candidates) of them.
     """
     if N_for_docking == 0:
         return []
 
     output_folder = f'Data_output/{output_filename}_appendix'
-    csv_file = os.path.join(output_folder, f'sorted_helix_{i}.csv')
-    df = pd.read_csv(csv_file)
-
-    max_H_percent = df['H_percent'].max()
-    max_H_percent_rows = df[df['H_percent'] == max_H_percent]
-    random_rows = np.random.choice(max_H_percent_rows.index.values, size=N_for_docking, replace=False)
-    helixpool = [df.loc[j, 'AA'] for j in random_rows]
-
-    with open(os.path.join(output_folder, f'helixpool{i}.csv'), 'w') as f:
-        f.write('helixpool\n')
-        for p in helixpool:
-            f.write(f"{p}\n")
+    if sorted_helix is not None:
+        rows = [(row[1], row[3]) for row in sorted_helix]
+    elif store is not None:
+        rows = [(row[1], row[3]) for row in store.sorted_helix(i)]
+    else:
+        with open(os.path.join(output_folder, f'sorted_helix_{i}.csv'), newline='') as f:
+            reader = csv.reader(f)
+            next(reader)  # Skip the header row
+            rows = [(row[1], float(row[3])) for row in reader]
+    N_for_docking = min(N_for_docking, len(rows))
+    if N_for_docking == 0:
+        return []
+
+    # Indices of the peptides with the highest helix percentage
+    max_H_percent = max(H_percent for _, H_percent in rows)
+    max_H_percent_rows = np.array([j for j, (_, H_percent) in enumerate(rows) if H_percent == max_H_percent])
+    if len(max_H_percent_rows) < N_for_docking:
+        # Too few of them to fill the helix pool: the next highest percentages are taken as well
+        by_H_percent = np.argsort([-H_percent for _, H_percent in rows], kind='stable')
+        max_H_percent_rows = by_H_percent[:N_for_docking]
+    if surrogate is not None and surrogate.ready():
+        # Shuffle first, so that ties of the predicted score are broken at random
+        candidates = np.random.permutation(max_H_percent_rows)
+        predicted = surrogate.predict([rows[j][0] for j in candidates])
+        ranked = candidates[np.argsort(predicted, kind='stable')]
+        n_best = N_for_docking - int(round(explore * N_for_docking))
+        others = np.random.choice(ranked[n_best:], size=N_for_docking - n_best, replace=False)
+        random_rows = np.concatenate([ranked[:n_best], others])
+    elif diversity:
+        random_rows = select_diverse([AA for AA, _ in rows], [H_percent for _, H_percent in rows], N_for_docking,
+                                     weight=diversity)
+    else:
+        random_rows = np.random.choice(max_H_percent_rows, size=N_for_docking, replace=False)
+    helixpool = [rows[j][0] for j in random_rows]
+
+    if store is not None:
+        store.append('helixpool', [(i, j, p) for j, p in enumerate(helixpool)])
+        store.flush()
+    if write_csv:
+        with open(os.path.join(output_folder, f'helixpool{i}.csv'), 'w') as f:
+            f.write('helixpool\n')
+            for p in helixpool:
+                f.write(f"{p}\n")
 
     return helixpool
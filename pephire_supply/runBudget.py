@@ -0,0 +1,139 @@
+"""
+Version 1.0,
+Wall-clock and tool-call budget of a run, and the sizes of the iterations that fit in it.
+
+A run can be limited in wall time (seconds, counted across the sessions of a
+resumed run), in HDOCK calls and in PSIPRED calls (runs of the tools, cache
+hits are free). Before each iteration, N_newPiptide and N_for_docking are
+scaled down by the same factor so that the budget left is spread over the
+iterations left: the cost of an iteration is estimated from those done, per
+docked peptide for the wall time and HDOCK, per predicted peptide for PSIPRED
+(the candidates and the helix pool). Before any iteration is measured, a
+docked peptide is taken to cost one HDOCK call per receptor and a predicted
+peptide one PSIPRED call, and the wall time is not limited. The run stops
+between iterations, with the outputs of the completed ones, once a limit is
+reached or not even one peptide can be docked in what is left.
+"""
+
+
+import time
+from pephire_supply import tracing as tr
+
+TOOLS = {'hdock': 'hdock', 'psipred': 'runpsipred_single'}  # Budget -> executable counted by tracing.calls()
+
+class RunBudget(object):
+    """
+    Limits of a run and the costs of its iterations.
+
+    Args:
+    seconds (float, optional): Maximum wall time of the run.
+    hdock (int, optional): Maximum number of HDOCK calls.
+    psipred (int, optional): Maximum number of PSIPRED calls.
+    state (dict, optional): The result of state() saved in the checkpoint, to continue a resumed run.
+    """
+    def __init__(self, seconds=None, hdock=None, psipred=None, state=None):
+        state = state or {}
+        self.limits = {'seconds': seconds, 'hdock': hdock, 'psipred': psipred}
+        self.used_before = dict(state.get('used', {'seconds': 0.0, 'hdock': 0, 'psipred': 0}))
+        self.iterations = list(state.get('iterations', []))  # {'N_new', 'N_dock', 'seconds', 'hdock', 'psipred'}
+        self.t0 = time.time()
+        self.calls0 = tr.calls()
+        self.start = None
+
+    def used(self):
+        # Wall time and tool calls of the run so far, this session included
+        calls = tr.calls()
+        used = {'seconds': self.used_before['seconds'] + time.time() - self.t0}
+        for name, tool in TOOLS.items():
+            used[name] = self.used_before[name] + calls.get(tool, 0) - self.calls0.get(tool, 0)
+        return used
+
+    def remaining(self):
+        """
+        Budget left of each limit, None for the unlimited ones.
+        """
+        used = self.used()
+        return {name: None if limit is None else limit - used[name] for name, limit in self.limits.items()}
+
+    def exhausted(self):
+        return any(left is not None and left <= 0 for left in self.remaining().values())
+
+    def unit_costs(self, hdock_per_dock):
+        """
+        Estimated wall time and HDOCK calls per docked peptide, and PSIPRED calls per predicted peptide.
+
+        Args:
+        hdock_per_dock (float): HDOCK calls per docked peptide before any iteration is measured.
+
+        Returns:
+        dict: {'seconds', 'hdock', 'psipred'}, seconds is None before any iteration is measured.
+        """
+        docked = sum(it['N_dock'] for it in self.iterations)
+        predicted = sum(it['N_new'] + it['N_dock'] for it in self.iterations)
+        if not docked:
+            return {'seconds': None, 'hdock': hdock_per_dock, 'psipred': 1.0}
+        return {'seconds': sum(it['seconds'] for it in self.iterations) / docked,
+                'hdock': sum(it['hdock'] for it in self.iterations) / docked,
+                'psipred': sum(it['psipred'] for it in self.iterations) / predicted}
+
+    def plan(self, N_newPiptide, N_for_docking, iterations_left, hdock_per_dock):
+        """
+        Sizes of the next iteration, N_newPiptide and N_for_docking scaled to fit the budget left.
+
+        Args:
+        N_newPiptide (int): Peptides generated by a full iteration.
+        N_for_docking (int): Peptides docked by a full iteration.
+        iterations_left (int): Iterations left in the run, this one included.
+        hdock_per_dock (float): As for unit_costs.
+
+        Returns:
+        tuple: (N_new, N_dock), or None if the budget is exhausted or too small for one docked peptide.
+        """
+        unit = self.unit_costs(hdock_per_dock)
+        remaining = self.remaining()
+
+        def cost(N_new, N_dock):
+            return {'seconds': None if unit['seconds'] is None else unit['seconds'] * N_dock,
+                    'hdock': unit['hdock'] * N_dock, 'psipred': unit['psipred'] * (N_new + N_dock)}
+
+        full = cost(N_newPiptide, N_for_docking)
+        scale = 1.0
+        for name, left in remaining.items():
+            if left is None:
+                continue
+            if left <= 0:
+                return None
+            if full[name]:
+                scale = min(scale, left / (full[name] * iterations_left))
+        N_dock = max(1, int(scale * N_for_docking))
+        N_new = min(N_newPiptide, max(N_dock, int(scale * N_newPiptide)))
+        # Even the smallest iteration, one docked peptide, may not fit in what is left
+        for name, need in cost(N_new, N_dock).items():
+            if remaining[name] is not None and need and need > remaining[name]:
+                return None
+        return N_new, N_dock
+
+    def start_iteration(self):
+        self.start = self.used()
+
+    def end_iteration(self, N_new, N_dock):
+        """
+        Record the cost of the iteration started by start_iteration
+        (an iteration resumed in the middle is not recorded, its cost is only partly known).
+        """
+        if self.start is None:
+            return
+        used = self.used()
+        iteration = {'N_new': N_new, 'N_dock': N_dock}
+        iteration.update((name, used[name] - self.start[name]) for name in self.limits)
+        self.iterations.append(iteration)
+        self.start = None
+
+    def state(self):
+        # Saved in the checkpoint; a resumed run continues with the time and calls already used
+        return {'used': self.used(), 'iterations': self.iterations}
+
+    def summary(self):
+        used = self.used()
+        return ', '.join(f"{name} {used[name]:.0f}" + (f"/{limit:g}" if limit is not None else '')
+                         for name, limit in self.limits.items())
@@ -0,0 +1,130 @@
+"""
+Version 1.0,
+SQLite results store shared by the stages of pephire.py.
+
+All runs write into one database file; every row carries the run name
+(<output_filename>), so the final selection of a run and the analysis across
+runs are indexed queries instead of scans over the per-iteration CSV files.
+"""
+
+
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS candidates (
+    run TEXT, iteration INTEGER, peptide_num INTEGER, peptide TEXT);
+CREATE TABLE IF NOT EXISTS helix (
+    run TEXT, iteration INTEGER, peptide_num INTEGER, peptide TEXT, pred TEXT, h_percent REAL);
+CREATE TABLE IF NOT EXISTS helixpool (
+    run TEXT, iteration INTEGER, j INTEGER, peptide TEXT);
+CREATE TABLE IF NOT EXISTS docking (
+    run TEXT, iteration INTEGER, j INTEGER, receptor TEXT, score REAL, fidelity TEXT);
+CREATE TABLE IF NOT EXISTS peptide_scores (
+    run TEXT, iteration INTEGER, peptide TEXT, score REAL, partial INTEGER, fidelity TEXT);
+CREATE TABLE IF NOT EXISTS pool (
+    run TEXT, iteration INTEGER, peptide TEXT, source TEXT);
+CREATE INDEX IF NOT EXISTS idx_candidates ON candidates (run, iteration);
+CREATE INDEX IF NOT EXISTS idx_helix ON helix (run, iteration, h_percent);
+CREATE INDEX IF NOT EXISTS idx_helixpool ON helixpool (run, iteration, j);
+CREATE INDEX IF NOT EXISTS idx_docking ON docking (run, iteration, j);
+CREATE INDEX IF NOT EXISTS idx_peptide_scores ON peptide_scores (run, iteration, score);
+CREATE INDEX IF NOT EXISTS idx_peptide_scores_score ON peptide_scores (run, score);
+CREATE INDEX IF NOT EXISTS idx_pool ON pool (run, iteration);
+"""
+
+TABLES = ['candidates', 'helix', 'helixpool', 'docking', 'peptide_scores', 'pool']
+
+# Columns added after the first version of the schema, added to older databases when they are opened
+ADDED_COLUMNS = [('docking', 'fidelity', 'TEXT'), ('peptide_scores', 'fidelity', 'TEXT')]
+
+
+class RunDatabase(object):
+    """
+    Results of one run in the shared SQLite database.
+
+    Rows are buffered per table and written with one executemany per table
+    when flush() is called (the stage functions flush before returning).
+
+    Args:
+    db_path (str): Path to the SQLite database file.
+    run (str): Name of the run, i.e. <output_filename>.
+    """
+    def __init__(self, db_path, run):
+        self.db_path = db_path
+        self.run = run
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(SCHEMA)
+        with self.conn:
+            for table, column, kind in ADDED_COLUMNS:
+                if column not in [row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')]:
+                    self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {kind}')
+        self.pending = {table: [] for table in TABLES}
+
+    def append(self, table, rows):
+        # Buffer rows (tuples without the run column) for a table
+        self.pending[table].extend((self.run,) + tuple(row) for row in rows)
+
+    def flush(self):
+        # Write all buffered rows in a single transaction
+        with self.conn:
+            for table, rows in self.pending.items():
+                if rows:
+                    placeholders = ', '.join(['?'] * len(rows[0]))
+                    self.conn.executemany(f'INSERT INTO {table} VALUES ({placeholders})', rows)
+                    self.pending[table] = []
+
+    def clear_run(self):
+        # Remove the rows of a previous run with the same name
+        with self.conn:
+            for table in TABLES:
+                self.conn.execute(f'DELETE FROM {table} WHERE run = ?', (self.run,))
+
+    def clear_iteration(self, table, i):
+        with self.conn:
+            self.conn.execute(f'DELETE FROM {table} WHERE run = ? AND iteration = ?', (self.run, i))
+
+    def query(self, sql, params=()):
+        self.flush()
+        return self.conn.execute(sql, params).fetchall()
+
+    # ------------ stage results ------------
+    def sorted_helix(self, i):
+        """
+        Return the helix predictions of iteration i, sorted by helix content.
+
+        Returns:
+        list: (peptide_num, peptide, pred, h_percent) tuples.
+        """
+        return self.query('SELECT peptide_num, peptide, pred, h_percent FROM helix '
+                          'WHERE run = ? AND iteration = ? ORDER BY h_percent DESC, rowid', (self.run, i))
+
+    def helixpool(self, i):
+        return [row[0] for row in self.query('SELECT peptide FROM helixpool WHERE run = ? AND iteration = ? ORDER BY j',
+                                             (self.run, i))]
+
+    def docking_scores(self, i):
+        """
+        Return the docking scores of iteration i.
+
+        Returns:
+        list: (j, receptor, score) tuples.
+        """
+        return self.query('SELECT j, receptor, score FROM docking WHERE run = ? AND iteration = ? ORDER BY j, receptor',
+                          (self.run, i))
+
+    def peptide_scores(self, i):
+        """
+        Return the peptides of iteration i with their average scores, best first (fine-tier scores first,
+        then the complete ones before the partial ones, in the order of hs.get_peptide_score).
+
+        Returns:
+        list: (peptide, score, partial, fidelity) tuples; fidelity is None without a coarse docking tier.
+        """
+        return self.query('SELECT peptide, score, partial, fidelity FROM peptide_scores '
+                          'WHERE run = ? AND iteration = ? '
+                          "ORDER BY CASE fidelity WHEN 'mixed' THEN 1 WHEN 'coarse' THEN 2 ELSE 0 END, partial, score, rowid",
+                          (self.run, i))
+
+    def close(self):
+        self.flush()
+        self.conn.close()
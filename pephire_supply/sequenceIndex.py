@@ -0,0 +1,109 @@
+"""
+Version 1.0,
+Persistent index of the peptides already evaluated, across iterations and runs.
+
+The sequences are stored in a SQLite table, with the stage they reached
+('predicted' by PSIPRED or 'docked'). A Bloom filter built in memory from the
+table answers most membership tests of the generator without touching the
+database; only its positive answers are checked with an indexed query.
+"""
+
+
+import math
+import sqlite3
+import hashlib
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS evaluated (
+    peptide TEXT PRIMARY KEY, stage TEXT, run TEXT, iteration INTEGER);
+"""
+
+
+class BloomFilter(object):
+    """
+    Bloom filter of strings.
+
+    Args:
+    capacity (int): Number of items for which the false positive rate is error_rate.
+    error_rate (float): False positive rate at capacity.
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, item):
+        # Double hashing: the k positions are h1 + n*h2 of a 128-bit digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + n * h2) % self.size for n in range(self.n_hashes)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+
+class SequenceIndex(object):
+    """
+    Peptides evaluated by any run using the same database file.
+    `peptide in index` is what gp.genNewPips(seen=index) tests for each candidate.
+
+    Args:
+    db_path (str): Path to the SQLite database file.
+    run (str): Name of the run, i.e. <output_filename>.
+    error_rate (float): False positive rate of the Bloom filter (false positives cost one query).
+    """
+    def __init__(self, db_path, run, error_rate=0.01):
+        self.run = run
+        self.error_rate = error_rate
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(SCHEMA)
+        self.rebuild()
+
+    def rebuild(self):
+        # (Re)build the Bloom filter from the table, with room for as many new peptides as there are already
+        count = self.conn.execute('SELECT COUNT(*) FROM evaluated').fetchone()[0]
+        self.bloom = BloomFilter(max(1024, 2 * count), self.error_rate)
+        for (peptide,) in self.conn.execute('SELECT peptide FROM evaluated'):
+            self.bloom.add(peptide)
+
+    def __contains__(self, peptide):
+        if peptide not in self.bloom:
+            return False
+        return self.conn.execute('SELECT 1 FROM evaluated WHERE peptide = ?', (peptide,)).fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM evaluated').fetchone()[0]
+
+    def add(self, peptides, iteration, stage='predicted'):
+        """
+        Record peptides as evaluated. A peptide keeps the run and iteration where it was first evaluated;
+        its stage is raised to 'docked' when it is docked.
+
+        Args:
+        peptides (list): Peptide sequences.
+        iteration (int): Iteration of the run.
+        stage (str): 'predicted' (helix prediction) or 'docked'.
+        """
+        rows = [(peptide, stage, self.run, iteration) for peptide in peptides]
+        with self.conn:
+            if stage == 'docked':
+                self.conn.executemany('INSERT INTO evaluated VALUES (?, ?, ?, ?) '
+                                      'ON CONFLICT(peptide) DO UPDATE SET stage = excluded.stage', rows)
+            else:
+                self.conn.executemany('INSERT OR IGNORE INTO evaluated VALUES (?, ?, ?, ?)', rows)
+        for peptide in peptides:
+            if peptide not in self.bloom:
+                self.bloom.add(peptide)
+        if self.bloom.count > self.bloom.capacity:
+            self.rebuild()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,200 @@
+"""
+Version 1.0,
+Speculative generation of the next iteration while the current one is docked.
+
+The pool of the next iteration is the current pool plus the best N_putBack
+docked peptides, so it can only be one of a few variants: the current pool
+plus an ordered choice of N_putBack peptides of the helix pool. While the
+docking runs, one process per likely variant (the helix pool order, or the
+order predicted by the surrogate model) builds the pip pool book of that
+variant, generates the peptides of the next iteration and runs PSIPRED on them
+in its own folder _external_app/speculation{i}_{k}. Once the docking scores
+are in, the variant whose pool is the actual pool is kept: its peptides and
+predictions replace the generation and PSIPRED stages of the next iteration,
+and the others are discarded.
+
+The processes start from the state of the random generator of the run, so
+the peptides of the kept variant are those the run would have generated, and
+the state of the generator after the generation is handed back: a run gives
+the same results with and without speculation. Speculation is skipped
+when the pool does not only depend on which peptides are put back (ladderon
+feedback from the scores, or pruning to max_pool).
+"""
+
+
+import os
+import json
+import time
+import random
+import shutil
+import signal
+import itertools
+import multiprocessing as mp
+from pephire_supply import genPeptides as gp
+from pephire_supply import psipredHelix as ph
+from pephire_supply import sequenceIndex as si
+from pephire_supply import toolCache as tc
+from pephire_supply import tracing as tr
+
+def putBackVariants(pipPool, helixpool, N_putBack, max_variants, ranking=None):
+    """
+    The most likely pools of the next iteration.
+
+    Args:
+    pipPool (list): The current pool.
+    helixpool (list): The peptides being docked.
+    N_putBack (int): Number of peptides put back in the pool.
+    max_variants (int): Maximum number of variants.
+    ranking (list, optional): Predicted scores of the helix pool (lower is better). Defaults to the helix pool order.
+
+    Returns:
+    list: Distinct next pools, the most likely first.
+    """
+    order = list(helixpool)
+    if ranking is not None:
+        order = [peptide for _, peptide in sorted(zip(ranking, order), key=lambda pair: pair[0])]
+    variants = []
+    for putBack in itertools.permutations(order, min(N_putBack, len(order))):
+        pool = gp.putBackPips(pipPool, putBack)
+        if pool not in variants:
+            variants.append(pool)
+        if len(variants) == max_variants:
+            break
+    return variants
+
+
+class _Seen(object):
+    # Peptides evaluated before the next iteration: the evaluated database and those of the current iteration
+    def __init__(self, index, extra):
+        self.index, self.extra = index, set(extra)
+
+    def __contains__(self, peptide):
+        return peptide in self.extra or (self.index is not None and peptide in self.index)
+
+
+def speculate(folder, i, pool, N_newPiptide, limitLadderonSize, sketch, evaluated_db, run, extra_seen, cache_folder,
+              random_state, inherited=()):
+    """
+    Generate and predict the peptides of iteration i for one pool (in a forked process).
+    The results are written to folder/result.json: {'peptides', 'random_state'}.
+    """
+    if hasattr(os, 'setsid'):
+        os.setsid()  # A process group with the PSIPRED runs started here, stopped together by Speculation.discard
+    # Nothing of the run is written from here: no trace events, and the SQLite connections copied by the fork
+    # are closed (the parent commits its writes before forking); the evaluated peptides are read with a new one
+    tr.after_fork()
+    for owner in inherited:
+        owner.conn.close()
+    os.chdir(folder)
+    random.setstate(random_state)  # A forked process reseeds the random module
+    index = si.SequenceIndex(evaluated_db, run) if evaluated_db is not None else None
+    seen = _Seen(index, extra_seen) if index is not None else None
+    PipPoolBook = gp.getPipPoolBook(pool, limitLadderonSize=limitLadderonSize, sketch=sketch)
+    peptides = gp.genNewPips(PipPoolBook, pool, N=N_newPiptide, noRepetition=True, seen=seen)
+    random_state = random.getstate()
+    cache = tc.ToolCache(cache_folder) if cache_folder is not None else None
+    ph.run_psipred(peptides, i, cache=cache)
+    with open('result.json.tmp', 'w') as f:
+        json.dump({'peptides': peptides, 'random_state': random_state}, f)
+    os.replace('result.json.tmp', 'result.json')
+
+
+class Speculation(object):
+    """
+    Speculative generations of iteration i, running while iteration i-1 is docked.
+
+    Args:
+    i (int): The iteration speculated on.
+    variants (list): Possible pools of iteration i, see putBackVariants.
+    N_newPiptide (int): Number of peptides generated.
+    limitLadderonSize (float): As for gp.getPipPoolBook.
+    sketch (dict, optional): As for gp.getPipPoolBook.
+    evaluated_db (str, optional): Path of the SequenceIndex of the run.
+    run (str): Name of the run.
+    extra_seen (list): Peptides of iteration i-1, added to the SequenceIndex before iteration i.
+    cache_folder (str, optional): Tool cache; predictions of discarded variants stay in it.
+    inherited (list, optional): Objects of the run with an SQLite connection (RunDatabase, SequenceIndex, JobQueue),
+        closed in the forked processes.
+    """
+    def __init__(self, i, variants, N_newPiptide, limitLadderonSize, sketch=None, evaluated_db=None, run=None,
+                 extra_seen=(), cache_folder=None, inherited=()):
+        self.i = i
+        self.variants = variants
+        self.folders = [os.path.abspath(os.path.join('_external_app', f'speculation{i}_{k}'))
+                        for k in range(len(variants))]
+        ctx = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else mp.get_context()
+        if evaluated_db is not None:
+            evaluated_db = os.path.abspath(evaluated_db)
+        if cache_folder is not None:
+            cache_folder = os.path.abspath(cache_folder)
+        random_state = random.getstate()
+        if ctx.get_start_method() != 'fork':
+            inherited = ()  # A spawned process starts without them
+        self.processes = []
+        for folder, pool in zip(self.folders, variants):
+            shutil.rmtree(folder, ignore_errors=True)
+            os.makedirs(folder)
+            process = ctx.Process(target=speculate, args=(folder, i, pool, N_newPiptide, limitLadderonSize, sketch,
+                                                          evaluated_db, run, list(extra_seen), cache_folder,
+                                                          random_state, list(inherited)),
+                                  daemon=True)
+            process.start()
+            self.processes.append(process)
+
+    def take(self, pipPool):
+        """
+        Wait for the variant of the actual pool, move its predictions to _external_app and discard the others.
+
+        Returns:
+        dict: {'peptides', 'random_state'} of the variant, or None if no variant matches or it failed.
+        """
+        k = self.variants.index(pipPool) if pipPool in self.variants else None
+        result = None
+        if k is not None:
+            with tr.span('speculation wait', iteration=self.i):
+                self.processes[k].join()
+            result_file = os.path.join(self.folders[k], 'result.json')
+            if self.processes[k].exitcode == 0 and os.path.exists(result_file):
+                with open(result_file) as f:
+                    result = json.load(f)
+                version, internal, gauss = result['random_state']
+                result['random_state'] = (version, tuple(internal), gauss)
+                outputs = os.path.join(self.folders[k], '_external_app')
+                for filename in os.listdir(outputs):
+                    if filename.endswith('.horiz'):
+                        shutil.move(os.path.join(outputs, filename), os.path.join('_external_app', filename))
+        self.discard()
+        return result
+
+    def discard(self):
+        for process in self.processes:
+            if process.is_alive():
+                if not kill_group(process.pid, signal.SIGTERM):
+                    process.terminate()  # Not in its own group yet: nothing started under it
+            process.join()
+            wait_group(process.pid)
+        for folder in self.folders:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+def kill_group(pgid, sig):
+    # Send a signal to a process group; False if there is no such group
+    if not hasattr(os, 'killpg'):
+        return False
+    try:
+        os.killpg(pgid, sig)
+    except ProcessLookupError:
+        return False
+    return True
+
+def wait_group(pgid, timeout=10.0):
+    """
+    Wait until the processes of a group are gone, so that their folder can be deleted; the ones left after
+    timeout seconds are killed.
+    """
+    deadline = time.time() + timeout
+    while kill_group(pgid, 0):
+        if time.time() > deadline:
+            kill_group(pgid, signal.SIGKILL)
+            return
+        time.sleep(0.01)
@@ -0,0 +1,149 @@
+"""
+Version 1.0,
+Surrogate model of the docking scores, to rank the helix candidates before docking.
+
+A peptide is described by its amino-acid composition and its dipeptide
+(2-mer) composition. One ridge regression per receptor is fitted on the
+docking scores recorded so far; the model keeps only the sufficient
+statistics of each regression (X'X, X'y and the sums), so it is updated
+incrementally after every iteration at a cost independent of the number of
+records, and saved to a .npz file between iterations and runs.
+"""
+
+
+import os
+import re
+import numpy as np
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+AA_INDEX = {aa: k for k, aa in enumerate(AMINO_ACIDS)}
+N_FEATURES = len(AMINO_ACIDS) + len(AMINO_ACIDS) ** 2
+
+def features(peptides):
+    """
+    Composition and 2-mer composition of peptides.
+
+    Args:
+    peptides (list): Peptide sequences.
+
+    Returns:
+    ndarray: Array of shape (len(peptides), N_FEATURES); the counts are divided by the length of each peptide.
+    """
+    X = np.zeros((len(peptides), N_FEATURES))
+    n_aa = len(AMINO_ACIDS)
+    for row, peptide in enumerate(peptides):
+        codes = np.array([AA_INDEX[aa] for aa in peptide if aa in AA_INDEX], dtype=np.intp)
+        if len(codes) == 0:
+            continue
+        np.add.at(X[row], codes, 1.0)
+        np.add.at(X[row], n_aa + codes[:-1] * n_aa + codes[1:], 1.0)
+        X[row] /= len(codes)
+    return X
+
+
+class SurrogateModel(object):
+    """
+    Ridge regressions of the docking score of a peptide against each receptor.
+    The predicted score of a peptide is the mean of its predicted scores against the receptors.
+
+    Args:
+    alpha (float): Ridge regularisation.
+    min_samples (int): Number of docked peptides below which the model is not used for ranking.
+    """
+    def __init__(self, alpha=1.0, min_samples=10):
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.stats = {}  # receptor -> [X'X, X'y, sum of x, sum of y, n]
+        self.trained = set()  # '<run>:<iteration>' already added
+        self.weights = None
+
+    def ready(self):
+        return any(stats[4] >= self.min_samples for stats in self.stats.values())
+
+    def add(self, peptides, receptor, scores):
+        """
+        Add the docking scores of peptides against one receptor.
+        """
+        X = features(peptides)
+        y = np.asarray(scores, dtype=float)
+        stats = self.stats.setdefault(receptor, [np.zeros((N_FEATURES, N_FEATURES)), np.zeros(N_FEATURES),
+                                                 np.zeros(N_FEATURES), 0.0, 0])
+        stats[0] += X.T @ X
+        stats[1] += X.T @ y
+        stats[2] += X.sum(axis=0)
+        stats[3] += y.sum()
+        stats[4] += len(y)
+        self.weights = None
+
+    def add_scores(self, key, helixpool, scores):
+        """
+        Add the scores of one iteration, once per key.
+
+        Args:
+        key (str): Identifier of the iteration, '<run>:<iteration>'.
+        helixpool (list): The helix pool of the iteration.
+        scores (dict): Output of hs.get_scores, {ligand file models<i>_<j>.pdb: {receptor: score, ...}}.
+            With a coarse docking tier, only the peptides whose fidelity is 'fine' are added: coarse and
+            fine HDOCK scores are not on the same scale.
+        """
+        if key in self.trained:
+            return
+        by_receptor = {}
+        for ligand_name, ligand_scores in scores.items():
+            match = re.search(r'models\d+_(\d+)\.pdb$', ligand_name)
+            if match is None or ligand_scores.get('fidelity', 'fine') != 'fine':
+                continue
+            peptide = helixpool[int(match.group(1))]
+            for receptor, score in ligand_scores.items():
+                if receptor not in ('score', 'partial', 'fidelity'):
+                    by_receptor.setdefault(receptor, ([], []))
+                    by_receptor[receptor][0].append(peptide)
+                    by_receptor[receptor][1].append(float(score))
+        for receptor, (peptides, receptor_scores) in by_receptor.items():
+            self.add(peptides, receptor, receptor_scores)
+        self.trained.add(key)
+
+    def fit(self):
+        # Solve the centred ridge regression of each receptor from its sufficient statistics
+        self.weights = {}
+        for receptor, (XtX, Xty, sx, sy, n) in self.stats.items():
+            if n == 0:
+                continue
+            mean_x, mean_y = sx / n, sy / n
+            A = XtX - n * np.outer(mean_x, mean_x) + self.alpha * np.eye(N_FEATURES)
+            w = np.linalg.solve(A, Xty - n * mean_x * mean_y)
+            self.weights[receptor] = (w, mean_y - mean_x @ w)
+
+    def predict(self, peptides):
+        """
+        Predict the average docking score of peptides (lower is better).
+
+        Returns:
+        ndarray: One predicted score per peptide.
+        """
+        if self.weights is None:
+            self.fit()
+        X = features(peptides)
+        predictions = [X @ w + intercept for w, intercept in self.weights.values()]
+        return np.mean(predictions, axis=0) if predictions else np.zeros(len(peptides))
+
+    def save(self, path):
+        # Replace the file atomically, so that an interruption never leaves a broken model
+        arrays = {'receptors': np.array(sorted(self.stats)), 'trained': np.array(sorted(self.trained)),
+                  'alpha': self.alpha}
+        for k, receptor in enumerate(sorted(self.stats)):
+            XtX, Xty, sx, sy, n = self.stats[receptor]
+            arrays.update({f'XtX{k}': XtX, f'Xty{k}': Xty, f'sx{k}': sx, f'sy{k}': sy, f'n{k}': n})
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, min_samples=10):
+        data = np.load(path)
+        model = cls(alpha=float(data['alpha']), min_samples=min_samples)
+        for k, receptor in enumerate(data['receptors']):
+            model.stats[str(receptor)] = [data[f'XtX{k}'], data[f'Xty{k}'], data[f'sx{k}'],
+                                          float(data[f'sy{k}']), int(data[f'n{k}'])]
+        model.trained = set(str(key) for key in data['trained'])
+        return model
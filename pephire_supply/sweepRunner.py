@@ -0,0 +1,145 @@
+"""
+Version 1.0,
+Parameter sweep: runs of pephire.py over a grid of parameter sets.
+
+The grid file has the format of parameters.txt, with a list of values for
+each swept parameter, e.g.
+    limitSize = [0.3, 0.5]
+    N_newPiptide = [50, 100]
+and every combination is run. Each run gets its own folder
+Data_output/sweep_<grid>/run<k>/ with a parameters.txt (the current one with
+the values of the run appended), a link to Data_input and its own
+_external_app folder (links to the installed tools and files), so that the
+runs do not share temp files and can run concurrently. All runs use the tool
+cache Data_output/sweep_<grid>/cache (see toolCache.py), so a peptide
+predicted or docked by one run is not computed again by the others, and are
+traced; summary.csv then compares the cost of each run (wall time, tool
+calls, cache hits) with its yield (peptides below the threshold).
+"""
+
+
+import os
+import csv
+import sys
+import json
+import time
+import itertools
+import subprocess
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pephire.py')
+TOOLS = ['runpsipred_single', 'modpep', 'hdock', 'createpl']
+
+def expand_grid(grid):
+    """
+    All combinations of the values of a grid.
+
+    Args:
+    grid (dict): Parameter name -> list of values (a single value is swept as a list of one).
+
+    Returns:
+    list: One dict of parameter values per run.
+    """
+    names = list(grid)
+    values = [grid[name] if isinstance(grid[name], list) else [grid[name]] for name in names]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+def prepare_run(run_folder, overrides, cache_folder):
+    """
+    Create the folder of one run: parameters.txt with the overrides, Data_input and _external_app.
+    """
+    os.makedirs(os.path.join(run_folder, '_external_app'), exist_ok=True)
+    if not os.path.lexists(os.path.join(run_folder, 'Data_input')):
+        os.symlink(os.path.abspath('Data_input'), os.path.join(run_folder, 'Data_input'))
+    # Tools and auxiliary files are linked; the temp files of the run stay in its own folder
+    for name in os.listdir('_external_app'):
+        link = os.path.join(run_folder, '_external_app', name)
+        if not name.startswith('peptide') and not os.path.lexists(link):
+            os.symlink(os.path.abspath(os.path.join('_external_app', name)), link)
+
+    with open('parameters.txt') as f:
+        parameters = f.read()
+    with open(os.path.join(run_folder, 'parameters.txt'), 'w') as f:
+        f.write(parameters.rstrip('\n') + '\n\n\n# Parameter sweep\n')
+        for name, value in overrides.items():
+            f.write(f'{name} = {value!r}\n')
+        f.write(f'tool_cache = {os.path.abspath(cache_folder)!r}\n')
+        f.write('trace = True\n')
+
+def run_cost(run_folder, name):
+    """
+    Read the tool calls and cache hits of a run from its trace, and its hits from the output file.
+
+    Returns:
+    dict: Number of runs of each tool, cache hits and hits.
+    """
+    cost = {tool: 0 for tool in TOOLS}
+    cost['cache_hits'] = 0
+    trace_file = os.path.join(run_folder, 'Data_output', f'{name}_appendix', 'trace.jsonl')
+    if os.path.exists(trace_file):
+        with open(trace_file) as f:
+            for line in f:
+                event = json.loads(line)
+                if event['cat'] == 'subprocess' and event['name'] in cost:
+                    cost[event['name']] += 1
+                elif event['cat'] == 'cache':
+                    cost['cache_hits'] += 1
+    output_file = os.path.join(run_folder, 'Data_output', f'{name}.csv')
+    cost['hits'] = None
+    if os.path.exists(output_file):
+        with open(output_file) as f:
+            cost['hits'] = max(0, sum(1 for _ in f) - 1)
+    return cost
+
+def run_sweep(grid, sweep_name, max_parallel=None, poll=0.2):
+    """
+    Run pephire.py for every parameter set of a grid, at most max_parallel at a time, and write summary.csv.
+
+    Args:
+    grid (dict): Parameter name -> list of values, see expand_grid.
+    sweep_name (str): Name of the sweep; the runs are in Data_output/sweep_<sweep_name>/.
+    max_parallel (int, optional): Number of concurrent runs. Defaults to the number of cores.
+    poll (float): Seconds between two checks of the running runs.
+
+    Returns:
+    int: 0 if every run succeeded, 1 otherwise.
+    """
+    sweep_folder = os.path.join('Data_output', f'sweep_{sweep_name}')
+    cache_folder = os.path.join(sweep_folder, 'cache')
+    runs = []
+    for k, overrides in enumerate(expand_grid(grid)):
+        run_folder = os.path.join(sweep_folder, f'run{k}')
+        prepare_run(run_folder, overrides, cache_folder)
+        runs.append({'name': f'run{k}', 'folder': run_folder, 'overrides': overrides})
+
+    max_parallel = max_parallel or os.cpu_count() or 1
+    pending, running = list(runs), []
+    while pending or running:
+        while pending and len(running) < max_parallel:
+            run = pending.pop(0)
+            run['log'] = open(os.path.join(run['folder'], 'pephire.log'), 'w')
+            run['start'] = time.perf_counter()
+            run['process'] = subprocess.Popen([sys.executable, SCRIPT, run['name'] + '.csv'], cwd=run['folder'],
+                                              stdout=run['log'], stderr=subprocess.STDOUT)
+            running.append(run)
+            print(f"Started {run['name']}: {run['overrides']}")
+        for run in list(running):
+            if run['process'].poll() is not None:
+                run['seconds'] = time.perf_counter() - run['start']
+                run['log'].close()
+                running.remove(run)
+                print(f"Finished {run['name']} in {run['seconds']:.1f} s (exit status {run['process'].returncode})")
+        if running:
+            time.sleep(poll)
+
+    columns = ['run'] + list(grid) + ['returncode', 'wall_seconds'] + TOOLS + ['cache_hits', 'hits', 'hdock_per_hit']
+    with open(os.path.join(sweep_folder, 'summary.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for run in runs:
+            cost = run_cost(run['folder'], run['name'])
+            row = {'run': run['name'], 'returncode': run['process'].returncode,
+                   'wall_seconds': f"{run['seconds']:.1f}", **run['overrides'], **cost}
+            row['hdock_per_hit'] = f"{cost['hdock'] / cost['hits']:.1f}" if cost['hits'] else ''
+            writer.writerow([row.get(column, '') for column in columns])
+    print(f'Summary written to {sweep_folder}/summary.csv')
+    return 0 if all(run['process'].returncode == 0 for run in runs) else 1
@@ -0,0 +1,84 @@
+"""
+Version 1.0,
+Cache of the outputs of PSIPRED, MODPEP and HDOCK, shared by runs.
+
+The tools are deterministic for a given peptide (and receptor), so their
+output files are kept in a cache folder under a hash of their inputs and
+copied back instead of running the tool again. Files enter the cache through
+a temporary name and os.replace, so concurrent runs (e.g. of a parameter
+sweep) can share one folder. Every hit is recorded in the trace as a
+'cache' event.
+"""
+
+
+import os
+import time
+import shutil
+import hashlib
+from pephire_supply import tracing as tr
+
+def file_digest(path):
+    # Hash of the content of an input file, e.g. a receptor
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def fasta_sequence(path):
+    # Sequence of a peptide{i}_{j}.fasta file written by the PSIPRED stage
+    with open(path) as f:
+        return ''.join(line.strip() for line in f if not line.startswith('>'))
+
+
+class ToolCache(object):
+    """
+    Folder of cached tool outputs, <folder>/<tool>/<hash[:2]>/<hash><suffix>.
+
+    Args:
+    folder (str): Cache folder, created if needed.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self.digests = {}
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, tool, key, suffix):
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.folder, tool, digest[:2], digest + suffix)
+
+    def receptor_key(self, sequence, pdb_path):
+        # Docking key: the peptide and the content of the receptor file
+        if pdb_path not in self.digests:
+            self.digests[pdb_path] = file_digest(pdb_path)
+        return f'{sequence}|{self.digests[pdb_path]}'
+
+    def fetch(self, tool, key, suffixes, targets):
+        """
+        Copy the cached outputs of one tool run to their targets.
+
+        Args:
+        tool (str): Name of the tool, e.g. 'psipred'.
+        key (str): Inputs of the run, e.g. the peptide sequence.
+        suffixes (list): Suffixes of the output files, e.g. ['.horiz', '.ss2'].
+        targets (list): Paths the outputs are copied to, in the order of suffixes.
+
+        Returns:
+        bool: True if all the outputs were in the cache.
+        """
+        paths = [self.path(tool, key, suffix) for suffix in suffixes]
+        if not all(os.path.exists(path) for path in paths):
+            return False
+        ts = time.time()
+        for path, target in zip(paths, targets):
+            shutil.copyfile(path, target)
+        tr.record(tool, 'cache', ts, time.time() - ts, key=key)
+        return True
+
+    def store(self, tool, key, suffixes, sources):
+        """
+        Add the outputs of one tool run to the cache (sources are copied, not moved).
+        """
+        for suffix, source in zip(suffixes, sources):
+            path = self.path(tool, key, suffix)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            shutil.copyfile(source, tmp)
+            os.replace(tmp, path)
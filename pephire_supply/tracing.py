@@ -0,0 +1,185 @@
+"""
+Version 1.0,
+Timing instrumentation of the stages and of the external tools.
+
+Tracing is off by default; span() then returns a shared no-op context and
+traced functions call straight through, so the instrumentation can stay in
+the code. When enabled, every event is appended to a JSON lines file as soon
+as it ends:
+    {"name", "cat", "ts" (start, epoch seconds), "dur" (wall seconds), "tid", "args"}
+Stage spans record their CPU time (own and children), and the bytes written by
+the process and its reaped children (Linux /proc/self/io); subprocess events
+record the command, exit status and the time spent waiting for a slot or a
+worker. export_chrome() converts the JSON lines into a Chrome trace-event file
+(chrome://tracing, Perfetto).
+"""
+
+
+import os
+import json
+import time
+import threading
+import functools
+import contextlib
+from collections import Counter
+
+_trace = {'file': None, 'path': None}
+_lock = threading.Lock()
+_calls = Counter()  # Runs of each external tool by this process, counted whether tracing is enabled or not
+_NULL = contextlib.nullcontext()
+
+def enable(jsonl_path):
+    """
+    Start recording events to a JSON lines file (appended to if it exists).
+    """
+    _trace['file'] = open(jsonl_path, 'a')
+    _trace['path'] = jsonl_path
+
+def disable():
+    if _trace['file'] is not None:
+        _trace['file'].close()
+    _trace['file'] = None
+
+def enabled():
+    return _trace['file'] is not None
+
+def after_fork():
+    """
+    Stop recording in a forked process, so that its events do not go into the trace of the parent.
+    record() flushes every event, so closing the inherited file writes nothing; the lock is replaced in case
+    another thread of the parent held it when the process was forked.
+    """
+    global _lock
+    _lock = threading.Lock()
+    disable()
+
+def bytes_written():
+    # Bytes written by this process and its reaped children, None where /proc/self/io is not available
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+def record(name, cat, ts, dur, tid=None, **args):
+    """
+    Append one event to the trace.
+
+    Args:
+    name (str): Name of the event.
+    cat (str): Category, e.g. 'stage' or 'subprocess'.
+    ts (float): Start time, epoch seconds.
+    dur (float): Wall time in seconds.
+    tid (int, optional): Track of the event in the Chrome trace. Defaults to the current thread;
+        concurrent subprocesses use their pid so that their slices do not overlap.
+    """
+    if _trace['file'] is None:
+        return
+    tid = threading.get_ident() if tid is None else tid
+    event = {'name': name, 'cat': cat, 'ts': ts, 'dur': dur, 'tid': tid, 'args': args}
+    with _lock:
+        _trace['file'].write(json.dumps(event) + '\n')
+        _trace['file'].flush()
+
+
+class Span(object):
+    """
+    Context manager timing a stage: wall time, CPU time of this process and of its children, bytes written.
+    """
+    def __init__(self, name, cat, args):
+        self.name, self.cat, self.args = name, cat, args
+
+    def __enter__(self):
+        self.ts = time.time()
+        self.t0 = time.perf_counter()
+        self.times0 = os.times()
+        self.bytes0 = bytes_written()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        dur = time.perf_counter() - self.t0
+        times1 = os.times()
+        self.args['cpu'] = (times1.user - self.times0.user) + (times1.system - self.times0.system)
+        self.args['children_cpu'] = (times1.children_user - self.times0.children_user) + (times1.children_system - self.times0.children_system)
+        bytes1 = bytes_written()
+        if bytes1 is not None and self.bytes0 is not None:
+            self.args['bytes_written'] = bytes1 - self.bytes0
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        record(self.name, self.cat, self.ts, dur, **self.args)
+        return False
+
+def span(name, cat='stage', **args):
+    """
+    Time a block of code: `with tr.span('docking', iteration=i): ...`.
+    """
+    if _trace['file'] is None:
+        return _NULL
+    return Span(name, cat, args)
+
+def traced(func):
+    """
+    Decorator timing every call of a function as a span named <module>.<function>.
+    """
+    name = func.__module__.split('.')[-1] + '.' + func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _trace['file'] is None:
+            return func(*args, **kwargs)
+        with Span(name, 'function', {}):
+            return func(*args, **kwargs)
+    return wrapper
+
+def record_subprocess(args, ts, dur, returncode, wait=0.0, tid=None, **extra):
+    """
+    Record one run of an external tool.
+
+    Args:
+    args (list): Command line.
+    ts (float): Start time, epoch seconds.
+    dur (float): Wall time in seconds.
+    returncode (int): Exit status.
+    wait (float): Seconds spent waiting for a free slot or a worker before the tool started.
+    """
+    count_call(args)
+    if _trace['file'] is None:
+        return
+    record(os.path.basename(args[0]), 'subprocess', ts, dur, tid=tid, command=' '.join(args), returncode=returncode,
+           wait=wait, **extra)
+
+def count_call(args):
+    # Count one run of an external tool, by the name of its executable
+    with _lock:
+        _calls[os.path.basename(args[0])] += 1
+
+def calls():
+    """
+    Runs of each external tool so far, e.g. {'hdock': 120, 'runpsipred_single': 48}.
+    """
+    with _lock:
+        return dict(_calls)
+
+def export_chrome(jsonl_path, chrome_path):
+    """
+    Convert a JSON lines trace into a Chrome trace-event file, streaming the events.
+    Waits of more than a millisecond before subprocesses are drawn as separate 'wait' slices.
+    """
+    pid = os.getpid()
+    with open(jsonl_path) as f_in, open(chrome_path, 'w') as f_out:
+        f_out.write('{"traceEvents": [\n')
+        first = True
+        for line in f_in:
+            event = json.loads(line)
+            slices = [{'name': event['name'], 'cat': event['cat'], 'ph': 'X', 'pid': pid, 'tid': event['tid'],
+                       'ts': event['ts'] * 1e6, 'dur': event['dur'] * 1e6, 'args': event['args']}]
+            wait = event['args'].get('wait', 0.0)
+            if wait > 1e-3:  # Waits shorter than a millisecond would only clutter the view
+                slices.append({'name': 'wait ' + event['name'], 'cat': 'wait', 'ph': 'X', 'pid': pid, 'tid': event['tid'],
+                               'ts': (event['ts'] - wait) * 1e6, 'dur': wait * 1e6, 'args': {}})
+            for s in slices:
+                f_out.write(('' if first else ',\n') + json.dumps(s))
+                first = False
+        f_out.write('\n]}\n')
@@ -0,0 +1,28 @@
+import os
+import random
+import numpy as np
+import pephire
+
+def test_checkpoint_restores_the_state_and_the_random_generators(tmp_path):
+    checkpoint_file = str(tmp_path / 'checkpoint.json')
+    state = {'iteration': 2, 'stages': ['generated', 'helix'], 'pipPool': ['IIRNIARHLAQVGDSMDRSIP'],
+             'peptides': ['PEIWIAQELRRIGDEFNAYYA'], 'docked_scores': {'IEIWIARELRQIGDSFDAYYP': -215.5}}
+    random.seed(3)
+    np.random.seed(3)
+    random.random()
+    np.random.rand(5)
+    pephire.save_checkpoint(checkpoint_file, state)
+    expected = random.random(), np.random.rand(3).tolist()
+
+    random.seed(4)
+    np.random.seed(4)
+    loaded = pephire.load_checkpoint(checkpoint_file)
+    assert loaded == state
+    assert (random.random(), np.random.rand(3).tolist()) == expected
+    assert os.listdir(tmp_path) == ['checkpoint.json']  # Written through a temporary file
+
+def test_checkpoint_is_replaced_whole(tmp_path):
+    checkpoint_file = str(tmp_path / 'checkpoint.json')
+    pephire.save_checkpoint(checkpoint_file, {'iteration': 1, 'stages': ['generated'], 'peptides': ['A'] * 1000})
+    pephire.save_checkpoint(checkpoint_file, {'iteration': 2, 'stages': []})
+    assert pephire.load_checkpoint(checkpoint_file) == {'iteration': 2, 'stages': []}
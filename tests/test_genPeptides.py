@@ -0,0 +1,58 @@
+import math
+import random
+import pytest
+from pephire_supply import genPeptides as gp
+
+SEEDS = ['IIRNIARHLAQVGDSMDRSIP', 'PEIWIAQELRRIGDEFNAYYA']
+
+def random_pips(n, seed=0):
+    rng = random.Random(seed)
+    return [''.join(rng.choice('ACDEFGHIKLMNPQRSTVWY') for _ in range(21)) for _ in range(n)]
+
+def near(pip):
+    # One letter away from pip
+    return pip[:-1] + ('A' if pip[-1] != 'A' else 'C')
+
+def test_prune_keeps_the_best_pip_in_a_single_free_place():
+    # The best pip is the closest to a seed, the last one the diversity alone would keep
+    pips = random_pips(4) + [near(SEEDS[0])]
+    scores = {pip: -200.0 - j for j, pip in enumerate(pips)}
+    pool = gp.prunePipPool(SEEDS + pips, 3, seeds=SEEDS, scores=scores)
+    assert pool == SEEDS + [near(SEEDS[0])]
+
+def test_prune_keeps_the_seeds_and_bounds_the_size():
+    pips = random_pips(30)
+    scores = {pip: -180.0 - j % 7 for j, pip in enumerate(pips[:20])}
+    best = min(scores, key=scores.get)
+    for maxSize in [2, 3, 5, 10, 31]:
+        pool = gp.prunePipPool(SEEDS + pips, maxSize, seeds=SEEDS, scores=scores)
+        assert len(pool) == maxSize
+        assert pool[:2] == SEEDS
+        assert maxSize == 2 or best in pool
+        assert pool == [pip for pip in SEEDS + pips if pip in pool]  # In their order in the pool
+
+    # The seeds are kept even if there are more of them than places
+    assert gp.prunePipPool(SEEDS + pips, 1, seeds=SEEDS, scores=scores) == SEEDS
+
+def test_prune_without_scores_keeps_the_most_diverse_pips():
+    pips = random_pips(3)
+    pool = gp.prunePipPool(SEEDS + [near(SEEDS[0])] + pips, 4, seeds=SEEDS)
+    assert len(pool) == 4 and near(SEEDS[0]) not in pool
+
+def test_feedback_weights_match_the_peptides_containing_each_ladderon():
+    rng = random.Random(1)
+    pips = random_pips(40, seed=1)
+    scores = {pip: rng.uniform(-250.0, -150.0) for pip in pips}
+    listLadderon = sorted({pip[start:start + length] for pip in pips[:10] for length in [1, 2, 3, 5]
+                           for start in range(0, 21 - length, 4)}) + ['WWWWW']
+    weights = gp.feedbackWeights(listLadderon, scores, strength=1.0, exploration=0.2)
+
+    mean = sum(scores.values()) / len(scores)
+    std = (sum((v - mean) ** 2 for v in scores.values()) / len(scores)) ** 0.5
+    for ladderon, weight in zip(listLadderon, weights):
+        found = [score for peptide, score in scores.items() if ladderon in peptide]
+        if not found:
+            assert weight == 1.0
+            continue
+        z = max(-5.0, min(5.0, (sum(found) / len(found) - mean) / std * len(found) / (len(found) + 1)))
+        assert weight == pytest.approx(0.8 * math.exp(-z) + 0.2)
@@ -0,0 +1,96 @@
+import gzip
+import os
+import pytest
+from pephire_supply import hdockScore as hs
+from pephire_supply import runDatabase as rd
+
+HELIXPOOL = ['IIRNIARHLAQVGDSMDRSIP', 'PEIWIAQELRRIGDEFNAYYA', 'IEIWIARELRQIGDSFDAYYP']
+OUTPUT = 'Data_output/a_appendix'
+
+def write_hdock(i, j, receptor, score, spacing=1.2, angle=15.0):
+    # Header and top pose of a Hdock*.out file, as read by read_hdock_score and read_sampling
+    with open(os.path.join(OUTPUT, f'Hdock{i}_{j}_{receptor}.out'), 'w') as f:
+        f.write(f'Grid spacing:     {spacing:.3f}\nAngle step:    {angle:.3f}\n'
+                f'Initial rotation:     0.00000   0.00000   0.00000\n{receptor}.pdb      1 2 3\n'
+                f'{OUTPUT}/models{i}_{j}.pdb      1 2 3\n')
+        f.write(f'   5.8 2.0 1.1 24.1 -56.0 -8.5 {score:.2f} 61.83 1.00\n')
+
+def write_helixpool(i, helixpool):
+    with open(os.path.join(OUTPUT, f'helixpool{i}.csv'), 'w') as f:
+        f.write('helixpool\n' + ''.join(f'{p}\n' for p in helixpool))
+
+@pytest.fixture
+def output(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(OUTPUT)
+    write_helixpool(0, HELIXPOOL[:2])
+    store = rd.RunDatabase(str(tmp_path / 'results.sqlite'), 'a')
+    store.append('helixpool', [(0, j, p) for j, p in enumerate(HELIXPOOL[:2])])
+    yield store
+    store.close()
+
+def test_partial_means_are_ranked_after_complete_ones(output):
+    # The first peptide was screened out after one receptor, with a better partial mean than the complete one
+    write_hdock(0, 0, '2PQK', -228.0)
+    write_hdock(0, 1, '2PQK', -220.0)
+    write_hdock(0, 1, '3KJ2', -227.0)
+    pdb_files = ['2PQK.pdb', '3KJ2.pdb']
+    scores = hs.get_scores(0, 'a', pdb_files, store=output)
+
+    in_memory = hs.get_peptide_score(0, 'a', write_csv=False, scores=scores, helixpool=HELIXPOOL[:2], pdb_files=pdb_files)
+    from_db = hs.get_peptide_score(0, 'a', store=output, write_csv=False, pdb_files=pdb_files)
+    from_csv = hs.get_peptide_score(0, 'a')
+    for records in [in_memory, from_db, from_csv]:
+        assert [(record['helixpool'], record['score'], record['partial']) for record in records] == \
+               [(HELIXPOOL[1], -223.5, False), (HELIXPOOL[0], -228.0, True)]
+    assert hs.create_dockingpool(0, 1, 'a', write_csv=False, peptide_scores=in_memory) == [HELIXPOOL[1]]
+    assert hs.create_dockingpool(0, 1, 'a', store=output, write_csv=False) == [HELIXPOOL[1]]
+    assert hs.create_dockingpool(0, 1, 'a') == [HELIXPOOL[1]]
+
+def test_receptors_no_peptide_reached_keep_their_column(output):
+    write_hdock(0, 0, '2PQK', -228.0)
+    write_hdock(0, 1, '2PQK', -220.0)
+    pdb_files = ['2PQK.pdb', '3KJ2.pdb']
+    scores = hs.get_scores(0, 'a', pdb_files, store=output)
+
+    records = hs.get_peptide_score(0, 'a', scores=scores, helixpool=HELIXPOOL[:2], pdb_files=pdb_files)
+    assert all(record['3KJ2'] is None and record['partial'] for record in records)
+    with open(os.path.join(OUTPUT, 'peptide_score0.csv')) as f:
+        assert f.readline().strip() == 'helixpool,2PQK,3KJ2,score,partial'
+    records = hs.get_peptide_score(0, 'a', store=output, write_csv=False, pdb_files=pdb_files)
+    assert all(record['3KJ2'] is None for record in records)
+
+def test_scores_carry_their_tier_and_completeness(output):
+    coarse = {'spacing': 2.0, 'angle': 30}
+    write_helixpool(1, HELIXPOOL)
+    output.append('helixpool', [(1, j, p) for j, p in enumerate(HELIXPOOL)])
+    write_hdock(1, 0, '2PQK', -230.0)
+    write_hdock(1, 0, '3KJ2', -220.0)
+    write_hdock(1, 1, '2PQK', -300.0, spacing=2.0, angle=30)
+    write_hdock(1, 1, '3KJ2', -290.0, spacing=2.0, angle=30)
+    write_hdock(1, 2, '2PQK', -250.0)  # Fine docking stopped by screening, the coarse score of 3KJ2 kept
+    write_hdock(1, 2, '3KJ2', -260.0, spacing=2.0, angle=30)
+    # Compressed artifacts are read like plain ones
+    path = os.path.join(OUTPUT, 'Hdock1_0_3KJ2.out')
+    with open(path, 'rb') as f, gzip.open(path + '.gz', 'wb') as g:
+        g.write(f.read())
+    os.remove(path)
+    pdb_files = ['2PQK.pdb', '3KJ2.pdb', '5T35.pdb']
+    scores = hs.get_scores(1, 'a', pdb_files, store=output, coarse=coarse)
+
+    assert [(scores[f'{OUTPUT}/models1_{j}.pdb']['fidelity'], scores[f'{OUTPUT}/models1_{j}.pdb']['partial'])
+            for j in range(3)] == [('fine', True), ('coarse', True), ('mixed', True)]
+    assert scores[f'{OUTPUT}/models1_0.pdb']['score'] == '-225.000'
+    with open(os.path.join(OUTPUT, 'Get_Score1.csv')) as f:
+        assert f.readline().strip() == 'REMARK Ligand,2PQK,3KJ2,5T35,score,partial,fidelity'
+    assert output.query('SELECT j, receptor, fidelity FROM docking WHERE run = ? AND iteration = 1 ORDER BY j, receptor',
+                        (output.run,)) == [(0, '2PQK', 'fine'), (0, '3KJ2', 'fine'), (1, '2PQK', 'coarse'),
+                                           (1, '3KJ2', 'coarse'), (2, '2PQK', 'fine'), (2, '3KJ2', 'coarse')]
+
+    # The fine scores come first however good the others are, then the mixed ones
+    records = hs.get_peptide_score(1, 'a', store=output, write_csv=False, pdb_files=pdb_files)
+    assert [(record['helixpool'], record['fidelity']) for record in records] == \
+           [(HELIXPOOL[0], 'fine'), (HELIXPOOL[2], 'mixed'), (HELIXPOOL[1], 'coarse')]
+    records = hs.get_peptide_score(1, 'a', scores=scores, helixpool=HELIXPOOL, pdb_files=pdb_files)
+    assert [record['helixpool'] for record in records] == [HELIXPOOL[0], HELIXPOOL[2], HELIXPOOL[1]]
+    assert [record['helixpool'] for record in hs.get_peptide_score(1, 'a')] == [HELIXPOOL[0], HELIXPOOL[2], HELIXPOOL[1]]
@@ -0,0 +1,53 @@
+import csv
+from pephire_supply import hitSelection as hsel
+
+RECEPTORS = ['3KJ2', '2PQK']
+
+def record(peptide, score, partial=False, fidelity=None):
+    result = {'helixpool': peptide, '2PQK': score, '3KJ2': score, 'score': score, 'partial': partial}
+    if fidelity is not None:
+        result['fidelity'] = fidelity
+    return result
+
+def read_hits(path):
+    with open(path, newline='') as f:
+        return [row for row in csv.reader(f)]
+
+def test_only_complete_fine_scores_below_the_threshold_are_hits(tmp_path):
+    hits = hsel.HitSelector(-200.0, RECEPTORS, str(tmp_path / 'hits_stream.csv'))
+    assert hits.add([record('AAA', -230.0), record('CCC', -190.0), record('DDD', -240.0, partial=True),
+                     record('EEE', -250.0, fidelity='coarse'), record('FFF', -250.0, fidelity='mixed'),
+                     record('GGG', -210.0, fidelity='fine')]) == 2
+    assert hits.finish(str(tmp_path / 'a.csv')) == ['AAA', 'GGG']
+    rows = read_hits(tmp_path / 'a.csv')
+    assert rows[0] == ['helixpool', '2PQK', '3KJ2', 'score', 'partial']
+    assert rows[1] == ['AAA', '-230.0', '-230.0', '-230.0', 'False']
+
+def test_top_k_keeps_the_best_hits_sorted(tmp_path):
+    hits = hsel.HitSelector(-200.0, RECEPTORS, str(tmp_path / 'hits_stream.csv'), top_k=3)
+    hits.add([record('AAA', -210.0), record('CCC', -240.0), record('DDD', -220.0)])
+    hits.add([record('EEE', -250.0), record('FFF', -240.0), record('GGG', -205.0)])
+    assert len(hits.heap) == 3
+    # Ties go to the hit found first
+    assert hits.finish(str(tmp_path / 'a.csv')) == ['EEE', 'CCC', 'FFF']
+    # The stream still has every hit, in the order they were found
+    assert [row[0] for row in read_hits(tmp_path / 'hits_stream.csv')] == ['AAA', 'CCC', 'DDD', 'EEE', 'FFF', 'GGG']
+
+def test_resume_drops_the_hits_written_after_the_checkpoint(tmp_path):
+    stream_file = str(tmp_path / 'hits_stream.csv')
+    for top_k in [None, 2]:
+        hits = hsel.HitSelector(-200.0, RECEPTORS, stream_file, top_k=top_k)
+        hits.add([record('AAA', -210.0), record('CCC', -230.0)])
+        state = hits.state()  # Saved with the checkpoint of iteration 0
+        hits.add([record('DDD', -250.0)])  # Iteration 1, interrupted before its checkpoint
+        hits.stream.close()
+
+        resumed = hsel.HitSelector(-200.0, RECEPTORS, stream_file, top_k=top_k, state=state)
+        resumed.add([record('DDD', -250.0), record('EEE', -220.0)])  # Iteration 1 done again
+        found = resumed.finish(str(tmp_path / 'a.csv'))
+        assert found == (['AAA', 'CCC', 'DDD', 'EEE'] if top_k is None else ['DDD', 'CCC'])
+        assert [row[0] for row in read_hits(stream_file)] == ['AAA', 'CCC', 'DDD', 'EEE']
+
+        # A new run starts from an empty stream
+        hsel.HitSelector(-200.0, RECEPTORS, stream_file).stream.close()
+        assert read_hits(stream_file) == []
@@ -0,0 +1,124 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import pytest
+from pephire_supply import jobQueue as jq
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def python_job(code, cwd):
+    return jq.make_job([sys.executable, '-c', code], cwd=str(cwd))
+
+def test_expired_lease_is_handed_to_another_worker(tmp_path):
+    queue = jq.JobQueue(str(tmp_path / 'queue.sqlite'), lease=0.2)
+    job_id, = queue.submit([python_job("open('out.txt', 'w').write('done')", tmp_path)])
+
+    claimed = queue.claim('lost-worker')  # Claimed, then the worker stops sending heartbeats
+    assert claimed['id'] == job_id
+    assert queue.claim('other-worker') is None  # Still leased
+    time.sleep(0.3)
+
+    jq.worker(str(tmp_path / 'queue.sqlite'), name='second-worker', lease=0.2, poll=0.05, idle_exit=0.2)
+    status, returncode, _ = queue.status([job_id])[job_id]
+    assert (status, returncode) == ('done', 0)
+    assert queue.times(job_id)[3] == 'second-worker'
+    assert (tmp_path / 'out.txt').read_text() == 'done'
+
+    # The first worker lost the job: its heartbeats and its result are ignored
+    assert not queue.heartbeat(job_id, 'lost-worker')
+    queue.complete(job_id, 'lost-worker', 1)
+    assert queue.status([job_id])[job_id][0] == 'done'
+    queue.close()
+
+def test_job_failing_after_max_attempts(tmp_path):
+    queue = jq.JobQueue(str(tmp_path / 'queue.sqlite'), lease=0.1, max_attempts=2)
+    job_id, = queue.submit([python_job('pass', tmp_path)])
+    for _ in range(2):
+        assert queue.claim('lost-worker')['id'] == job_id
+        time.sleep(0.15)
+    assert queue.claim('other-worker') is None
+    assert queue.status([job_id])[job_id][0] == 'failed'
+    queue.close()
+
+def test_failed_job_is_reported_to_the_executor(tmp_path):
+    path = str(tmp_path / 'queue.sqlite')
+    executor = jq.QueueExecutor(path, poll=0.05)
+    # The worker runs in another process, as on a cluster node
+    process = subprocess.Popen([sys.executable, '-c', 'import sys; sys.path.insert(0, sys.argv[1]); '
+                                'from pephire_supply import jobQueue as jq; jq.worker(sys.argv[2], poll=0.05, idle_exit=1.0)',
+                                ROOT, path])
+    done = []
+    try:
+        with pytest.raises(subprocess.CalledProcessError) as error:
+            executor.run([python_job('pass', tmp_path), python_job('import sys; sys.exit(4)', tmp_path)],
+                         on_done=done.append)
+    finally:
+        process.wait()
+    assert error.value.returncode == 4
+    assert [job['args'][-1] for job in done] == ['pass']
+
+def timed_tool(tmp_path):
+    # A tool that records when it starts and ends, named so that it has its own profile
+    tool = tmp_path / 'timedjob'
+    tool.write_text(f'#!{sys.executable}\nimport sys, time\n'
+                    "with open(sys.argv[1], 'a') as f:\n"
+                    "    f.write(f'{time.time()} ')\n"
+                    '    time.sleep(0.3)\n'
+                    "    f.write(f'{time.time()}\\n')\n")
+    tool.chmod(0o755)
+    return str(tool)
+
+def test_scheduler_serializes_jobs_over_the_memory_budget(tmp_path):
+    tool = timed_tool(tmp_path)
+    profile = tmp_path / 'profile.json'
+    profile.write_text(json.dumps({'timedjob': {'wall': 0.3, 'cores': 0.1, 'memory': 200.0, 'jobs': 5}}))
+    # Two jobs of 200 MB do not fit in 300 MB; smoothing=0 keeps the profile as it is
+    executor = jq.ScheduledExecutor(memory=300.0, profile=str(profile), poll=0.01, smoothing=0.0)
+    jobs = [jq.make_job([tool, str(tmp_path / f'log{k}.txt')], cwd=str(tmp_path)) for k in range(3)]
+    done = []
+    executor.run(jobs, on_done=done.append)
+
+    assert len(done) == 3
+    intervals = sorted(tuple(map(float, (tmp_path / f'log{k}.txt').read_text().split())) for k in range(3))
+    for (_, end), (start, _) in zip(intervals, intervals[1:]):
+        assert start >= end
+    assert json.loads(profile.read_text())['timedjob']['jobs'] == 8
+
+def test_scheduler_profiles_round_trip(tmp_path):
+    profile = str(tmp_path / 'profile.json')
+    executor = jq.ScheduledExecutor(memory=1000.0, profile=profile, smoothing=0.5)
+    executor.learn('hdock', 2.0, 1.0, 100.0)
+    executor.learn('hdock', 4.0, 4.0, 300.0)
+    executor.save_profiles()
+    assert executor.profiles['hdock'] == {'wall': 3.0, 'cores': 0.75, 'memory': 200.0, 'jobs': 2}
+
+    restored = jq.ScheduledExecutor(memory=1000.0, profile=profile)
+    assert restored.profiles == executor.profiles
+    assert restored.expected(jq.make_job(['/usr/bin/hdock', 'a.pdb', 'b.pdb'])) == executor.profiles['hdock']
+    assert restored.expected(jq.make_job(['modpep'])) == jq.ScheduledExecutor.DEFAULTS
+
+def test_failed_job_cancels_the_rest_of_its_batch(tmp_path):
+    path = str(tmp_path / 'queue.sqlite')
+    executor = jq.QueueExecutor(path, poll=0.05)
+    process = subprocess.Popen([sys.executable, '-c', 'import sys; sys.path.insert(0, sys.argv[1]); '
+                                'from pephire_supply import jobQueue as jq; '
+                                'jq.worker(sys.argv[2], lease=0.3, poll=0.05, idle_exit=1.0)',
+                                ROOT, path])
+    jobs = [python_job('import sys; sys.exit(4)', tmp_path),
+            python_job("import time; time.sleep(30); open('slow.txt', 'w').close()", tmp_path),
+            python_job("open('last.txt', 'w').close()", tmp_path)]
+    try:
+        with pytest.raises(subprocess.CalledProcessError):
+            executor.run(jobs)
+    finally:
+        t0 = time.time()
+        process.wait()
+    assert time.time() - t0 < 10  # The running job was stopped at its next heartbeat
+    queue = jq.JobQueue(path)
+    status = queue.status([1, 2, 3])  # The ids of the batch in a new queue
+    assert [status[job_id][0] for job_id in [1, 2, 3]] == ['failed', 'cancelled', 'cancelled']
+    assert queue.claim('late-worker') is None
+    assert not (tmp_path / 'slow.txt').exists() and not (tmp_path / 'last.txt').exists()
+    queue.close()
@@ -0,0 +1,56 @@
+import json
+import pytest
+from pephire_supply import ladderpath as lp
+from pephire_supply import laddergraphWriter as lw
+
+POOL = ['IIRNIARHLAQVGDSMDRSIP', 'PEIWIAQELRRIGDEFNAYYA', 'IERNIARHLARVGDEFDASYP',
+        'IIRNIARHLARVGDEFNAYYA', 'PEIWIAQELAQVGDSMDRSIP']
+
+@pytest.fixture(scope='module')
+def strMat():
+    return lp.ladderpath(POOL, CalPOM=True)
+
+def components(graph, ID):
+    return [(edge['source'], edge['count']) for edge in graph['edges'] if edge['target'] == ID]
+
+def test_every_node_is_made_of_its_components(strMat, tmp_path):
+    assert lw.writeLaddergraph(strMat, str(tmp_path / 'G.json'))[0] > len(POOL)
+    graph = json.loads((tmp_path / 'G.json').read_text())
+    nodes = {node['id']: node for node in graph['nodes']}
+    assert [nodes[k]['label'] for k in range(len(POOL))] == POOL
+    for ID, node in nodes.items():
+        if node['kind'] == 'letter':
+            assert node['level'] == 0 and ID < 0
+            continue
+        if 'alias' in node:
+            continue
+        # The copies of the ladderons and the letters left cover the node exactly, one level below it at most
+        parts = components(graph, ID)
+        assert sum(nodes[source]['length'] * count for source, count in parts) == node['length']
+        if node['kind'] == 'ladderon':
+            assert node['level'] == 1 + max(nodes[source]['level'] for source, _ in parts)
+
+def test_filters(strMat, tmp_path):
+    lw.writeLaddergraph(strMat, str(tmp_path / 'G.json'), showLetters=False, minLength=3)
+    graph = json.loads((tmp_path / 'G.json').read_text())
+    assert all(node['kind'] == 'target' or node['length'] >= 3 for node in graph['nodes'])
+    IDs = {node['id'] for node in graph['nodes']}
+    assert all(edge['source'] in IDs and edge['target'] in IDs for edge in graph['edges'])
+
+    lw.writeLaddergraph(strMat, str(tmp_path / 'root.json'), root=POOL[0])
+    graph = json.loads((tmp_path / 'root.json').read_text())
+    assert [node['label'] for node in graph['nodes'] if node['kind'] == 'target'] == [POOL[0]]
+    with pytest.raises(ValueError):
+        lw.writeLaddergraph(strMat, str(tmp_path / 'root.json'), root='WWWW')
+
+def test_dot_edges_with_and_without_aggregation(strMat, tmp_path):
+    nNodes, nEdges = lw.writeLaddergraph(strMat, str(tmp_path / 'G.dot'), aggregate=False)
+    lines = (tmp_path / 'G.dot').read_text().splitlines()
+    assert lines[0] == 'digraph Laddergraph {' and lines[-1] == '}'
+    assert sum('->' in line for line in lines) == nEdges
+    assert sum('[label=' in line and '->' not in line for line in lines) == nNodes
+
+    lw.writeLaddergraph(strMat, str(tmp_path / 'G.json'))
+    graph = json.loads((tmp_path / 'G.json').read_text())
+    assert sum(edge['count'] for edge in graph['edges']) == nEdges
+    assert lw.writeLaddergraph(strMat, str(tmp_path / 'A.dot')) == (nNodes, len(graph['edges']))
@@ -0,0 +1,50 @@
+import random
+import numpy as np
+import pytest
+from pephire_supply import ladderonSketch as ls
+
+def random_pool(n, length=21, seed=0):
+    # Peptides built from a few shared blocks, so that long k-mers repeat
+    rng = random.Random(seed)
+    blocks = [''.join(rng.choice('ACDEFGHIKLMNPQRSTVWY') for _ in range(7)) for _ in range(4)]
+    return [''.join(rng.choice(blocks) for _ in range(length // 7)) for _ in range(n)]
+
+def test_multiplicities_of_a_small_pool():
+    # ABC occurs 3 times: built once, copied twice; its letters are left with one free occurrence each
+    listLadderon, listMulti, LadderonAddress, _ = ls.sketchLadderons(['ABCABC', 'ABCXYZ'])
+    assert listLadderon == ['A', 'B', 'C', 'X', 'Y', 'Z', 'ABC']
+    assert listMulti == [1, 1, 1, 1, 1, 1, 2]
+    assert LadderonAddress['ABC'] == [0, 3]
+    assert LadderonAddress['X'] == [3]
+
+def test_sketch_matches_exact_counts_on_small_pools():
+    # Far fewer k-mers than 1/epsilon: every count of the sketch is exact
+    pool = random_pool(200) + random_pool(20, length=14, seed=1)
+    exact = ls.sketchLadderons(pool, maxLen=10, epsilon=0, chunk=64)
+    sketched = ls.sketchLadderons(pool, maxLen=10, chunk=64)
+    assert sketched[:3] == exact[:3]
+    assert all(bound == 0.0 for bound in exact[3].values())
+
+def test_addresses_are_the_positions_of_the_ladderons():
+    pool = random_pool(100)
+    listLadderon, listMulti, LadderonAddress, _ = ls.sketchLadderons(pool, maxLen=8, minSupport=2)
+    assert sorted(LadderonAddress) == sorted(listLadderon)
+    for ladderon, multi in zip(listLadderon, listMulti):
+        positions = {p for peptide in pool for p in range(len(peptide)) if peptide.startswith(ladderon, p)}
+        assert LadderonAddress[ladderon] == sorted(positions)
+        assert multi >= 1 and len(ladderon) <= 8
+        if len(ladderon) > 1:
+            assert sum(peptide.count(ladderon) for peptide in pool) >= 2
+
+def test_count_min_sketch_never_underestimates():
+    codes = np.random.default_rng(0).integers(0, 5000, size=20000, dtype=np.uint64)
+    sketch = ls.CountMinSketch(epsilon=0.01, delta=0.01)
+    sketch.add(codes)
+    values, counts = np.unique(codes, return_counts=True)
+    estimates = sketch.query(values)
+    assert (estimates >= counts).all()
+    assert (estimates - counts).max() <= 0.01 * sketch.total
+
+def test_only_uppercase_letters_are_encoded():
+    with pytest.raises(ValueError):
+        ls.encodePool(['ACDEf'])
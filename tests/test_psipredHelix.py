@@ -0,0 +1,22 @@
+import numpy as np
+from pephire_supply import psipredHelix as ph
+
+SORTED_HELIX = [(0, 'IIRNIARHLAQVGDSMDRSIP', 'CHHHHHHHHHHHHHHHHHHHC', 0.9),
+                (1, 'PEIWIAQELRRIGDEFNAYYA', 'CHHHHHHHHHHHHHHHHHHCC', 0.9),
+                (2, 'IEIWIARELRQIGDSFDAYYP', 'CHHHHHHHHHHHHHHHHHCCC', 0.8)]
+
+def test_select_diverse_takes_every_candidate_when_fewer_than_N():
+    chosen = ph.select_diverse([row[1] for row in SORTED_HELIX], [row[3] for row in SORTED_HELIX], 5)
+    assert sorted(chosen.tolist()) == [0, 1, 2]
+
+def test_helixpool_with_fewer_candidates_than_N():
+    np.random.seed(0)
+    for diversity in [0.0, 1.0]:
+        helixpool = ph.create_helixpool(0, 5, 'a', write_csv=False, diversity=diversity, sorted_helix=SORTED_HELIX)
+        assert sorted(helixpool) == sorted(row[1] for row in SORTED_HELIX)
+
+def test_helixpool_is_filled_with_the_next_highest_helix_percentage():
+    np.random.seed(0)
+    helixpool = ph.create_helixpool(0, 3, 'a', write_csv=False, sorted_helix=SORTED_HELIX + [
+        (3, 'PERWIAQELAQIGDEFDRSIP', 'CCCCCHHHHHHHHHHHHHCCC', 0.6)])
+    assert sorted(helixpool) == sorted(row[1] for row in SORTED_HELIX)
@@ -0,0 +1,24 @@
+import pytest
+import pephire
+from pephire_supply import runBudget as rb
+from pephire_supply import tracing as tr
+
+def test_resumed_run_continues_with_the_budget_left(tmp_path):
+    checkpoint_file = str(tmp_path / 'checkpoint.json')
+    budget = rb.RunBudget(seconds=100, hdock=10, psipred=50)
+    for _ in range(4):
+        tr.count_call(['hdock', 'rec.pdb', 'lig.pdb'])
+    tr.count_call(['runpsipred_single', 'pep.fasta'])
+    budget.t0 -= 30  # The first session ran for 30 s
+    pephire.save_checkpoint(checkpoint_file, {'iteration': 1, 'stages': []}, budget)
+
+    # The next session starts from the checkpoint, with the limits of the parameters
+    state = pephire.load_checkpoint(checkpoint_file)
+    resumed = rb.RunBudget(seconds=100, hdock=10, psipred=50, state=state['budget'])
+    remaining = resumed.remaining()
+    assert (remaining['hdock'], remaining['psipred']) == (6, 49)
+    assert remaining['seconds'] == pytest.approx(70, abs=1.0)
+
+    tr.count_call(['hdock', 'rec.pdb', 'lig.pdb'])
+    assert resumed.remaining()['hdock'] == 5
+    assert not resumed.exhausted()
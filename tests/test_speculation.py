@@ -0,0 +1,58 @@
+import os
+import sys
+import pytest
+from pephire_supply import speculation as spc
+from pephire_supply import tracing as tr
+from pephire_supply import runDatabase as rd
+from pephire_supply import sequenceIndex as si
+
+POOL = ['IIRNIARHLAQVGDSMDRSIP', 'PEIWIAQELRRIGDEFNAYYA']
+HELIXPOOL = ['IEIWIARELRQIGDSFDAYYP', 'PERWIAQELAQIGDEFDRSIP']
+
+@pytest.fixture
+def run_folder(tmp_path, monkeypatch):
+    # A stand-in for runpsipred_single, writing its outputs next to the working directory as the real one does
+    bin_folder = tmp_path / 'bin'
+    bin_folder.mkdir()
+    tool = bin_folder / 'runpsipred_single'
+    tool.write_text(f'#!{sys.executable}\nimport os, sys\n'
+                    "name = os.path.basename(sys.argv[1])[:-len('.fasta')]\n"
+                    "peptide = open(sys.argv[1]).read().split()[-1]\n"
+                    "for ext in ['.ss', '.ss2']:\n"
+                    "    open(name + ext, 'w').close()\n"
+                    "with open(name + '.horiz', 'w') as f:\n"
+                    "    f.write(f'# PSIPRED HFORMAT\\n\\nConf: 0\\nPred: {\"H\" * len(peptide)}\\n  AA: {peptide}\\n')\n")
+    tool.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{bin_folder}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('_external_app')
+    yield tmp_path
+    tr.disable()
+
+def test_discarded_speculation_leaves_the_trace_and_databases_unchanged(run_folder):
+    tr.enable(str(run_folder / 'trace.jsonl'))
+    with tr.span('generation', iteration=0):
+        pass
+    store = rd.RunDatabase(str(run_folder / 'results.sqlite'), 'a')
+    store.append('helixpool', [(0, j, p) for j, p in enumerate(HELIXPOOL)])
+    store.flush()
+    seen = si.SequenceIndex(str(run_folder / 'evaluated.sqlite'), 'a')
+    seen.add(POOL + HELIXPOOL, 0)
+    trace = (run_folder / 'trace.jsonl').read_text()
+    dump = list(store.conn.iterdump())
+
+    variants = spc.putBackVariants(POOL, HELIXPOOL, 1, 2)
+    speculation = spc.Speculation(1, variants, 5, 0.25 * 21, evaluated_db=str(run_folder / 'evaluated.sqlite'),
+                                  run='a', inherited=[store, seen])
+    for process in speculation.processes:
+        process.join()
+    assert [process.exitcode for process in speculation.processes] == [0, 0]
+    assert all(os.path.exists(os.path.join(folder, 'result.json')) for folder in speculation.folders)
+    speculation.discard()
+
+    assert (run_folder / 'trace.jsonl').read_text() == trace
+    # The connections of the run still work in the parent, on the same data
+    assert list(store.conn.iterdump()) == dump
+    assert len(seen) == len(POOL + HELIXPOOL)
+    store.close()
+    seen.close()
@@ -0,0 +1,29 @@
+from pephire_supply import surrogate as sg
+
+HELIXPOOL = ['IIRNIARHLAQVGDSMDRSIP', 'PEIWIAQELRRIGDEFNAYYA', 'IEIWIARELRQIGDSFDAYYP']
+
+def test_add_scores_skips_scores_of_the_coarse_tier():
+    scores = {
+        'Data_output/a_appendix/models0_0.pdb': {'2PQK': '-220.00', '3KJ2': '-210.00', 'score': '-215.000',
+                                                  'partial': False, 'fidelity': 'fine'},
+        'Data_output/a_appendix/models0_1.pdb': {'2PQK': '-180.00', '3KJ2': '-170.00', 'score': '-175.000',
+                                                  'partial': False, 'fidelity': 'coarse'},
+        'Data_output/a_appendix/models0_2.pdb': {'2PQK': '-230.00', '3KJ2': '-160.00', 'score': '-195.000',
+                                                  'partial': False, 'fidelity': 'mixed'},
+    }
+    model = sg.SurrogateModel()
+    model.add_scores('run:0', HELIXPOOL, scores)
+    assert sorted(model.stats) == ['2PQK', '3KJ2']
+    for XtX, Xty, sx, sy, n in model.stats.values():
+        assert n == 1
+    assert model.stats['2PQK'][3] == -220.0
+    assert model.stats['3KJ2'][3] == -210.0
+
+def test_add_scores_without_tiers_keeps_every_peptide():
+    scores = {f'Data_output/a_appendix/models0_{j}.pdb': {'2PQK': str(-200.0 - j), 'score': str(-200.0 - j)}
+              for j in range(len(HELIXPOOL))}
+    model = sg.SurrogateModel()
+    model.add_scores('run:0', HELIXPOOL, scores)
+    model.add_scores('run:0', HELIXPOOL, scores)  # Added once per key
+    assert model.stats['2PQK'][4] == 3
+    assert model.stats['2PQK'][3] == -603.0
@@ -0,0 +1,51 @@
+import json
+from pephire_supply import toolCache as tc
+from pephire_supply import tracing as tr
+
+PEPTIDE = 'IIRNIARHLAQVGDSMDRSIP'
+
+def test_outputs_are_copied_back_from_the_cache(tmp_path):
+    cache = tc.ToolCache(str(tmp_path / 'cache'))
+    sources = [tmp_path / 'peptide0_0.horiz', tmp_path / 'peptide0_0.ss2']
+    for source in sources:
+        source.write_text(f'{source.name} of {PEPTIDE}\n')
+    targets = [str(tmp_path / 'peptide1_3.horiz'), str(tmp_path / 'peptide1_3.ss2')]
+    assert not cache.fetch('psipred', PEPTIDE, ['.horiz', '.ss2'], targets)
+
+    cache.store('psipred', PEPTIDE, ['.horiz', '.ss2'], [str(source) for source in sources])
+    assert all(source.exists() for source in sources)  # Copied, not moved
+    assert cache.fetch('psipred', PEPTIDE, ['.horiz', '.ss2'], targets)
+    assert [open(target).read() for target in targets] == [source.read_text() for source in sources]
+    # Other tools and other peptides do not share the entry
+    assert not cache.fetch('modpep', PEPTIDE, ['.horiz', '.ss2'], targets)
+    assert not cache.fetch('psipred', PEPTIDE[::-1], ['.horiz', '.ss2'], targets)
+
+def test_an_incomplete_entry_is_a_miss(tmp_path):
+    cache = tc.ToolCache(str(tmp_path / 'cache'))
+    source = tmp_path / 'peptide0_0.horiz'
+    source.write_text('horiz\n')
+    cache.store('psipred', PEPTIDE, ['.horiz'], [str(source)])
+    assert not cache.fetch('psipred', PEPTIDE, ['.horiz', '.ss2'], [str(tmp_path / 'a.horiz'), str(tmp_path / 'a.ss2')])
+    assert not (tmp_path / 'a.horiz').exists()
+
+def test_docking_key_follows_the_content_of_the_receptor(tmp_path):
+    cache = tc.ToolCache(str(tmp_path / 'cache'))
+    receptor = tmp_path / '2PQK.pdb'
+    receptor.write_text('ATOM      1  N   MET A   1\n')
+    key = cache.receptor_key(PEPTIDE, str(receptor))
+    assert tc.ToolCache(str(tmp_path / 'cache')).receptor_key(PEPTIDE, str(receptor)) == key
+    receptor.write_text('ATOM      1  N   GLY A   1\n')
+    assert tc.ToolCache(str(tmp_path / 'cache')).receptor_key(PEPTIDE, str(receptor)) != key
+
+def test_hits_are_traced(tmp_path):
+    cache = tc.ToolCache(str(tmp_path / 'cache'))
+    source = tmp_path / 'models0_0.pdb'
+    source.write_text('MODEL\n')
+    cache.store('modpep', PEPTIDE, ['.pdb'], [str(source)])
+    tr.enable(str(tmp_path / 'trace.jsonl'))
+    try:
+        assert cache.fetch('modpep', PEPTIDE, ['.pdb'], [str(tmp_path / 'models1_0.pdb')])
+    finally:
+        tr.disable()
+    events = [json.loads(line) for line in (tmp_path / 'trace.jsonl').read_text().splitlines()]
+    assert [(event['name'], event['cat'], event['args']['key']) for event in events] == [('modpep', 'cache', PEPTIDE)]